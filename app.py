@@ -1,14 +1,37 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, has_request_context, make_response, Response
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import datetime as dt
 import os
+import sys
+import hmac
+import hashlib
+import base64
+import bisect
+import gzip
+import heapq
+import json
+import operator
+import random
+import re
+import zlib
 import logging
+import logging.handlers
+import socket
+import atexit
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from typing import Optional
 import time
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
-from sqlalchemy import text, and_
+from sqlalchemy import text, and_, case, event, false, func, insert, literal, literal_column, select, tuple_, update, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import validates, Session
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -41,6 +64,39 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 # Добавляем настройки для предотвращения кэширования
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
+# Журнал медленных запросов (порог в миллисекундах, 0 - выключено)
+app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 500))
+app.config['SLOW_QUERY_LOG_PATH'] = os.environ.get('SLOW_QUERY_LOG_PATH', os.path.join('logs', 'slow_queries.log'))
+app.config['SLOW_QUERY_LOG_MAX_BYTES'] = int(os.environ.get('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024))
+app.config['SLOW_QUERY_LOG_BACKUPS'] = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
+
+# Профилирование отдельных запросов (интервал выборки и срок жизни подписи X-Profile)
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 1))
+app.config['PROFILE_TOKEN_TTL'] = int(os.environ.get('PROFILE_TOKEN_TTL', 300))
+
+# Администраторы (логины через запятую)
+app.config['ADMIN_USERNAMES'] = {
+    name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()
+}
+
+# Помесячное секционирование food_entries (только PostgreSQL, по умолчанию выключено).
+# Срок хранения в месяцах: старые секции отсоединяются от таблицы (0 - не отсоединять)
+app.config['FOOD_ENTRIES_PARTITIONING'] = os.environ.get('FOOD_ENTRIES_PARTITIONING', '').lower() in ('1', 'true', 'yes')
+app.config['FOOD_ENTRIES_PARTITIONS_AHEAD'] = int(os.environ.get('FOOD_ENTRIES_PARTITIONS_AHEAD', 3))
+app.config['FOOD_ENTRIES_RETENTION_MONTHS'] = int(os.environ.get('FOOD_ENTRIES_RETENTION_MONTHS', 0))
+
+# Фоновые задачи: JOBS_IN_PROCESS=1 выполняет их в потоке веб-процесса (без отдельного worker.py)
+app.config['JOBS_IN_PROCESS'] = os.environ.get('JOBS_IN_PROCESS', '').lower() in ('1', 'true', 'yes')
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+
+# Отложенная запись быстрых добавлений (write-behind): по умолчанию выключена.
+# WRITE_BEHIND_ACK: flush - ответ после фиксации пачки, enqueue - сразу после постановки в очередь
+app.config['WRITE_BEHIND_ENABLED'] = os.environ.get('WRITE_BEHIND_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['WRITE_BEHIND_ACK'] = os.environ.get('WRITE_BEHIND_ACK', 'flush')
+app.config['WRITE_BEHIND_FLUSH_MS'] = int(os.environ.get('WRITE_BEHIND_FLUSH_MS', 200))
+app.config['WRITE_BEHIND_BATCH_ROWS'] = int(os.environ.get('WRITE_BEHIND_BATCH_ROWS', 100))
+app.config['WRITE_BEHIND_QUEUE_SIZE'] = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 2000))
+
 db = SQLAlchemy(app)
 
 # Функции для управления сессиями
@@ -53,6 +109,22 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def is_admin() -> bool:
+    """Текущий пользователь входит в ADMIN_USERNAMES"""
+    return 'user_id' in session and session.get('username') in app.config['ADMIN_USERNAMES']
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Для доступа к этой странице необходимо войти в систему.', 'warning')
+            return redirect(url_for('login'))
+        if not is_admin():
+            flash('Эта страница доступна только администраторам.', 'error')
+            return redirect(url_for('index'))
+        return f(*args, **kwargs)
+    return decorated_function
+
 def get_current_user():
     """Get current user from session"""
     user_id = session.get('user_id')
@@ -63,25 +135,310 @@ def get_current_user():
     return None
 
 
+# Журнал медленных запросов
+slow_query_logger = logging.getLogger('calckal.slow_queries')
+slow_query_logger.propagate = False
+_slow_query_handler_lock = threading.Lock()
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+_explain_pending = 0
+EXPLAIN_MAX_PENDING = 20
+EXPLAINABLE_PREFIXES = ('select', 'with', 'update', 'delete', 'insert')
+
+def get_slow_query_logger() -> logging.Logger:
+    """Логгер медленных запросов с ротацией файла (создаётся при первой записи)"""
+    if not slow_query_logger.handlers:
+        with _slow_query_handler_lock:
+            if not slow_query_logger.handlers:
+                log_path = app.config['SLOW_QUERY_LOG_PATH']
+                os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    log_path,
+                    maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+                    backupCount=app.config['SLOW_QUERY_LOG_BACKUPS'],
+                    encoding='utf-8'
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                slow_query_logger.addHandler(handler)
+                slow_query_logger.setLevel(logging.INFO)
+    return slow_query_logger
+
+def redact_value(value):
+    """Скрыть значение параметра, оставив только тип и длину строк"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return f'<str:{len(value)}>'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<bytes:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+def redact_query_params(parameters, executemany: bool = False):
+    """Параметры запроса в безопасном для журнала виде"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        first = redact_query_params(parameters[0]) if parameters else None
+        return {'rows': len(parameters), 'first': first}
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+def write_slow_query_record(record: dict):
+    try:
+        get_slow_query_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception as e:
+        logging.warning(f"Не удалось записать медленный запрос: {str(e)}")
+
+def capture_explain_plan(engine, statement: str, parameters, record: dict):
+    """Снять план EXPLAIN (ANALYZE off) в фоне и записать запись журнала"""
+    global _explain_pending
+    try:
+        with engine.connect() as conn:
+            conn.info['skip_slow_query_log'] = True
+            rows = conn.exec_driver_sql('EXPLAIN (ANALYZE off) ' + statement, parameters).fetchall()
+            record['plan'] = '\n'.join(row[0] for row in rows)
+            conn.rollback()
+    except Exception as e:
+        record['plan_error'] = str(e)
+    finally:
+        with _slow_query_handler_lock:
+            _explain_pending -= 1
+        write_slow_query_record(record)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def slow_query_before_execute(conn, cursor, statement, parameters, context, executemany):
+    # Время старта живет в контексте выполнения: упавший запрос не оставляет его в соединении
+    if context is not None:
+        context.slow_query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def slow_query_after_execute(conn, cursor, statement, parameters, context, executemany):
+    global _explain_pending
+    started = getattr(context, 'slow_query_started', None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    threshold = app.config['SLOW_QUERY_THRESHOLD_MS']
+    if threshold <= 0 or elapsed_ms < threshold or conn.info.get('skip_slow_query_log'):
+        return
+    
+    record = {
+        'id': uuid.uuid4().hex[:12],
+        'time': datetime.utcnow().isoformat(timespec='seconds'),
+        'duration_ms': round(elapsed_ms, 1),
+        'route': request.endpoint if has_request_context() else None,
+        'path': request.path if has_request_context() else None,
+        'statement': statement,
+        'params': redact_query_params(parameters, executemany),
+        'plan': None
+    }
+    
+    explainable = (conn.dialect.name == 'postgresql' and not executemany
+                   and statement.lstrip().lower().startswith(EXPLAINABLE_PREFIXES))
+    if explainable:
+        with _slow_query_handler_lock:
+            if _explain_pending < EXPLAIN_MAX_PENDING:
+                _explain_pending += 1
+            else:
+                explainable = False
+                record['plan_error'] = 'explain backlog is full'
+    if explainable:
+        _explain_executor.submit(capture_explain_plan, conn.engine, statement, parameters, record)
+    else:
+        write_slow_query_record(record)
+
+# Профилирование отдельного запроса
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FORMATS = ('speedscope', 'collapsed')
+
+def make_profile_token(path: str, timestamp: Optional[int] = None) -> str:
+    """Подписанное значение заголовка X-Profile для пути запроса"""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    signature = hmac.new(app.config['SECRET_KEY'].encode(), f'{timestamp}:{path}'.encode(), hashlib.sha256).hexdigest()
+    return f'{timestamp}.{signature}'
+
+def verify_profile_token(token: str, path: str) -> bool:
+    try:
+        timestamp_str, signature = token.split('.', 1)
+        timestamp = int(timestamp_str)
+    except ValueError:
+        return False
+    if abs(time.time() - timestamp) > app.config['PROFILE_TOKEN_TTL']:
+        return False
+    expected = make_profile_token(path, timestamp).split('.', 1)[1]
+    return hmac.compare_digest(expected, signature)
+
+class StackSampler:
+    """Выборочный профилировщик одного потока: раз в interval снимает его стек"""
+    
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = {}
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+    
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.finished_at = time.perf_counter()
+        return False
+    
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < 200:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = tuple(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self._stop.wait(self.interval)
+    
+    @staticmethod
+    def frame_label(frame) -> str:
+        name, filename, line = frame
+        return f'{name} ({os.path.basename(filename)}:{line})'
+    
+    def to_collapsed(self) -> str:
+        """Свернутые стеки в формате flamegraph.pl / speedscope"""
+        lines = [';'.join(self.frame_label(f) for f in stack) + f' {count}'
+                 for stack, count in sorted(self.samples.items())]
+        return '\n'.join(lines) + '\n'
+    
+    def to_speedscope(self, name: str) -> dict:
+        frames, frame_index = [], {}
+        samples, weights = [], []
+        interval_ms = self.interval * 1000
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(round(count * interval_ms, 3))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 3),
+                'samples': samples,
+                'weights': weights
+            }],
+            'name': name,
+            'exporter': 'calckal',
+            'activeProfileIndex': 0
+        }
+
+def profile_requested() -> bool:
+    """Запрос просит профилирование: подписанный X-Profile или ?profile=1 от администратора"""
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        return verify_profile_token(token, request.path)
+    return request.args.get('profile') == '1' and is_admin()
+
+def profiled_route(f):
+    """Профилирует GET-запрос к маршруту по требованию и отдает стеки файлом.
+    Обычные запросы проходят без профилировщика."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET' or (PROFILE_HEADER not in request.headers and 'profile' not in request.args):
+            return f(*args, **kwargs)
+        if not profile_requested():
+            return f(*args, **kwargs)
+        
+        output_format = request.headers.get('X-Profile-Format') or request.args.get('profile_format', 'speedscope')
+        if output_format not in PROFILE_FORMATS:
+            output_format = 'speedscope'
+        
+        interval = app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000
+        with StackSampler(threading.get_ident(), interval) as sampler:
+            view_response = make_response(f(*args, **kwargs))
+        
+        elapsed_ms = (sampler.finished_at - sampler.started_at) * 1000
+        profile_name = f'{request.endpoint} {request.full_path}'
+        stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        logging.info(f"Профиль запроса {profile_name}: {elapsed_ms:.1f} мс, {sum(sampler.samples.values())} выборок")
+        
+        if output_format == 'collapsed':
+            body = sampler.to_collapsed()
+            mimetype = 'text/plain'
+            filename = f'profile-{request.endpoint}-{stamp}.collapsed.txt'
+        else:
+            body = json.dumps(sampler.to_speedscope(profile_name), ensure_ascii=False)
+            mimetype = 'application/json'
+            filename = f'profile-{request.endpoint}-{stamp}.speedscope.json'
+        
+        response = Response(body, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.headers['X-Profile-Duration-Ms'] = f'{elapsed_ms:.1f}'
+        response.headers['X-Profile-Status'] = str(view_response.status_code)
+        return response
+    return decorated_function
+
+def read_slow_query_log(limit: int = 200) -> list:
+    """Последние записи журнала медленных запросов, новые первыми"""
+    log_path = app.config['SLOW_QUERY_LOG_PATH']
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, encoding='utf-8') as log_file:
+        lines = deque(log_file, maxlen=limit)
+    records = []
+    for line in reversed(lines):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
 # Функции для системы уровней
-def get_or_create_user_level(user_id: int) -> 'UserLevel':
+def get_or_create_user_level(user_id: int, commit: bool = True) -> 'UserLevel':
     """Получить или создать запись об уровне пользователя"""
     user_level = UserLevel.query.filter_by(user_id=user_id).first()
     if not user_level:
         user_level = UserLevel(user_id=user_id)
         db.session.add(user_level)
-        db.session.commit()
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
         logging.info(f"Created new level record for user {user_id}")
     return user_level
 
-def award_experience(user_id: int, points: int, activity_type: str, description: str = '') -> dict:
-    """Наградить пользователя опытом"""
+def award_experience(user_id: int, points: int, activity_type: str, description: str = '',
+                     count: int = 1, commit: bool = True) -> dict:
+    """Наградить пользователя опытом.
+    
+    count - число действий (например, записей дневника), commit=False - фиксирует вызывающий код
+    вместе со своими изменениями.
+    """
     try:
-        user_level = get_or_create_user_level(user_id)
+        user_level = get_or_create_user_level(user_id, commit=commit)
         old_level = user_level.level
         
-        new_level = user_level.add_experience(points, activity_type)
-        db.session.commit()
+        new_level = user_level.add_experience(points, activity_type, count)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
         
         result = {
             'success': True,
@@ -102,6 +459,31 @@ def award_experience(user_id: int, points: int, activity_type: str, description:
         logging.error(f"Error awarding experience to user {user_id}: {str(e)}")
         return {'success': False, 'error': str(e)}
 
+def calculate_target_calories(gender: str, weight: float, height: float, age: int, activity_level: str, goal: str) -> int:
+    """Целевые калории по формуле Миффлина-Сан Жеора с учетом активности и цели"""
+    if gender == 'male':
+        bmr = 10 * weight + 6.25 * height - 5 * age + 5
+    else:
+        bmr = 10 * weight + 6.25 * height - 5 * age - 161
+    
+    # Коэффициенты активности
+    activity_multipliers = {
+        'sedentary': 1.2,
+        'light': 1.375,
+        'moderate': 1.55,
+        'active': 1.725,
+        'very_active': 1.9
+    }
+    
+    tdee = bmr * activity_multipliers.get(activity_level, 1.2)
+    
+    # Корректировка по цели
+    if goal == 'lose':
+        return int(tdee - 500)  # дефицит 500 ккал
+    elif goal == 'gain':
+        return int(tdee + 500)  # профицит 500 ккал
+    return int(tdee)
+
 def check_achievements(user_level: 'UserLevel'):
     """Проверить и выдать достижения"""
     new_achievements = []
@@ -171,6 +553,18 @@ class User(db.Model):
     
     def __repr__(self):
         return f'<User {self.username}>'
+
+class Category(db.Model):
+    __tablename__ = 'categories'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    product_count = db.Column(db.Integer, nullable=False, default=0)  # поддерживается событиями Product
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Category {self.name}>'
+
 class Product(db.Model):
     __tablename__ = 'products'
     
@@ -180,8 +574,12 @@ class Product(db.Model):
     protein = db.Column(db.Float, default=0)
     carbs = db.Column(db.Float, default=0)
     fat = db.Column(db.Float, default=0)
-    category = db.Column(db.String(50), default='Прочее')
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    name_key = db.Column(db.String(32))  # md5 нормализованного названия, уникален (см. MANAGED_INDEXES)
+    
+    # Строковая колонка products.category осталась в старых БД только как источник для миграции
+    category_ref = db.relationship('Category', lazy='selectin')
     
     def __init__(self, name: str, calories_per_100g: float, protein: float = 0, carbs: float = 0, fat: float = 0, category: str = 'Прочее', **kwargs):
         super().__init__(**kwargs)
@@ -192,9 +590,105 @@ class Product(db.Model):
         self.fat = fat
         self.category = category
     
+    @validates('name')
+    def _update_name_key(self, key, value):
+        self.name_key = product_name_key(value)
+        return value
+    
+    @property
+    def category(self) -> str:
+        pending = getattr(self, '_category_name', None)
+        if pending is not None:
+            return pending
+        return self.category_ref.name if self.category_ref else DEFAULT_CATEGORY
+    
+    @category.setter
+    def category(self, name: str):
+        # Без запросов: категория по названию подставляется перед flush (resolve_pending_categories)
+        self._category_name = (name or '').strip() or DEFAULT_CATEGORY
+        if sa_inspect(self).persistent:
+            self.category_ref = self.category_ref  # попадает в session.dirty
+    
     def __repr__(self):
         return f'<Product {self.name}>'
 
+DEFAULT_CATEGORY = 'Прочее'
+_category_ids = {}  # название -> id; проверяется при каждом обращении, поэтому переименования безопасны
+
+def get_category(name: str) -> Optional[Category]:
+    name = (name or '').strip() or DEFAULT_CATEGORY
+    category_id = _category_ids.get(name)
+    category = db.session.get(Category, category_id) if category_id else None
+    if category is None or category.name != name:
+        category = Category.query.filter_by(name=name).first()
+        if category is None:
+            _category_ids.pop(name, None)
+            return None
+        _category_ids[name] = category.id
+    return category
+
+def get_or_create_category(name: str) -> Category:
+    category = get_category(name)
+    if category is None:
+        category = Category(name=(name or '').strip() or DEFAULT_CATEGORY, product_count=0)
+        db.session.add(category)
+        db.session.flush()
+        _category_ids[category.name] = category.id
+    return category
+
+@event.listens_for(Session, 'before_flush')
+def resolve_pending_categories(session, flush_context, instances):
+    """Категории продуктов, заданные названием, ищутся одним запросом на flush; недостающие создаются"""
+    pending = [obj for obj in list(session.new) + list(session.dirty)
+               if isinstance(obj, Product) and getattr(obj, '_category_name', None) is not None]
+    if not pending:
+        return
+    names = {obj._category_name for obj in pending}
+    categories = {category.name: category for category in session.new if isinstance(category, Category)}
+    missing = names - categories.keys()
+    if missing:
+        categories.update((category.name, category) for category in session.scalars(
+            select(Category).where(Category.name.in_(missing))
+        ))
+    for obj in pending:
+        name = obj._category_name
+        if name not in categories:
+            categories[name] = Category(name=name, product_count=0)
+            session.add(categories[name])
+        obj.category_ref = categories[name]
+        del obj._category_name
+
+def _change_category_count(connection, category_id, delta: int):
+    if category_id is not None and delta:
+        connection.execute(
+            Category.__table__.update().where(Category.__table__.c.id == category_id)
+            .values(product_count=Category.__table__.c.product_count + delta)
+        )
+
+@event.listens_for(Product, 'after_insert')
+def count_inserted_product(mapper, connection, target):
+    _change_category_count(connection, target.category_id, 1)
+
+@event.listens_for(Product, 'after_delete')
+def count_deleted_product(mapper, connection, target):
+    _change_category_count(connection, target.category_id, -1)
+
+@event.listens_for(Product, 'after_update')
+def count_moved_product(mapper, connection, target):
+    history = sa_inspect(target).attrs.category_id.history
+    if history.has_changes():
+        for old_id in history.deleted or ():
+            _change_category_count(connection, old_id, -1)
+        for new_id in history.added or ():
+            _change_category_count(connection, new_id, 1)
+
+def normalize_product_name(name: str) -> str:
+    """Нормализованное название: регистр, пробелы и ё не различаются"""
+    return ' '.join((name or '').lower().replace('ё', 'е').split())
+
+def product_name_key(name: str) -> str:
+    return hashlib.md5(normalize_product_name(name).encode('utf-8')).hexdigest()
+
 class FoodEntry(db.Model):
     __tablename__ = 'food_entries'
     
@@ -205,6 +699,11 @@ class FoodEntry(db.Model):
     date = db.Column(db.Date, nullable=False, default=dt.date.today)
     meal_type = db.Column(db.String(20), nullable=False)  # завтрак, обед, ужин, перекус
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Снимок КБЖУ на момент добавления: правка продукта или слияние дубликатов не меняет историю
+    calories = db.Column(db.Float)
+    protein = db.Column(db.Float)
+    carbs = db.Column(db.Float)
+    fat = db.Column(db.Float)
     
     product = db.relationship('Product', backref=db.backref('entries', lazy=True))
     
@@ -217,21 +716,74 @@ class FoodEntry(db.Model):
         if date is not None:
             self.date = date
     
+    # Продукт загружается только для строк, которые фоновая задача еще не заполнила
     @property
     def total_calories(self):
+        if self.calories is not None:
+            return self.calories
         return (self.product.calories_per_100g * self.weight) / 100
     
     @property
     def total_protein(self):
-        return (self.product.protein * self.weight) / 100
+        if self.protein is not None:
+            return self.protein
+        return ((self.product.protein or 0) * self.weight) / 100
     
     @property
     def total_carbs(self):
-        return (self.product.carbs * self.weight) / 100
+        if self.carbs is not None:
+            return self.carbs
+        return ((self.product.carbs or 0) * self.weight) / 100
     
     @property
     def total_fat(self):
-        return (self.product.fat * self.weight) / 100
+        if self.fat is not None:
+            return self.fat
+        return ((self.product.fat or 0) * self.weight) / 100
+
+# Колонка снимка записи -> колонка продукта на 100 г
+ENTRY_NUTRIENTS = {'calories': 'calories_per_100g', 'protein': 'protein', 'carbs': 'carbs', 'fat': 'fat'}
+
+def entry_nutrients(product, weight: float) -> dict:
+    """Снимок КБЖУ записи по продукту (модель или строка select с теми же полями) и весу"""
+    return {column: (getattr(product, source) or 0) * weight / 100 for column, source in ENTRY_NUTRIENTS.items()}
+
+class MealTemplate(db.Model):
+    """Сохраненный прием пищи пользователя, который добавляется в дневник одним действием"""
+    __tablename__ = 'meal_templates'
+    __table_args__ = (db.UniqueConstraint('user_id', 'name', name='uq_meal_templates_user_name'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    meal_type = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    items = db.relationship('MealTemplateItem', backref='template', lazy=True, cascade='all, delete-orphan')
+
+class MealTemplateItem(db.Model):
+    """Продукт шаблона с весом и снимком КБЖУ исходной записи"""
+    __tablename__ = 'meal_template_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('meal_templates.id', ondelete='CASCADE'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    weight = db.Column(db.Float, nullable=False)
+    calories = db.Column(db.Float)
+    protein = db.Column(db.Float)
+    carbs = db.Column(db.Float)
+    fat = db.Column(db.Float)
+
+class UserProductStat(db.Model):
+    """Как часто и как давно пользователь добавлял продукт (см. record_product_usage)"""
+    __tablename__ = 'user_product_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False, default=0)  # сумма 2^(t / период полураспада) по добавлениям
+    uses = db.Column(db.Integer, nullable=False, default=0)
+    last_weight = db.Column(db.Float)
+    last_used_at = db.Column(db.DateTime, index=True)
 
 class UserProfile(db.Model):
     __tablename__ = 'user_profile'
@@ -316,8 +868,8 @@ class UserLevel(db.Model):
         else:
             return "🌱 Новичок"
     
-    def add_experience(self, points: int, activity_type: str):
-        """Добавить опыт и проверить повышение уровня"""
+    def add_experience(self, points: int, activity_type: str, count: int = 1):
+        """Добавить опыт и проверить повышение уровня (count - число действий за раз)"""
         self.experience += points
         
         # Проверяем повышение уровня
@@ -327,9 +879,9 @@ class UserLevel(db.Model):
         # Обновляем статистику активности
         today = dt.date.today()
         if activity_type == 'food_entry':
-            self.total_food_entries += 1
+            self.total_food_entries += count
         elif activity_type == 'product_added':
-            self.total_products_added += 1
+            self.total_products_added += count
         
         # Обновляем дни активности
         if self.last_activity_date != today:
@@ -363,109 +915,1656 @@ class UserLevel(db.Model):
             return True
         return False
 
-# Добавляем мидлвар для обеспечения свежих данных
-@app.before_request
-def refresh_database_session():
-    """Рефреш базы данных сессия перед каждым запросом для обеспечения свежих данных"""
+class IdempotencyKey(db.Model):
+    """Ответ на запрос с ключом идемпотентности: повтор того же запроса получает сохраненный ответ"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)  # NULL - запрос еще выполняется
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(500))
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT = 60  # секунд; незавершенный дольше запрос считается брошенным
+IDEMPOTENCY_PURGE_INTERVAL = 3600
+_idempotency_purged_at = 0.0
+
+def purge_idempotency_keys(ttl_hours: int = IDEMPOTENCY_KEY_TTL_HOURS) -> int:
+    """Удаляет ключи старше TTL (по индексу created_at)"""
+    cutoff = datetime.utcnow() - dt.timedelta(hours=ttl_hours)
+    removed = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    if removed:
+        logging.info(f"Удалено устаревших ключей идемпотентности: {removed}")
+    return removed
+
+def maybe_purge_idempotency_keys():
+    """Очистка не чаще раза в IDEMPOTENCY_PURGE_INTERVAL секунд на процесс"""
+    global _idempotency_purged_at
+    if time.time() - _idempotency_purged_at < IDEMPOTENCY_PURGE_INTERVAL:
+        return
+    _idempotency_purged_at = time.time()
     try:
-        db.session.expire_all()
+        purge_idempotency_keys()
     except Exception as e:
-        logging.warning(f"Ошибка обновления базы данных сессия: {str(e)}")
+        logging.error(f"Error purging idempotency_keys: {str(e)}")
+        db.session.rollback()
 
-@app.after_request
-def add_cache_headers(response):
-    """Добавить cache-control заголовки для предотвращения кэширования динамических данных"""
-    if request.endpoint in ['index', 'products', 'add_food', 'profile', 'statistics']:
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+def idempotency_rejection(message: str, status: int):
+    """Отказ в формате маршрута: JSON для API, flash и редирект для форм"""
+    if request.is_json:
+        return jsonify({'success': False, 'message': message}), status
+    flash(message, 'warning')
+    return redirect(url_for('index'))
+
+def replay_idempotent_response(stored: IdempotencyKey):
+    if stored.location:
+        if not request.is_json:
+            flash('Эта форма уже была отправлена, записи добавлены ранее.', 'info')
+        response = redirect(stored.location, code=stored.status_code)
+    else:
+        response = Response(stored.response_body or '', status=stored.status_code, content_type=stored.content_type)
+    response.headers['Idempotent-Replayed'] = 'true'
     return response
 
-# Инициализация базы данных при импорте модуля (для gunicorn)
-def init_database():
-    """Initialize database tables and default data"""
+def idempotent(f):
+    """Запись с ключом Idempotency-Key (заголовок) или idempotency_key (скрытое поле формы) выполняется один раз.
+    
+    Первый запрос занимает ключ строкой idempotency_keys, выполняется и сохраняет ответ; повтор с тем же ключом
+    получает сохраненный ответ без повторной вставки и начисления опыта. Ключ с другим телом запроса - 422,
+    повтор, пока первый запрос еще выполняется, - 409. Ответы 5xx не сохраняются, чтобы запрос можно было повторить.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'POST' or 'user_id' not in session:
+            return f(*args, **kwargs)
+        # Тело читается до разбора формы, чтобы оно осталось доступно для хэша
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return idempotency_rejection('Слишком длинный ключ идемпотентности', 400)
+        
+        maybe_purge_idempotency_keys()
+        user_id = session['user_id']
+        stored = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if stored is not None:
+            age = (datetime.utcnow() - stored.created_at).total_seconds()
+            if age > IDEMPOTENCY_KEY_TTL_HOURS * 3600 or (stored.status_code is None and age > IDEMPOTENCY_IN_FLIGHT_TIMEOUT):
+                db.session.delete(stored)
+                db.session.commit()
+            elif stored.endpoint != request.endpoint or stored.request_hash != request_hash:
+                return idempotency_rejection('Ключ идемпотентности уже использован для другого запроса', 422)
+            elif stored.status_code is None:
+                return idempotency_rejection('Запрос с этим ключом еще выполняется', 409)
+            else:
+                logging.info(f"Повтор запроса {request.endpoint} с ключом {key}: возвращен сохраненный ответ")
+                return replay_idempotent_response(stored)
+        
+        # Ключ занимается до выполнения: параллельный дубль упрется в уникальный индекс
+        claim = IdempotencyKey(user_id=user_id, key=key, endpoint=request.endpoint, request_hash=request_hash)
+        db.session.add(claim)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return idempotency_rejection('Запрос с этим ключом еще выполняется', 409)
+        claim_id = claim.id
+        
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            IdempotencyKey.query.filter_by(id=claim_id).delete(synchronize_session=False)
+            db.session.commit()
+            raise
+        
+        if response.status_code >= 500:
+            IdempotencyKey.query.filter_by(id=claim_id).delete(synchronize_session=False)
+        else:
+            is_redirect = 300 <= response.status_code < 400
+            IdempotencyKey.query.filter_by(id=claim_id).update({
+                'status_code': response.status_code,
+                'content_type': response.content_type,
+                'location': response.headers.get('Location') if is_redirect else None,
+                'response_body': None if is_redirect else response.get_data(as_text=True),
+            }, synchronize_session=False)
+        db.session.commit()
+        return response
+    return decorated_function
+
+class Job(db.Model):
+    """Фоновая задача: тяжелые административные операции выполняются воркером, а не в запросе"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    params = db.Column(db.Text)  # JSON
+    progress = db.Column(db.Integer)  # проценты, если задача умеет их считать
+    message = db.Column(db.Text)  # последний отчет о ходе выполнения
+    result = db.Column(db.Text)  # JSON результата
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_by = db.Column(db.String(80))
+    locked_by = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+JOB_HANDLERS = {}
+JOB_STALE_SECONDS = 600  # задача без отчета дольше этого считается брошенной (воркер упал)
+JOB_MAX_ATTEMPTS = 3
+JOB_ACTIVE_STATUSES = ('queued', 'running')
+
+def job_handler(kind: str):
+    """Регистрирует обработчик задачи: handler(report, **params) -> dict с 'message' и 'category'"""
+    def register(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return register
+
+def enqueue_job(kind: str, params: Optional[dict] = None, created_by: Optional[str] = None) -> 'Job':
+    """Ставит задачу в очередь; если такая же уже ждет или выполняется, возвращает ее"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Неизвестная задача: {kind}')
+    payload = json.dumps(params or {}, sort_keys=True)
+    job = Job.query.filter(Job.kind == kind, Job.params == payload, Job.status.in_(JOB_ACTIVE_STATUSES)).first()
+    if job is None:
+        job = Job(kind=kind, params=payload, status='queued', created_by=created_by)
+        db.session.add(job)
+        db.session.commit()
+        logging.info(f"Задача #{job.id} ({kind}) поставлена в очередь")
+    if app.config['JOBS_IN_PROCESS']:
+        start_in_process_worker()
+    return job
+
+def claim_next_job(worker_id: str) -> Optional[int]:
+    """Забирает самую старую задачу из очереди.
+    
+    На PostgreSQL строка выбирается с FOR UPDATE SKIP LOCKED, поэтому воркеры не ждут друг друга
+    и не берут одну задачу дважды. На SQLite FOR UPDATE не поддерживается, но запись в базу
+    сериализована, и повторная проверка status = 'queued' в UPDATE дает тот же результат.
+    """
+    now = datetime.utcnow()
+    candidate = (select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(1)
+                 .with_for_update(skip_locked=True).scalar_subquery())
+    job_id = db.session.execute(
+        update(Job).where(Job.id == candidate, Job.status == 'queued')
+        .values(status='running', locked_by=worker_id, attempts=Job.attempts + 1, started_at=now, heartbeat_at=now)
+        .returning(Job.id)
+    ).scalar()
+    db.session.commit()
+    return job_id
+
+def requeue_stale_jobs() -> int:
+    """Возвращает в очередь задачи упавших воркеров; после JOB_MAX_ATTEMPTS попыток задача считается проваленной"""
+    cutoff = datetime.utcnow() - dt.timedelta(seconds=JOB_STALE_SECONDS)
+    stale = and_(Job.status == 'running', Job.heartbeat_at < cutoff)
+    failed = db.session.execute(
+        update(Job).where(stale, Job.attempts >= JOB_MAX_ATTEMPTS)
+        .values(status='failed', error='Воркер перестал отвечать', finished_at=datetime.utcnow())
+    ).rowcount
+    requeued = db.session.execute(
+        update(Job).where(stale).values(status='queued', locked_by=None)
+    ).rowcount
+    db.session.commit()
+    if failed or requeued:
+        logging.warning(f"Зависшие задачи: возвращено в очередь {requeued}, провалено {failed}")
+    return requeued
+
+def run_job(job_id: int) -> bool:
+    """Выполняет задачу и сохраняет результат или ошибку"""
+    job = db.session.get(Job, job_id)
+    handler = JOB_HANDLERS.get(job.kind)
+    
+    def report(progress: Optional[int] = None, message: str = ''):
+        # Фиксирует и текущую транзакцию обработчика: вызывать между пакетами
+        values = {'heartbeat_at': datetime.utcnow(), 'message': message}
+        if progress is not None:
+            values['progress'] = progress
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+    
+    started = time.perf_counter()
     try:
-        with app.app_context():
-            logging.info("Starting database initialization...")
-            
-            # Создаем все таблицы
-            db.create_all()
-            logging.info("Database tables created successfully")
-            
-            # Проверяем, что таблицы действительно созданы
-            from sqlalchemy import text
-            result = db.session.execute(text(
-                "SELECT table_name FROM information_schema.tables WHERE table_schema='public'"
-            ))
-            tables = [row[0] for row in result]
-            logging.info(f"Created tables: {tables}")
-            
-            # Добавляем все продукты автоматически
-            auto_load_all_products()
-            
-            # Инициализируем систему уровней для существующих пользователей
-            init_user_levels_for_existing_users()
-            
+        if handler is None:
+            raise ValueError(f'Неизвестная задача: {job.kind}')
+        result = handler(report, **json.loads(job.params or '{}')) or {}
+        db.session.commit()
+        values = {'status': 'done', 'progress': 100, 'message': result.get('message', ''),
+                  'result': json.dumps(result, ensure_ascii=False, default=str)}
+        logging.info(f"Задача #{job_id} ({job.kind}) выполнена за {time.perf_counter() - started:.1f} с")
     except Exception as e:
-        logging.error(f"Error initializing database: {str(e)}")
-        # Не поднимаем исключение, чтобы приложение продолжило работать
+        db.session.rollback()
+        logging.error(f"Задача #{job_id} завершилась ошибкой: {str(e)}")
+        values = {'status': 'failed', 'error': str(e)}
+    db.session.execute(update(Job).where(Job.id == job_id).values(finished_at=datetime.utcnow(), **values))
+    db.session.commit()
+    return values['status'] == 'done'
 
-def auto_load_all_products():
-    """Автоматически загружает все доступные продукты при инициализации"""
-    try:
-        current_count = Product.query.count()
-        logging.info(f"Current product count: {current_count}")
-        
-        if current_count == 0:
-            logging.info("Loading initial products...")
-            
-            # Базовые продукты
-            default_products = [
-                    # Хлебобулочные изделия
-                    Product(name="Хлеб белый", calories_per_100g=265, protein=8.1, carbs=48.8, fat=3.2, category="Хлебобулочные"),
-                    Product(name="Хлеб черный", calories_per_100g=214, protein=6.6, carbs=40.7, fat=1.3, category="Хлебобулочные"),
-                    Product(name="Хлеб ржаной", calories_per_100g=181, protein=6.6, carbs=34.2, fat=1.2, category="Хлебобулочные"),
-                    Product(name="Батон нарезной", calories_per_100g=264, protein=7.5, carbs=50.9, fat=2.9, category="Хлебобулочные"),
-                    Product(name="Булочка с маком", calories_per_100g=336, protein=7.8, carbs=55.5, fat=9.9, category="Хлебобулочные"),
-                    Product(name="Круассан", calories_per_100g=406, protein=8.2, carbs=45.8, fat=20.9, category="Хлебобулочные"),
-                    Product(name="Багет", calories_per_100g=262, protein=8.1, carbs=51.4, fat=3.3, category="Хлебобулочные"),
-                    Product(name="Лаваш тонкий", calories_per_100g=236, protein=7.9, carbs=47.6, fat=1.2, category="Хлебобулочные"),
-                    Product(name="Тортилья", calories_per_100g=218, protein=5.7, carbs=43.2, fat=2.9, category="Хлебобулочные"),
-                    Product(name="Сухари панировочные", calories_per_100g=347, protein=11.2, carbs=72.1, fat=1.8, category="Хлебобулочные"),
+def work_jobs(worker_id: str, stop: threading.Event, poll_interval: float, exit_when_idle: bool = False) -> int:
+    """Цикл воркера: берет задачи по одной, между ними выполняет периодическое обслуживание"""
+    processed = 0
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                requeue_stale_jobs()
+                job_id = claim_next_job(worker_id)
+                if job_id is not None:
+                    run_job(job_id)
+                    processed += 1
+                maybe_compact_product_changes()
+                maybe_purge_idempotency_keys()
+                maybe_prune_product_stats()
+                maybe_maintain_food_entry_partitions()
+            except Exception as e:
+                logging.error(f"Ошибка воркера задач: {str(e)}")
+                db.session.rollback()
+                job_id = None
+            finally:
+                db.session.remove()
+        if job_id is None:
+            if exit_when_idle:
+                break
+            stop.wait(poll_interval)
+    return processed
 
-                    # Молочные продукты
-                    Product(name="Молоко 3.2%", calories_per_100g=60, protein=2.9, carbs=4.7, fat=3.2, category="Молочные"),
-                    Product(name="Молоко 2.5%", calories_per_100g=54, protein=2.8, carbs=4.7, fat=2.5, category="Молочные"),
-                    Product(name="Молоко 1.5%", calories_per_100g=47, protein=3.0, carbs=4.9, fat=1.5, category="Молочные"),
-                    Product(name="Молоко обезжиренное", calories_per_100g=35, protein=3.4, carbs=5.0, fat=0.1, category="Молочные"),
-                    Product(name="Сливки 10%", calories_per_100g=118, protein=3.0, carbs=4.0, fat=10.0, category="Молочные"),
-                    Product(name="Сливки 20%", calories_per_100g=206, protein=2.8, carbs=3.7, fat=20.0, category="Молочные"),
-                    Product(name="Сметана 15%", calories_per_100g=158, protein=2.6, carbs=3.0, fat=15.0, category="Молочные"),
-                    Product(name="Сметана 20%", calories_per_100g=206, protein=2.8, carbs=3.2, fat=20.0, category="Молочные"),
-                    Product(name="Творог 0%", calories_per_100g=88, protein=16.7, carbs=1.3, fat=0.6, category="Молочные"),
-                    Product(name="Творог 5%", calories_per_100g=121, protein=17.2, carbs=1.8, fat=5.0, category="Молочные"),
-                    Product(name="Творог 9%", calories_per_100g=159, protein=16.7, carbs=2.0, fat=9.0, category="Молочные"),
-                    Product(name="Йогурт натуральный", calories_per_100g=66, protein=5.0, carbs=3.5, fat=3.2, category="Молочные"),
-                    Product(name="Кефир 1%", calories_per_100g=40, protein=2.8, carbs=4.0, fat=1.0, category="Молочные"),
-                    Product(name="Кефир 2.5%", calories_per_100g=53, protein=2.8, carbs=4.0, fat=2.5, category="Молочные"),
-                    Product(name="Ряженка 4%", calories_per_100g=67, protein=2.9, carbs=4.2, fat=4.0, category="Молочные"),
-                    Product(name="Простокваша", calories_per_100g=58, protein=2.9, carbs=4.1, fat=3.2, category="Молочные"),
+def job_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
 
-                    # Сыры
-                    Product(name="Сыр российский", calories_per_100g=364, protein=23.2, carbs=0.3, fat=29.5, category="Сыры"),
-                    Product(name="Сыр голландский", calories_per_100g=352, protein=26.8, carbs=0.0, fat=26.8, category="Сыры"),
-                    Product(name="Сыр швейцарский", calories_per_100g=396, protein=24.9, carbs=0.0, fat=31.8, category="Сыры"),
-                    Product(name="Сыр моцарелла", calories_per_100g=280, protein=22.2, carbs=2.2, fat=22.4, category="Сыры"),
-                    Product(name="Сыр пармезан", calories_per_100g=431, protein=38.0, carbs=1.0, fat=29.0, category="Сыры"),
-                    Product(name="Сыр фета", calories_per_100g=264, protein=14.2, carbs=4.1, fat=21.3, category="Сыры"),
-                    Product(name="Сыр чеддер", calories_per_100g=402, protein=25.0, carbs=1.3, fat=33.1, category="Сыры"),
-                    Product(name="Сыр камамбер", calories_per_100g=299, protein=19.8, carbs=0.5, fat=24.3, category="Сыры"),
-                    Product(name="Сыр творожный", calories_per_100g=342, protein=22.6, carbs=4.1, fat=26.2, category="Сыры"),
-                    Product(name="Сыр плавленый", calories_per_100g=257, protein=16.8, carbs=23.8, fat=11.2, category="Сыры"),
+_in_process_worker = None
+_in_process_worker_lock = threading.Lock()
 
-                    # Мясо и птица
-                    Product(name="Говядина постная", calories_per_100g=158, protein=22.2, carbs=0.0, fat=7.1, category="Мясо и птица"),
-                    Product(name="Свинина постная", calories_per_100g=142, protein=20.9, carbs=0.0, fat=6.1, category="Мясо и птица"),
+def start_in_process_worker():
+    """Поток, который разбирает очередь внутри веб-процесса и завершается, когда она пуста"""
+    global _in_process_worker
+    with _in_process_worker_lock:
+        if _in_process_worker is not None and _in_process_worker.is_alive():
+            return
+        _in_process_worker = threading.Thread(
+            target=work_jobs, args=(job_worker_id(), threading.Event(), app.config['JOB_POLL_INTERVAL'], True),
+            name='job-worker', daemon=True
+        )
+        _in_process_worker.start()
+
+def enqueue_job_and_redirect(kind: str, endpoint: str):
+    """Общий ответ тяжелых маршрутов: задача ставится в очередь, пользователь сразу возвращается на страницу"""
+    try:
+        job = enqueue_job(kind, created_by=session.get('username'))
+        flash(f'Задача #{job.id} поставлена в очередь, статус: {url_for("job_status", job_id=job.id)}', 'info')
+    except Exception as e:
+        logging.error(f"Не удалось поставить задачу {kind} в очередь: {str(e)}")
+        db.session.rollback()
+        flash(f'Ошибка: {str(e)}', 'error')
+    return redirect(url_for(endpoint))
+
+class BatchCheckpoint(db.Model):
+    """Прогресс пакетных задач: позволяет продолжить прерванную обработку с места остановки"""
+    __tablename__ = 'batch_checkpoints'
+    
+    job = db.Column(db.String(100), primary_key=True)
+    cursor = db.Column(db.String(255), default='')  # ключ последней обработанной строки
+    processed = db.Column(db.Integer, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+def get_checkpoint(job: str) -> BatchCheckpoint:
+    """Незавершенная контрольная точка задачи или новая, если прошлый проход закончился"""
+    checkpoint = db.session.get(BatchCheckpoint, job)
+    if checkpoint is None:
+        checkpoint = BatchCheckpoint(job=job, cursor='', processed=0)
+        db.session.add(checkpoint)
+    elif checkpoint.finished_at is not None:
+        checkpoint.cursor = ''
+        checkpoint.processed = 0
+        checkpoint.started_at = datetime.utcnow()
+        checkpoint.finished_at = None
+    return checkpoint
+
+def advance_checkpoint(checkpoint: BatchCheckpoint, cursor: str, processed: int, finished: bool = False):
+    """Сдвигает контрольную точку; фиксируется вместе с пакетом в одной транзакции"""
+    checkpoint.cursor = cursor
+    checkpoint.processed = (checkpoint.processed or 0) + processed
+    checkpoint.updated_at = datetime.utcnow()
+    if finished:
+        checkpoint.finished_at = checkpoint.updated_at
+
+class CatalogState(db.Model):
+    """Версия каталога продуктов: увеличивается при каждом изменении, ключ для кэшей"""
+    __tablename__ = 'catalog_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # Журнал product_changes полон для версий больше этой (старые удаления сжаты)
+    changes_floor = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ProductChange(db.Model):
+    """Журнал изменений каталога для синхронизации клиентов: добавления/изменения и удаления (tombstone)"""
+    __tablename__ = 'product_changes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+_catalog_cache = {}
+_catalog_cache_lock = threading.Lock()
+
+# Версия каталога в памяти процесса: БД проверяется не чаще раза в CATALOG_VERSION_TTL секунд,
+# изменения в этом же процессе сбрасывают ее сразу после фиксации
+CATALOG_VERSION_TTL = 5
+_catalog_version = {'value': None, 'checked_at': 0.0}
+
+def get_catalog_version() -> int:
+    with _catalog_cache_lock:
+        version, checked_at = _catalog_version['value'], _catalog_version['checked_at']
+    if version is not None and time.monotonic() - checked_at < CATALOG_VERSION_TTL:
+        return version
+    version = db.session.execute(text("SELECT version FROM catalog_state WHERE id = 1")).scalar()
+    if version is None:
+        version = ensure_catalog_state()
+    with _catalog_cache_lock:
+        _catalog_version.update(value=version, checked_at=time.monotonic())
+    return version
+
+def ensure_catalog_state() -> int:
+    """Создает строку catalog_state, если ее нет. Без нее изменения продуктов не попадают в журнал,
+    поэтому при уже заполненном каталоге журнал считается неполным (changes_floor = version)"""
+    version = db.session.execute(text("SELECT version FROM catalog_state WHERE id = 1")).scalar()
+    if version is not None:
+        return version
+    has_products = db.session.execute(select(Product.id).limit(1)).first() is not None
+    db.session.add(CatalogState(id=1, version=1, changes_floor=1 if has_products else 0))
+    db.session.commit()
+    return 1
+
+def invalidate_catalog_version():
+    with _catalog_cache_lock:
+        _catalog_version['value'] = None
+
+def bump_catalog_version(connection=None):
+    """Увеличивает версию каталога в текущей транзакции (для изменений через прямой SQL)"""
+    (connection or db.session).execute(
+        text("UPDATE catalog_state SET version = version + 1, updated_at = :now WHERE id = 1"),
+        {'now': datetime.utcnow()}
+    )
+    db.session.info['catalog_bumped'] = True
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_catalog_version_on_commit(session):
+    if session.info.pop('catalog_bumped', False):
+        invalidate_catalog_version()
+
+@event.listens_for(Session, 'after_rollback')
+def forget_catalog_bump_on_rollback(session):
+    session.info.pop('catalog_bumped', None)
+
+def log_product_changes(connection=None, upserted=(), deleted=()):
+    """Увеличивает версию каталога и записывает изменившиеся продукты в журнал с новой версией"""
+    connection = connection or db.session
+    bump_catalog_version(connection)
+    now = datetime.utcnow()
+    rows = [{'product_id': product_id, 'deleted': False, 'now': now} for product_id in upserted] + \
+        [{'product_id': product_id, 'deleted': True, 'now': now} for product_id in deleted]
+    if rows:
+        connection.execute(text("""
+            INSERT INTO product_changes (version, product_id, deleted, changed_at)
+            SELECT version, :product_id, :deleted, :now FROM catalog_state WHERE id = 1
+        """), rows)
+
+@event.listens_for(Session, 'after_flush')
+def bump_catalog_version_on_flush(session, flush_context):
+    """Изменения продуктов через ORM автоматически меняют версию каталога и попадают в журнал"""
+    upserted = {obj.id for obj in session.new if isinstance(obj, Product)} | \
+        {obj.id for obj in session.dirty if isinstance(obj, Product) and session.is_modified(obj)}
+    deleted = {obj.id for obj in session.deleted if isinstance(obj, Product)}
+    categories_changed = any(isinstance(obj, Category) for obj in session.new) or \
+        any(isinstance(obj, Category) for obj in session.deleted)
+    renamed = [obj.id for obj in session.dirty
+               if isinstance(obj, Category) and sa_inspect(obj).attrs.name.history.has_changes()]
+    if not (upserted or deleted or categories_changed or renamed):
+        return
+    connection = session.connection()
+    if renamed:
+        # Переименование категории меняет строки всех ее продуктов у клиентов
+        upserted.update(connection.execute(select(Product.id).where(Product.category_id.in_(renamed))).scalars())
+    log_product_changes(connection, sorted(upserted - deleted), sorted(deleted))
+
+def catalog_cached(name: str, builder):
+    """Значение, вычисленное builder() для текущей версии каталога (кэш процесса)"""
+    version = get_catalog_version()
+    with _catalog_cache_lock:
+        cached = _catalog_cache.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+    value = builder()
+    with _catalog_cache_lock:
+        _catalog_cache[name] = (version, value)
+    return value
+
+# Общие запросы горячих путей (используются маршрутами и benchmark_queries.py)
+PRODUCTS_PER_PAGE = 20
+
+DUPLICATE_GROUPS_PER_PAGE = 50
+
+def duplicate_report_query():
+    """Все продукты из групп дубликатов одним запросом: размер группы и число записей дневника"""
+    ranked = select(
+        Product.id, Product.name, Category.name.label('category'), Product.calories_per_100g,
+        Product.protein, Product.carbs, Product.fat, Product.created_at, Product.name_key,
+        func.count().over(partition_by=Product.name_key).label('group_size'),
+        func.first_value(Product.name).over(partition_by=Product.name_key, order_by=Product.id).label('group_name')
+    ).outerjoin_from(Product, Category, Product.category_id == Category.id) \
+        .where(Product.name_key.isnot(None)).subquery('ranked')
+    usage_count = select(func.count()).select_from(FoodEntry.__table__) \
+        .where(FoodEntry.product_id == ranked.c.id).correlate(ranked).scalar_subquery()
+    return select(ranked, usage_count.label('usage_count')) \
+        .where(ranked.c.group_size > 1) \
+        .order_by(ranked.c.group_name, ranked.c.name_key, ranked.c.id)
+
+def entries_for_day_query(user_id: int, day: dt.date):
+    """Записи пользователя за один день"""
+    return FoodEntry.query.filter_by(user_id=user_id, date=day)
+
+def entry_nutrient_expression(column: str):
+    """Значение снимка; расчет по продукту нужен только строкам, которые еще не заполнены"""
+    from_product = select(func.coalesce(getattr(Product, ENTRY_NUTRIENTS[column]), 0) * FoodEntry.weight / 100) \
+        .where(Product.id == FoodEntry.product_id).scalar_subquery()
+    return func.coalesce(getattr(FoodEntry, column), from_product)
+
+def daily_nutrient_totals_query(user_id: int, start_date: dt.date, end_date: dt.date):
+    """Суммы КБЖУ по дням периода одной агрегацией по food_entries"""
+    return select(FoodEntry.date, *[func.sum(entry_nutrient_expression(column)) for column in ENTRY_NUTRIENTS]) \
+        .where(FoodEntry.user_id == user_id, FoodEntry.date >= start_date, FoodEntry.date <= end_date) \
+        .group_by(FoodEntry.date)
+
+def daily_nutrient_totals(user_id: int, start_date: dt.date, end_date: dt.date) -> dict:
+    """{дата: {calories, protein, carbs, fat}} для дней с записями"""
+    rows = db.session.execute(daily_nutrient_totals_query(user_id, start_date, end_date)).all()
+    return {row[0]: dict(zip(ENTRY_NUTRIENTS, (value or 0 for value in row[1:]))) for row in rows}
+
+def filtered_products_query(search: str = '', category: str = ''):
+    """Каталог продуктов с фильтрами по категории (точное совпадение) и названию"""
+    query = Product.query
+    if category:
+        category_row = get_category(category)
+        query = query.filter(Product.category_id == (category_row.id if category_row else None))
+    if search:
+        query = query.filter(Product.name.ilike(f'%{search}%'))  # type: ignore
+    return query
+
+def catalog_page_query(search: str = '', category: str = ''):
+    """Каталог в порядке страницы /products: по названию категории, затем продукта.
+    При фильтре по категории название одно, и порядок берется из индекса (category_id, name, id)"""
+    return (filtered_products_query(search, category)
+            .outerjoin(Category, Product.category_id == Category.id)
+            .order_by(Category.name, Product.name))
+
+FILTERED_COUNTS_CACHE_SIZE = 1000
+
+def build_category_facets() -> dict:
+    categories = {
+        category.name: category.product_count
+        for category in Category.query.filter(Category.product_count > 0).order_by(Category.name)
+    }
+    return {'total': Product.query.count(), 'categories': categories}
+
+def get_category_facets() -> dict:
+    """Общее число продуктов и число продуктов по категориям (кэш под версией каталога)"""
+    return catalog_cached('category_facets', build_category_facets)
+
+def filtered_products_count(search: str = '', category: str = '', query=None, mode: str = '') -> int:
+    """Число продуктов под фильтром: без поиска - из фасетов, с поиском - один COUNT на версию каталога"""
+    facets = get_category_facets()
+    if not search:
+        return facets['categories'].get(category, 0) if category else facets['total']
+    
+    counts = catalog_cached('filtered_counts', dict)
+    key = (search, category, mode)
+    if key not in counts:
+        if len(counts) >= FILTERED_COUNTS_CACHE_SIZE:
+            counts.clear()
+        if query is None:
+            query = fulltext_products_query(search, category) if mode == 'fulltext' else filtered_products_query(search, category)
+        counts[key] = query.order_by(None).count()
+    return counts[key]
+
+def paginate_products(search: str, category: str, page: int, mode: str = ''):
+    """Страница каталога; количество считается один раз и передается пагинации.
+    mode='fulltext' - поиск по словоформам, упорядоченный по релевантности"""
+    if mode == 'fulltext' and search:
+        query = fulltext_products_query(search, category)
+    else:
+        mode = ''
+        query = catalog_page_query(search, category)
+    pagination = query.paginate(page=page, per_page=PRODUCTS_PER_PAGE, error_out=False, count=False)
+    pagination.total = filtered_products_count(search, category, query, mode)
+    return pagination
+
+PICKER_PAGE_SIZE = 20
+PICKER_MAX_PAGE_SIZE = 50
+
+def encode_picker_cursor(name: str, product_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([name, product_id], ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+def decode_picker_cursor(cursor: str):
+    """(name, id) последней выданной строки; ValueError для испорченного курсора"""
+    try:
+        name, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return str(name), int(product_id)
+    except Exception as e:
+        raise ValueError(f'Некорректный курсор: {e}')
+
+def picker_row(product_id, name, category, calories, protein, fat, carbs) -> dict:
+    return {'id': product_id, 'name': name, 'kcal': calories, 'protein': protein or 0, 'fat': fat or 0,
+            'carbs': carbs or 0, 'category': category or DEFAULT_CATEGORY}
+
+def product_picker_page(q: str = '', category: str = '', cursor: str = '', limit: int = PICKER_PAGE_SIZE) -> dict:
+    """Страница выбора продукта: компактные строки по (name, id) с курсором вместо OFFSET.
+    Если подстрока ничего не нашла, первая страница берется из поиска с исправлением опечаток"""
+    limit = max(1, min(limit, PICKER_MAX_PAGE_SIZE))
+    statement = (
+        select(Product.id, Product.name, Category.name, Product.calories_per_100g,
+               Product.protein, Product.fat, Product.carbs)
+        .outerjoin_from(Product, Category, Product.category_id == Category.id)
+        .order_by(Product.name, Product.id)
+        .limit(limit + 1)
+    )
+    if category:
+        category_row = get_category(category)
+        statement = statement.where(Product.category_id == (category_row.id if category_row else None))
+    if q:
+        statement = statement.where(Product.name.ilike(f'%{q}%'))  # type: ignore
+    if cursor:
+        statement = statement.where(tuple_(Product.name, Product.id) > decode_picker_cursor(cursor))
+    
+    rows = db.session.execute(statement).all()
+    items = [picker_row(*row) for row in rows[:limit]]
+    if not items and q and not cursor:
+        items = [
+            picker_row(p['id'], p['name'], p['category'], p['calories'], p['protein'], p['fat'], p['carbs'])
+            for p in search_catalog(q, limit) if not category or p['category'] == category
+        ]
+        return {'items': items, 'next_cursor': None, 'corrected': bool(items)}
+    next_cursor = encode_picker_cursor(items[-1]['name'], items[-1]['id']) if len(rows) > limit else None
+    return {'items': items, 'next_cursor': next_cursor, 'corrected': False}
+
+# Снимок каталога в памяти процесса и нечеткий поиск по нему
+def build_catalog_snapshot() -> list:
+    rows = db.session.execute(
+        select(Product.id, Product.name, Category.name.label('category'), Product.calories_per_100g,
+               Product.protein, Product.carbs, Product.fat)
+        .outerjoin_from(Product, Category, Product.category_id == Category.id)
+        .order_by(Product.id)
+    ).all()
+    return [{
+        'id': row[0], 'name': row[1], 'category': row[2] or DEFAULT_CATEGORY,
+        'calories': row[3], 'protein': row[4] or 0, 'carbs': row[5] or 0, 'fat': row[6] or 0
+    } for row in rows]
+
+def get_catalog_snapshot() -> list:
+    """Все продукты компактными словарями (пересобирается при смене версии каталога)"""
+    return catalog_cached('catalog_snapshot', build_catalog_snapshot)
+
+def get_catalog_by_id() -> dict:
+    return catalog_cached('catalog_by_id', lambda: {product['id']: product for product in get_catalog_snapshot()})
+
+def build_catalog_name_index() -> dict:
+    """Нормализованное название -> самый ранний продукт с ним (как find_product_by_name)"""
+    index = {}
+    for product in get_catalog_snapshot():
+        index.setdefault(normalize_product_name(product['name']), product)
+    return index
+
+def get_catalog_name_index() -> dict:
+    return catalog_cached('catalog_name_index', build_catalog_name_index)
+
+def catalog_product_dict(product: 'Product') -> dict:
+    """Продукт в формате снимка каталога"""
+    return {'id': product.id, 'name': product.name, 'category': product.category,
+            'calories': product.calories_per_100g, 'protein': product.protein or 0,
+            'carbs': product.carbs or 0, 'fat': product.fat or 0}
+
+def resolve_catalog_product(product_id=None, name: str = '', fresh: bool = False) -> Optional[dict]:
+    """Продукт из снимка каталога по id или по названию без запроса к products.
+    
+    Продукт, которого в снимке еще нет (другой воркер только что его добавил), ищется в базе.
+    fresh=True - только из базы: снимок другого процесса отстает до CATALOG_VERSION_TTL секунд,
+    и вставка с id из него может упасть на внешнем ключе (продукт уже слит или удален).
+    """
+    if product_id is not None:
+        product = None if fresh else get_catalog_by_id().get(product_id)
+        if product is None:
+            row = db.session.get(Product, product_id)
+            product = catalog_product_dict(row) if row else None
+        return product
+    product = get_catalog_name_index().get(normalize_product_name(name))
+    if product is not None:
+        return product
+    row = find_product_by_name(name) if name.strip() else None
+    return catalog_product_dict(row) if row else None
+
+QWERTY_TO_JCUKEN = str.maketrans(
+    "qwertyuiop[]asdfghjkl;'zxcvbnm,.`",
+    'йцукенгшщзхъфывапролджэячсмитьбюё'
+)
+JCUKEN_TO_QWERTY = str.maketrans(
+    'йцукенгшщзхъфывапролджэячсмитьбюё',
+    "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+)
+TRANSLIT_PAIRS = [
+    ('shch', 'щ'), ('sch', 'щ'), ('yo', 'ё'), ('zh', 'ж'), ('kh', 'х'), ('ts', 'ц'), ('ch', 'ч'),
+    ('sh', 'ш'), ('yu', 'ю'), ('ya', 'я'), ('ye', 'е'), ('a', 'а'), ('b', 'б'), ('v', 'в'), ('g', 'г'),
+    ('d', 'д'), ('e', 'е'), ('z', 'з'), ('i', 'и'), ('y', 'ы'), ('j', 'й'), ('k', 'к'), ('l', 'л'),
+    ('m', 'м'), ('n', 'н'), ('o', 'о'), ('p', 'п'), ('r', 'р'), ('s', 'с'), ('t', 'т'), ('u', 'у'),
+    ('f', 'ф'), ('h', 'х'), ('c', 'к'), ('w', 'в'), ('x', 'кс'), ('q', 'к'), ("'", 'ь')
+]
+_LATIN_RE = re.compile(r'[a-z]')
+_WORD_RE = re.compile(r'[0-9a-zа-я%]+')
+
+def transliterate(value: str) -> str:
+    result = []
+    i = 0
+    while i < len(value):
+        for latin, cyrillic in TRANSLIT_PAIRS:
+            if value.startswith(latin, i):
+                result.append(cyrillic)
+                i += len(latin)
+                break
+        else:
+            result.append(value[i])
+            i += 1
+    return ''.join(result)
+
+def search_variants(query: str) -> list:
+    """Запрос и его исправления: (текст, штраф). Раскладка и транслит - для латиницы и наоборот"""
+    base = normalize_product_name(query)
+    variants = [(base, 0)]
+    if _LATIN_RE.search(base):
+        variants.append((normalize_product_name(base.translate(QWERTY_TO_JCUKEN)), 1))
+        variants.append((normalize_product_name(transliterate(base)), 1))
+    elif re.search('[а-я]', base):
+        latin = base.translate(JCUKEN_TO_QWERTY)
+        variants.append((latin, 1))
+        variants.append((normalize_product_name(transliterate(latin)), 2))
+    seen = set()
+    return [(text_value, penalty) for text_value, penalty in variants
+            if text_value and not (text_value in seen or seen.add(text_value))]
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау-Левенштейна (с перестановкой соседних букв); limit + 1, если больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+class FuzzySearchIndex:
+    """Индекс SymSpell по словам названий и триграммы названий для поиска подстроки"""
+    
+    PREFIX_LENGTH = 7
+    
+    def __init__(self, snapshot: list):
+        self.products = snapshot
+        self.names = [normalize_product_name(product['name']) for product in snapshot]
+        self.blob = '\n'.join(self.names)
+        self.offsets = []
+        offset = 0
+        for name in self.names:
+            self.offsets.append(offset)
+            offset += len(name) + 1
+        self.trigrams = {}
+        for index, name in enumerate(self.names):
+            for gram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                self.trigrams.setdefault(gram, []).append(index)
+        
+        self.words = [frozenset(_WORD_RE.findall(name)) for name in self.names]
+        self.postings = {}
+        for index, words in enumerate(self.words):
+            for word in words:
+                self.postings.setdefault(word, []).append(index)
+        self.deletes = {}
+        for word in self.postings:
+            if len(word) >= 3:
+                for variant in self._deletes(word[:self.PREFIX_LENGTH], self.max_distance(word)):
+                    self.deletes.setdefault(variant, []).append(word)
+    
+    @staticmethod
+    def max_distance(word: str) -> int:
+        return 1 if len(word) <= 4 else 2
+    
+    @staticmethod
+    def _deletes(word: str, distance: int) -> set:
+        result = {word}
+        frontier = {word}
+        for _ in range(distance):
+            frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w)) if len(w) > 1}
+            result |= frontier
+        return result
+    
+    def substring_matches(self, query: str, limit: int) -> list:
+        """Индексы продуктов, название которых содержит запрос.
+        Кандидаты берутся из самой редкой триграммы запроса; короткий запрос ищется по склеенной строке"""
+        found = []
+        if len(query) >= 3:
+            postings = [self.trigrams.get(query[i:i + 3]) for i in range(len(query) - 2)]
+            if not all(postings):
+                return found
+            for index in min(postings, key=len):
+                if query in self.names[index]:
+                    found.append(index)
+                    if len(found) >= limit:
+                        break
+            return found
+        position = self.blob.find(query)
+        while position != -1 and len(found) < limit:
+            index = bisect.bisect_right(self.offsets, position) - 1
+            found.append(index)
+            position = self.blob.find(query, self.offsets[index] + len(self.names[index]) + 1)
+        return found
+    
+    def similar_words(self, token: str) -> dict:
+        limit = self.max_distance(token)
+        candidates = set()
+        for variant in self._deletes(token[:self.PREFIX_LENGTH], limit):
+            candidates.update(self.deletes.get(variant, ()))
+        result = {}
+        for word in candidates:
+            distance = edit_distance(token, word, limit)
+            if distance <= limit:
+                result[word] = distance
+        return result
+    
+    def fuzzy_matches(self, query: str, candidates: int) -> dict:
+        """Продукты, где каждому слову запроса соответствует похожее слово названия: индекс -> расстояние.
+        Перебор идет от самого редкого слова запроса и от меньшего расстояния к большему"""
+        tokens = [token for token in _WORD_RE.findall(query) if len(token) >= 3]
+        similar = [self.similar_words(token) for token in tokens]
+        if not similar or not all(similar):
+            return {}
+        pivot = min(range(len(similar)), key=lambda k: sum(len(self.postings[word]) for word in similar[k]))
+        others = [words for k, words in enumerate(similar) if k != pivot]
+        allowed = [set().union(*(self.postings[word] for word in words)) for words in others]
+        matched = {}
+        for distance in sorted(set(similar[pivot].values())):
+            postings = [self.postings[w] for w, d in similar[pivot].items() if d == distance]
+            if allowed:
+                tier = sorted(set().union(*postings).intersection(*allowed).difference(matched))
+            else:
+                tier = (index for indexes in postings for index in indexes if index not in matched)
+            for index in tier:
+                matched[index] = distance + sum(min(other[w] for w in self.words[index] if w in other)
+                                                for other in others)
+                if len(matched) >= candidates:
+                    return matched
+        return matched
+    
+    def search(self, query: str, limit: int = 10) -> list:
+        """Сначала точные совпадения подстроки (начало названия выше), затем исправленные опечатки"""
+        candidates = limit * 20
+        # Исправленные варианты короче трех букв слишком многозначны
+        variants = [(variant, penalty) for variant, penalty in search_variants(query)
+                    if penalty == 0 or len(variant) >= 3]
+        ranked = {}
+        for variant, penalty in variants:
+            for index in self.substring_matches(variant, candidates):
+                key = (0, penalty, 0 if self.names[index].startswith(variant) else 1, len(self.names[index]))
+                ranked[index] = min(ranked.get(index, key), key)
+        if len(ranked) < limit:
+            for variant, penalty in variants:
+                for index, distance in self.fuzzy_matches(variant, candidates).items():
+                    key = (1, distance + penalty, 0, len(self.names[index]))
+                    ranked[index] = min(ranked.get(index, key), key)
+        best = heapq.nsmallest(limit, ranked, key=lambda index: (ranked[index], self.names[index]))
+        return [self.products[index] for index in best]
+
+def get_fuzzy_search_index() -> FuzzySearchIndex:
+    return catalog_cached('fuzzy_search_index', lambda: FuzzySearchIndex(get_catalog_snapshot()))
+
+def search_catalog(query: str, limit: int = 10) -> list:
+    """Поиск продуктов с исправлением опечаток, раскладки и транслита"""
+    if not query.strip():
+        return []
+    return get_fuzzy_search_index().search(query, limit)
+
+# Недавние и частые продукты пользователя. Затухающая частота хранится без пересчета: каждое добавление
+# прибавляет 2^((t - эпоха) / период полураспада), поэтому обновление - один upsert с простым сложением,
+# а порядок по score совпадает с порядком по частоте с затуханием на любой момент времени.
+# Float переполнится через 1024 периода полураспада (около 39 лет от эпохи).
+PRODUCT_STATS_EPOCH = datetime(2024, 1, 1)
+PRODUCT_STATS_HALF_LIFE_DAYS = 14
+PRODUCT_STATS_LIMIT = 50
+PRODUCT_STATS_CACHE_TTL = 60  # секунд; свои добавления сбрасывают кэш сразу, чужие воркеры - по TTL
+PRODUCT_STATS_CACHE_SIZE = 10000
+PRODUCT_STATS_RETENTION_DAYS = 365
+PRODUCT_STATS_PRUNE_INTERVAL = 3600
+PRODUCT_STATS_UPSERT_SET = """
+    score = user_product_stats.score + excluded.score,
+    uses = user_product_stats.uses + excluded.uses,
+    last_weight = CASE WHEN excluded.last_used_at >= user_product_stats.last_used_at
+                       THEN excluded.last_weight ELSE user_product_stats.last_weight END,
+    last_used_at = CASE WHEN excluded.last_used_at >= user_product_stats.last_used_at
+                        THEN excluded.last_used_at ELSE user_product_stats.last_used_at END
+"""
+_product_stats_cache = {}
+_product_stats_cache_lock = threading.Lock()
+_product_stats_pruned_at = 0.0
+
+def product_usage_weight(when: datetime) -> float:
+    return 2 ** ((when - PRODUCT_STATS_EPOCH).total_seconds() / (PRODUCT_STATS_HALF_LIFE_DAYS * 86400))
+
+def record_product_usage(rows: list):
+    """Учитывает добавленные записи (словари user_id, product_id, weight и необязательный created_at).
+    
+    Один upsert на пачку в транзакции вызывающего кода; коммит - там же.
+    """
+    now = datetime.utcnow()
+    merged = {}
+    for row in rows:
+        when = row.get('created_at') or now
+        key = (row['user_id'], row['product_id'])
+        stat = merged.setdefault(key, {'user_id': key[0], 'product_id': key[1], 'score': 0.0, 'uses': 0,
+                                       'last_weight': None, 'last_used_at': when})
+        stat['score'] += product_usage_weight(when)
+        stat['uses'] += 1
+        if when >= stat['last_used_at'] or stat['last_weight'] is None:
+            stat['last_weight'], stat['last_used_at'] = row['weight'], when
+    if not merged:
+        return
+    # Строки в одном порядке во всех транзакциях: параллельные upsert не взаимоблокируются
+    db.session.execute(text(f"""
+        INSERT INTO user_product_stats (user_id, product_id, score, uses, last_weight, last_used_at)
+        VALUES (:user_id, :product_id, :score, :uses, :last_weight, :last_used_at)
+        ON CONFLICT (user_id, product_id) DO UPDATE SET {PRODUCT_STATS_UPSERT_SET}
+    """), [merged[key] for key in sorted(merged)])
+    with _product_stats_cache_lock:
+        for user_id, _ in merged:
+            _product_stats_cache.pop(user_id, None)
+
+def build_user_products(user_id: int) -> list:
+    """До PRODUCT_STATS_LIMIT продуктов пользователя по убыванию частоты с затуханием"""
+    rows = db.session.execute(
+        select(UserProductStat.product_id, UserProductStat.score, UserProductStat.uses,
+               UserProductStat.last_weight, UserProductStat.last_used_at)
+        .where(UserProductStat.user_id == user_id)
+        .order_by(UserProductStat.score.desc()).limit(PRODUCT_STATS_LIMIT)
+    ).all()
+    catalog = get_catalog_by_id()
+    now_weight = product_usage_weight(datetime.utcnow())
+    products = []
+    for product_id, score, uses, last_weight, last_used_at in rows:
+        product = catalog.get(product_id)
+        if product is None:
+            continue
+        products.append(dict(product, weight=last_weight, uses=uses, score=round(score / now_weight, 3),
+                             last_used_at=last_used_at.isoformat(timespec='seconds') if last_used_at else None))
+    return products
+
+def get_user_products(user_id: int) -> list:
+    """Недавние и частые продукты пользователя (кэш процесса на PRODUCT_STATS_CACHE_TTL секунд)"""
+    now = time.monotonic()
+    with _product_stats_cache_lock:
+        cached = _product_stats_cache.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    products = build_user_products(user_id)
+    with _product_stats_cache_lock:
+        if len(_product_stats_cache) >= PRODUCT_STATS_CACHE_SIZE:
+            _product_stats_cache.clear()
+        _product_stats_cache[user_id] = (now + PRODUCT_STATS_CACHE_TTL, products)
+    return products
+
+def rank_for_user(products: list, query: str, user_id: Optional[int], limit: int = 10) -> list:
+    """Свои продукты пользователя, подходящие под запрос, - первыми, затем остальные результаты поиска"""
+    if not user_id:
+        return products
+    needle = normalize_product_name(query)
+    mine = [product for product in get_user_products(user_id) if needle in normalize_product_name(product['name'])]
+    seen = {product['id'] for product in mine}
+    return (mine + [product for product in products if product['id'] not in seen])[:limit]
+
+def prune_product_stats(retention_days: int = PRODUCT_STATS_RETENTION_DAYS) -> int:
+    """Удаляет статистику продуктов, которые пользователь не добавлял дольше retention_days"""
+    cutoff = datetime.utcnow() - dt.timedelta(days=retention_days)
+    removed = UserProductStat.query.filter(UserProductStat.last_used_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    if removed:
+        logging.info(f"Удалено устаревших строк user_product_stats: {removed}")
+    return removed
+
+def maybe_prune_product_stats():
+    """Очистка не чаще раза в PRODUCT_STATS_PRUNE_INTERVAL секунд на процесс"""
+    global _product_stats_pruned_at
+    if time.time() - _product_stats_pruned_at < PRODUCT_STATS_PRUNE_INTERVAL:
+        return
+    _product_stats_pruned_at = time.time()
+    try:
+        prune_product_stats()
+    except Exception as e:
+        logging.error(f"Error pruning user_product_stats: {str(e)}")
+        db.session.rollback()
+
+# Каталог одним файлом для поиска в браузере: колонки, gzip, адрес по хэшу содержимого
+CATALOG_BUNDLE_MAX_AGE = 365 * 24 * 3600
+
+def build_catalog_bundle() -> dict:
+    """Колоночный JSON каталога (категории - коды в словаре), сжатый заранее"""
+    snapshot = get_catalog_snapshot()
+    categories = sorted({product['category'] for product in snapshot})
+    codes = {name: code for code, name in enumerate(categories)}
+    payload = {
+        'version': get_catalog_version(),
+        'ids': [product['id'] for product in snapshot],
+        'names': [product['name'] for product in snapshot],
+        'kcal': [round(product['calories'], 1) for product in snapshot],
+        'protein': [round(product['protein'], 1) for product in snapshot],
+        'fat': [round(product['fat'], 1) for product in snapshot],
+        'carbs': [round(product['carbs'], 1) for product in snapshot],
+        'categories': categories,
+        'category': [codes[product['category']] for product in snapshot],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return {
+        'digest': hashlib.sha256(raw).hexdigest()[:16],
+        # mtime=0: одинаковое содержимое дает одинаковые байты во всех воркерах
+        'gzip': gzip.compress(raw, compresslevel=9, mtime=0),
+        'size': len(raw),
+        'products': len(snapshot),
+    }
+
+def get_catalog_bundle() -> dict:
+    """Бандл каталога; пересобирается только при смене версии каталога"""
+    return catalog_cached('catalog_bundle', build_catalog_bundle)
+
+def catalog_bundle_url() -> str:
+    return url_for('catalog_bundle', digest=get_catalog_bundle()['digest'])
+
+# Синхронизация каталога по журналу product_changes
+CATALOG_CHANGES_MAX_ROWS = 5000  # больше изменений - клиенту проще скачать бандл заново
+CATALOG_CHANGES_RETENTION_DAYS = 30
+CATALOG_CHANGES_COMPACT_INTERVAL = 3600
+_changes_compacted_at = 0.0
+
+def catalog_changes_since(since: int) -> dict:
+    """Продукты, добавленные/измененные и удаленные после версии since.
+    reset=True - журнал не покрывает since (сжат или слишком много изменений), нужен полный бандл"""
+    state = db.session.execute(text("SELECT version, changes_floor FROM catalog_state WHERE id = 1")).fetchone()
+    version, floor = (state[0], state[1]) if state else (get_catalog_version(), 0)
+    result = {'version': version, 'since': since, 'reset': False, 'upserted': [], 'deleted': []}
+    if since >= version:
+        result['reset'] = since > version
+        return result
+    # Журнал начинается после changes_floor; пустой журнал при изменившейся версии тоже не покрывает since
+    logged = db.session.execute(select(ProductChange.id).limit(1)).first() is not None
+    if since < floor or not logged:
+        result['reset'] = True
+        return result
+    
+    rows = db.session.execute(
+        select(ProductChange.product_id, ProductChange.deleted)
+        .where(ProductChange.version > since, ProductChange.version <= version)
+        .order_by(ProductChange.id)
+        .limit(CATALOG_CHANGES_MAX_ROWS + 1)
+    ).all()
+    if len(rows) > CATALOG_CHANGES_MAX_ROWS:
+        result['reset'] = True
+        return result
+    
+    latest = {}
+    for product_id, deleted in rows:
+        latest[product_id] = deleted
+    upserted_ids = [product_id for product_id, deleted in latest.items() if not deleted]
+    found = set()
+    for start in range(0, len(upserted_ids), 500):
+        chunk = upserted_ids[start:start + 500]
+        for row in db.session.execute(
+            select(Product.id, Product.name, Category.name, Product.calories_per_100g,
+                   Product.protein, Product.fat, Product.carbs)
+            .outerjoin_from(Product, Category, Product.category_id == Category.id)
+            .where(Product.id.in_(chunk))
+        ):
+            result['upserted'].append(picker_row(*row))
+            found.add(row[0])
+    # Продукт мог быть удален после чтения журнала - для клиента это тоже удаление
+    result['deleted'] = sorted([product_id for product_id, deleted in latest.items() if deleted] +
+                               [product_id for product_id in upserted_ids if product_id not in found])
+    return result
+
+def compact_product_changes(retention_days: int = CATALOG_CHANGES_RETENTION_DAYS) -> dict:
+    """Сжатие журнала: у каждого продукта остается последняя запись, старые удаления отбрасываются
+    (граница полноты журнала changes_floor сдвигается)"""
+    superseded = db.session.execute(text("""
+        DELETE FROM product_changes
+        WHERE id NOT IN (SELECT MAX(id) FROM product_changes GROUP BY product_id)
+    """)).rowcount or 0
+    cutoff = datetime.utcnow() - dt.timedelta(days=retention_days)
+    floor = db.session.execute(
+        select(func.max(ProductChange.version)).where(ProductChange.deleted.is_(True), ProductChange.changed_at < cutoff)
+    ).scalar()
+    expired = 0
+    if floor is not None:
+        expired = db.session.execute(
+            ProductChange.__table__.delete().where(ProductChange.deleted.is_(True), ProductChange.version <= floor)
+        ).rowcount or 0
+        db.session.execute(text(
+            "UPDATE catalog_state SET changes_floor = :floor WHERE id = 1 AND changes_floor < :floor"
+        ), {'floor': floor})
+    db.session.commit()
+    logging.info(f"product_changes compacted: {superseded} superseded, {expired} expired tombstones")
+    return {'superseded': superseded, 'expired': expired, 'floor': floor}
+
+def maybe_compact_product_changes():
+    """Сжатие не чаще раза в CATALOG_CHANGES_COMPACT_INTERVAL секунд на процесс"""
+    global _changes_compacted_at
+    if time.time() - _changes_compacted_at < CATALOG_CHANGES_COMPACT_INTERVAL:
+        return
+    _changes_compacted_at = time.time()
+    try:
+        compact_product_changes()
+    except Exception as e:
+        logging.error(f"Error compacting product_changes: {str(e)}")
+        db.session.rollback()
+
+# Полнотекстовый поиск с учетом морфологии: tsvector на PostgreSQL, стеммер в процессе на остальных БД
+RUSSIAN_VOWELS = 'аеиоуыэюя'
+RUSSIAN_STOP_WORDS = frozenset('и в во не на с со по к ко из у о об от для без за до при или а'.split())
+_PERFECTIVE_GERUND = (('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв'), ('вшись', 'вши', 'в'))
+_ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем',
+              'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+_PARTICIPLE = (('ивш', 'ывш', 'ующ'), ('ем', 'нн', 'вш', 'ющ', 'щ'))
+_REFLEXIVE = ('ся', 'сь')
+_VERB = (('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены',
+          'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю'),
+         ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н'))
+_NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий',
+         'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я')
+
+def _strip_ending(word: str, endings, start: int, after_a: bool = False):
+    """Отрезает самое длинное окончание, начинающееся не раньше start; after_a - только после а/я"""
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            if after_a and (len(word) - len(ending) - 1 < start or word[-len(ending) - 1] not in 'ая'):
+                continue
+            return word[:-len(ending)]
+    return None
+
+def _strip_group(word: str, groups, start: int):
+    for ending in sorted(groups[0] + groups[1], key=len, reverse=True):
+        stripped = _strip_ending(word, (ending,), start, after_a=ending in groups[1])
+        if stripped is not None:
+            return stripped
+    return None
+
+def russian_stem(word: str) -> str:
+    """Стеммер Портера (Snowball) для русского языка, как у конфигурации russian в PostgreSQL"""
+    word = word.lower().replace('ё', 'е')
+    rv = next((i + 1 for i, letter in enumerate(word) if letter in RUSSIAN_VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in RUSSIAN_VOWELS and word[i - 1] in RUSSIAN_VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in RUSSIAN_VOWELS and word[i - 1] in RUSSIAN_VOWELS), len(word))
+    
+    stripped = _strip_group(word, _PERFECTIVE_GERUND, rv)
+    if stripped is not None:
+        word = stripped
+    else:
+        word = _strip_ending(word, _REFLEXIVE, rv) or word
+        stripped = _strip_ending(word, _ADJECTIVE, rv)
+        if stripped is not None:
+            word = _strip_group(stripped, _PARTICIPLE, rv) or stripped
+        else:
+            word = _strip_group(word, _VERB, rv) or _strip_ending(word, _NOUN, rv) or word
+    
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip_ending(word, ('ость', 'ост'), r2) or word
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    else:
+        superlative = _strip_ending(word, ('ейше', 'ейш'), rv)
+        if superlative is not None:
+            word = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+def fulltext_terms(value: str) -> list:
+    """Основы слов без стоп-слов, в порядке появления"""
+    return [russian_stem(word) for word in _WORD_RE.findall(normalize_product_name(value))
+            if word not in RUSSIAN_STOP_WORDS]
+
+class FullTextIndex:
+    """Основы слов названий -> продукты; ранжирование близко к ts_rank (больше совпадений и раньше в названии - выше)"""
+    
+    def __init__(self, snapshot: list):
+        self.products = snapshot
+        self.terms = [fulltext_terms(product['name']) for product in snapshot]
+        self.postings = {}
+        for index, terms in enumerate(self.terms):
+            for term in set(terms):
+                self.postings.setdefault(term, []).append(index)
+    
+    def search(self, query: str, category: str = '', limit: int = None) -> list:
+        terms = list(dict.fromkeys(fulltext_terms(query)))
+        if not terms or not all(term in self.postings for term in terms):
+            return []
+        matched = set(self.postings[terms[0]]).intersection(*(self.postings[term] for term in terms[1:]))
+        if category:
+            matched = {index for index in matched if self.products[index]['category'] == category}
+        
+        def rank(index):
+            name_terms = self.terms[index]
+            hits = sum(name_terms.count(term) for term in terms)
+            first = min(name_terms.index(term) for term in terms)
+            return (-hits / len(name_terms), first, self.products[index]['name'], self.products[index]['id'])
+        
+        ranked = sorted(matched, key=rank)
+        return [self.products[index] for index in (ranked[:limit] if limit else ranked)]
+
+def get_fulltext_index() -> FullTextIndex:
+    return catalog_cached('fulltext_index', lambda: FullTextIndex(get_catalog_snapshot()))
+
+def fulltext_in_database() -> bool:
+    return db.engine.dialect.name == 'postgresql' and _search_vector_ready
+
+def fulltext_products_query(search: str, category: str = ''):
+    """Продукты, совпадающие с запросом по словоформам, по убыванию релевантности"""
+    if fulltext_in_database():
+        tsquery = func.plainto_tsquery('russian', search)
+        vector = literal_column('products.search_vector')
+        return (filtered_products_query('', category)
+                .filter(vector.op('@@')(tsquery))
+                .order_by(func.ts_rank(vector, tsquery).desc(), Product.name, Product.id))
+    
+    ids = [product['id'] for product in get_fulltext_index().search(search, category)]
+    if not ids:
+        return Product.query.filter(false())
+    return (Product.query.filter(Product.id.in_(ids))
+            .order_by(case({product_id: position for position, product_id in enumerate(ids)}, value=Product.id)))
+
+# Каталог продуктов: поиск по ключу названия, вставка без дубликатов, пакетная очистка
+DEDUPE_JOB = 'dedupe_products'
+_name_key_migrated = False
+
+def find_product_by_name(name: str):
+    """Продукт с таким же нормализованным названием (самый ранний, если дубликаты еще не очищены)"""
+    return Product.query.filter_by(name_key=product_name_key(name)).order_by(Product.id).first()
+
+def insert_missing_products(products) -> int:
+    """Добавляет в сессию продукты, которых еще нет в каталоге; возвращает их количество.
+    
+    Принимает объекты Product или кортежи (name, calories, protein, carbs, fat, category).
+    Коммит выполняет вызывающий код.
+    """
+    candidates = {}
+    for item in products:
+        product = item if isinstance(item, Product) else Product(*item)
+        candidates.setdefault(product.name_key, product)
+    
+    keys = list(candidates)
+    existing = set()
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        existing.update(row[0] for row in db.session.query(Product.name_key).filter(Product.name_key.in_(chunk)))
+    
+    added = [product for key, product in candidates.items() if key not in existing]
+    db.session.add_all(added)
+    return len(added)
+
+def backfill_product_name_keys(batch_size: int = 1000) -> int:
+    """Заполняет name_key у продуктов, добавленных до появления колонки"""
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, name FROM products WHERE name_key IS NULL AND id > :last_id ORDER BY id LIMIT :n"
+        ), {'last_id': last_id, 'n': batch_size}).fetchall()
+        if not rows:
+            break
+        db.session.execute(text("UPDATE products SET name_key = :key WHERE id = :id"),
+                           [{'id': row[0], 'key': product_name_key(row[1])} for row in rows])
+        bump_catalog_version()
+        db.session.commit()
+        last_id = rows[-1][0]
+        total += len(rows)
+    if total:
+        logging.info(f"Backfilled name_key for {total} products")
+    return total
+
+def migrate_products_name_key():
+    """Добавляет products.name_key в существующую БД и заполняет его пакетами"""
+    global _name_key_migrated
+    if _name_key_migrated:
+        return False
+    try:
+        columns = {column['name'] for column in sa_inspect(db.engine).get_columns('products')}
+        added = False
+        if 'name_key' not in columns:
+            logging.info("Adding name_key column to products...")
+            db.session.execute(text("ALTER TABLE products ADD COLUMN name_key VARCHAR(32)"))
+            db.session.commit()
+            added = True
+        backfill_product_name_keys()
+        _name_key_migrated = True
+        return added
+    except Exception as e:
+        logging.error(f"Error during products.name_key migration: {str(e)}")
+        db.session.rollback()
+        return False
+
+_changes_floor_migrated = False
+
+def migrate_catalog_changes_floor():
+    """Добавляет catalog_state.changes_floor; изменения до текущей версии в журнале не записаны"""
+    global _changes_floor_migrated
+    if _changes_floor_migrated:
+        return False
+    try:
+        columns = {column['name'] for column in sa_inspect(db.engine).get_columns('catalog_state')}
+        added = False
+        if 'changes_floor' not in columns:
+            logging.info("Adding changes_floor column to catalog_state...")
+            db.session.execute(text("ALTER TABLE catalog_state ADD COLUMN changes_floor INTEGER NOT NULL DEFAULT 0"))
+            db.session.execute(text("UPDATE catalog_state SET changes_floor = version"))
+            db.session.commit()
+            added = True
+        # Строка catalog_state могла появиться уже после записи продуктов (они не попали в журнал) -
+        # тогда журнал полон только начиная с текущей версии
+        unlogged = db.session.execute(text("""
+            SELECT 1 FROM catalog_state WHERE id = 1 AND changes_floor = 0 AND EXISTS (
+                SELECT 1 FROM products WHERE NOT EXISTS (
+                    SELECT 1 FROM product_changes WHERE product_changes.product_id = products.id
+                )
+            )
+        """)).first()
+        if unlogged:
+            logging.info("product_changes misses initial products, moving changes_floor to current version")
+            db.session.execute(text("UPDATE catalog_state SET changes_floor = version WHERE id = 1"))
+            db.session.commit()
+            added = True
+        _changes_floor_migrated = True
+        return added
+    except Exception as e:
+        logging.error(f"Error during catalog_state.changes_floor migration: {str(e)}")
+        db.session.rollback()
+        return False
+
+_search_vector_ready = False
+SEARCH_VECTOR_BATCH_SIZE = 5000
+
+def migrate_products_search_vector():
+    """PostgreSQL: колонка products.search_vector (tsvector, конфигурация russian), триггер и заполнение пакетами.
+    GIN-индекс создается вместе с остальными управляемыми индексами"""
+    global _search_vector_ready
+    if _search_vector_ready or db.engine.dialect.name != 'postgresql':
+        return False
+    try:
+        db.session.execute(text("ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector"))
+        db.session.execute(text("""
+            CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('russian', coalesce(NEW.name, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """))
+        db.session.execute(text("DROP TRIGGER IF EXISTS products_search_vector_trigger ON products"))
+        db.session.execute(text("""
+            CREATE TRIGGER products_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF name ON products
+            FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+        """))
+        db.session.commit()
+        
+        filled = 0
+        while True:
+            updated = db.session.execute(text("""
+                UPDATE products SET search_vector = to_tsvector('russian', coalesce(name, ''))
+                WHERE id IN (SELECT id FROM products WHERE search_vector IS NULL LIMIT :batch)
+            """), {'batch': SEARCH_VECTOR_BATCH_SIZE}).rowcount
+            db.session.commit()
+            filled += updated
+            if updated < SEARCH_VECTOR_BATCH_SIZE:
+                break
+        if filled:
+            logging.info(f"products.search_vector filled for {filled} products")
+        _search_vector_ready = True
+        return True
+    except Exception as e:
+        logging.error(f"Error during products.search_vector migration: {str(e)}")
+        db.session.rollback()
+        return False
+
+CATEGORY_MIGRATION_JOB = 'products_category_id'
+_category_migrated = False
+
+def recount_categories():
+    """Пересчитывает product_count всех категорий (после миграции или массовых правок)"""
+    db.session.execute(text("""
+        UPDATE categories SET product_count = (
+            SELECT COUNT(*) FROM products WHERE products.category_id = categories.id
+        )
+    """))
+    bump_catalog_version()
+
+def rename_category(old_name: str, new_name: str) -> Category:
+    """Переименование - обновление одной строки categories; в существующую категорию - слияние"""
+    source = get_category(old_name)
+    if source is None:
+        raise ValueError(f'Категория "{old_name}" не найдена')
+    target = get_category(new_name)
+    if target is not None and target.id != source.id:
+        return merge_categories(old_name, new_name)
+    source.name = new_name.strip()
+    db.session.commit()
+    return source
+
+def merge_categories(source_name: str, target_name: str) -> Category:
+    """Переносит продукты одной категории в другую одним UPDATE и удаляет пустую категорию"""
+    source = get_category(source_name)
+    target = get_or_create_category(target_name)
+    if source is None or source.id == target.id:
+        return target
+    moved_ids = db.session.execute(select(Product.id).where(Product.category_id == source.id)).scalars().all()
+    moved = db.session.execute(text("UPDATE products SET category_id = :target WHERE category_id = :source"),
+                               {'target': target.id, 'source': source.id}).rowcount
+    log_product_changes(db.session, moved_ids)
+    _change_category_count(db.session, target.id, max(moved or 0, 0))
+    db.session.delete(source)
+    db.session.commit()
+    db.session.expire_all()
+    logging.info(f"Category '{source_name}' merged into '{target_name}': {moved} products moved")
+    return target
+
+def migrate_products_category_id(batch_size: int = 2000):
+    """Переводит строковые products.category на таблицу categories пакетами с контрольной точкой"""
+    global _category_migrated
+    if _category_migrated:
+        return False
+    try:
+        columns = {column['name'] for column in sa_inspect(db.engine).get_columns('products')}
+        if 'category_id' not in columns:
+            logging.info("Adding category_id column to products...")
+            db.session.execute(text("ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES categories(id)"))
+            db.session.commit()
+        
+        if 'category' in columns:
+            missing = db.session.execute(text(
+                "SELECT 1 FROM products WHERE category_id IS NULL LIMIT 1"
+            )).fetchone()
+            if missing:
+                db.session.execute(text("""
+                    INSERT INTO categories (name, product_count, created_at)
+                    SELECT DISTINCT COALESCE(NULLIF(TRIM(p.category), ''), :default), 0, :now
+                    FROM products p
+                    WHERE p.category_id IS NULL
+                      AND NOT EXISTS (
+                          SELECT 1 FROM categories c WHERE c.name = COALESCE(NULLIF(TRIM(p.category), ''), :default)
+                      )
+                """), {'default': DEFAULT_CATEGORY, 'now': datetime.utcnow()})
+                db.session.commit()
+                
+                checkpoint = get_checkpoint(CATEGORY_MIGRATION_JOB)
+                db.session.commit()
+                while True:
+                    last_id = int(checkpoint.cursor or 0)
+                    upper = db.session.execute(text(
+                        "SELECT MAX(id) FROM (SELECT id FROM products WHERE id > :last_id ORDER BY id LIMIT :n) batch"
+                    ), {'last_id': last_id, 'n': batch_size}).scalar()
+                    if upper is None:
+                        advance_checkpoint(checkpoint, str(last_id), 0, finished=True)
+                        db.session.commit()
+                        break
+                    migrated_ids = db.session.execute(text(
+                        "SELECT id FROM products WHERE id > :last_id AND id <= :upper AND category_id IS NULL"
+                    ), {'last_id': last_id, 'upper': upper}).scalars().all()
+                    updated = db.session.execute(text("""
+                        UPDATE products SET category_id = (
+                            SELECT c.id FROM categories c
+                            WHERE c.name = COALESCE(NULLIF(TRIM(products.category), ''), :default)
+                        )
+                        WHERE id > :last_id AND id <= :upper AND category_id IS NULL
+                    """), {'default': DEFAULT_CATEGORY, 'last_id': last_id, 'upper': upper}).rowcount
+                    if migrated_ids:
+                        log_product_changes(db.session, migrated_ids)
+                    advance_checkpoint(checkpoint, str(upper), max(updated or 0, 0))
+                    db.session.commit()
+                
+                recount_categories()
+                db.session.commit()
+                logging.info(f"Products category migration finished: {checkpoint.processed} products")
+        
+        _category_migrated = True
+        return True
+    except Exception as e:
+        logging.error(f"Error during products.category_id migration: {str(e)}")
+        db.session.rollback()
+        return False
+
+def merge_products_into(mapping: dict) -> int:
+    """Переносит записи дневника, шаблоны и статистику продуктов с продуктов-ключей mapping на значения и удаляет первые.
+    
+    Коммит выполняет вызывающий код; возвращает число перенесенных записей дневника.
+    """
+    mapping = {loser: keep for loser, keep in mapping.items() if loser != keep}
+    if not mapping:
+        return 0
+    pairs = [{'keep_id': keep, 'loser_id': loser} for loser, keep in mapping.items()]
+    remap = db.session.execute(text("UPDATE food_entries SET product_id = :keep_id WHERE product_id = :loser_id"), pairs)
+    db.session.execute(text("UPDATE meal_template_items SET product_id = :keep_id WHERE product_id = :loser_id"), pairs)
+    db.session.execute(text(f"""
+        INSERT INTO user_product_stats (user_id, product_id, score, uses, last_weight, last_used_at)
+        SELECT user_id, :keep_id, score, uses, last_weight, last_used_at FROM user_product_stats WHERE product_id = :loser_id
+        ON CONFLICT (user_id, product_id) DO UPDATE SET {PRODUCT_STATS_UPSERT_SET}
+    """), pairs)
+    db.session.execute(text("DELETE FROM user_product_stats WHERE product_id = :loser_id"), pairs)
+    removed = db.session.query(Product.category_id, func.count()).filter(Product.id.in_(list(mapping))) \
+        .group_by(Product.category_id).all()
+    for category_id, count in removed:
+        _change_category_count(db.session, category_id, -count)
+    db.session.execute(Product.__table__.delete().where(Product.__table__.c.id.in_(list(mapping))))
+    log_product_changes(db.session, deleted=list(mapping))
+    return max(remap.rowcount or 0, 0)
+
+def dedupe_products(batch_size: int = 200, time_budget: Optional[float] = None) -> dict:
+    """Объединяет продукты с одинаковым name_key пакетами групп.
+    
+    В каждом пакете записи дневника переносятся на самый ранний продукт группы,
+    остальные удаляются, и транзакция фиксируется вместе с контрольной точкой,
+    поэтому блокировки короткие, а прерванный проход продолжается с места остановки.
+    """
+    backfill_product_name_keys()
+    checkpoint = get_checkpoint(DEDUPE_JOB)
+    db.session.commit()
+    
+    started = time.perf_counter()
+    result = {'groups': 0, 'remapped_entries': 0, 'deleted': 0, 'batches': 0, 'finished': False}
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    
+    while True:
+        if is_postgres:
+            db.session.execute(text("SET LOCAL lock_timeout = '5s'"))
+        groups = db.session.execute(text("""
+            SELECT name_key, MIN(id) FROM products
+            WHERE name_key > :after
+            GROUP BY name_key HAVING COUNT(*) > 1
+            ORDER BY name_key LIMIT :n
+        """), {'after': checkpoint.cursor or '', 'n': batch_size}).fetchall()
+        if not groups:
+            advance_checkpoint(checkpoint, checkpoint.cursor, 0, finished=True)
+            db.session.commit()
+            result['finished'] = True
+            break
+        
+        keep = {row[0]: row[1] for row in groups}
+        losers = db.session.query(Product.id, Product.name_key).filter(
+            Product.name_key.in_(list(keep)), Product.id.notin_(list(keep.values()))
+        ).all()
+        remapped = merge_products_into({product_id: keep[key] for product_id, key in losers})
+        advance_checkpoint(checkpoint, groups[-1][0], len(groups))
+        db.session.commit()
+        
+        result['groups'] += len(groups)
+        result['remapped_entries'] += remapped
+        result['deleted'] += len(losers)
+        result['batches'] += 1
+        logging.info(f"Dedupe batch {result['batches']}: {len(groups)} groups, {len(losers)} products removed")
+        
+        if time_budget is not None and time.perf_counter() - started > time_budget:
+            break
+    
+    db.session.expire_all()
+    if result['finished']:
+        # Уникальный индекс по name_key мог быть пропущен из-за дубликатов
+        ensure_managed_indexes(force=True)
+    return result
+
+# Добавляем мидлвар для обеспечения свежих данных
+@app.before_request
+def refresh_database_session():
+    """Рефреш базы данных сессия перед каждым запросом для обеспечения свежих данных"""
+    try:
+        db.session.expire_all()
+    except Exception as e:
+        logging.warning(f"Ошибка обновления базы данных сессия: {str(e)}")
+
+@app.after_request
+def add_cache_headers(response):
+    """Добавить cache-control заголовки для предотвращения кэширования динамических данных"""
+    if request.endpoint in ['index', 'products', 'add_food', 'profile', 'statistics']:
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    return response
+
+# Инициализация базы данных при импорте модуля (для gunicorn)
+def init_database():
+    """Initialize database tables and default data"""
+    try:
+        with app.app_context():
+            logging.info("Starting database initialization...")
+            
+            # Создаем все таблицы
+            db.create_all()
+            logging.info("Database tables created successfully")
+            
+            # Версия каталога должна существовать до первой записи продуктов, иначе они не попадут в журнал
+            ensure_catalog_state()
+            
+            # Проверяем, что таблицы действительно созданы
+            from sqlalchemy import text
+            result = db.session.execute(text(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema='public'"
+            ))
+            tables = [row[0] for row in result]
+            logging.info(f"Created tables: {tables}")
+            
+            # Добавляем все продукты автоматически
+            auto_load_all_products()
+            
+            # Инициализируем систему уровней для существующих пользователей
+            init_user_levels_for_existing_users()
+            
+    except Exception as e:
+        logging.error(f"Error initializing database: {str(e)}")
+        # Не поднимаем исключение, чтобы приложение продолжило работать
+
+def auto_load_all_products():
+    """Автоматически загружает все доступные продукты при инициализации"""
+    try:
+        current_count = Product.query.count()
+        logging.info(f"Current product count: {current_count}")
+        
+        if current_count == 0:
+            logging.info("Loading initial products...")
+            
+            # Базовые продукты
+            default_products = [
+                    # Хлебобулочные изделия
+                    Product(name="Хлеб белый", calories_per_100g=265, protein=8.1, carbs=48.8, fat=3.2, category="Хлебобулочные"),
+                    Product(name="Хлеб черный", calories_per_100g=214, protein=6.6, carbs=40.7, fat=1.3, category="Хлебобулочные"),
+                    Product(name="Хлеб ржаной", calories_per_100g=181, protein=6.6, carbs=34.2, fat=1.2, category="Хлебобулочные"),
+                    Product(name="Батон нарезной", calories_per_100g=264, protein=7.5, carbs=50.9, fat=2.9, category="Хлебобулочные"),
+                    Product(name="Булочка с маком", calories_per_100g=336, protein=7.8, carbs=55.5, fat=9.9, category="Хлебобулочные"),
+                    Product(name="Круассан", calories_per_100g=406, protein=8.2, carbs=45.8, fat=20.9, category="Хлебобулочные"),
+                    Product(name="Багет", calories_per_100g=262, protein=8.1, carbs=51.4, fat=3.3, category="Хлебобулочные"),
+                    Product(name="Лаваш тонкий", calories_per_100g=236, protein=7.9, carbs=47.6, fat=1.2, category="Хлебобулочные"),
+                    Product(name="Тортилья", calories_per_100g=218, protein=5.7, carbs=43.2, fat=2.9, category="Хлебобулочные"),
+                    Product(name="Сухари панировочные", calories_per_100g=347, protein=11.2, carbs=72.1, fat=1.8, category="Хлебобулочные"),
+
+                    # Молочные продукты
+                    Product(name="Молоко 3.2%", calories_per_100g=60, protein=2.9, carbs=4.7, fat=3.2, category="Молочные"),
+                    Product(name="Молоко 2.5%", calories_per_100g=54, protein=2.8, carbs=4.7, fat=2.5, category="Молочные"),
+                    Product(name="Молоко 1.5%", calories_per_100g=47, protein=3.0, carbs=4.9, fat=1.5, category="Молочные"),
+                    Product(name="Молоко обезжиренное", calories_per_100g=35, protein=3.4, carbs=5.0, fat=0.1, category="Молочные"),
+                    Product(name="Сливки 10%", calories_per_100g=118, protein=3.0, carbs=4.0, fat=10.0, category="Молочные"),
+                    Product(name="Сливки 20%", calories_per_100g=206, protein=2.8, carbs=3.7, fat=20.0, category="Молочные"),
+                    Product(name="Сметана 15%", calories_per_100g=158, protein=2.6, carbs=3.0, fat=15.0, category="Молочные"),
+                    Product(name="Сметана 20%", calories_per_100g=206, protein=2.8, carbs=3.2, fat=20.0, category="Молочные"),
+                    Product(name="Творог 0%", calories_per_100g=88, protein=16.7, carbs=1.3, fat=0.6, category="Молочные"),
+                    Product(name="Творог 5%", calories_per_100g=121, protein=17.2, carbs=1.8, fat=5.0, category="Молочные"),
+                    Product(name="Творог 9%", calories_per_100g=159, protein=16.7, carbs=2.0, fat=9.0, category="Молочные"),
+                    Product(name="Йогурт натуральный", calories_per_100g=66, protein=5.0, carbs=3.5, fat=3.2, category="Молочные"),
+                    Product(name="Кефир 1%", calories_per_100g=40, protein=2.8, carbs=4.0, fat=1.0, category="Молочные"),
+                    Product(name="Кефир 2.5%", calories_per_100g=53, protein=2.8, carbs=4.0, fat=2.5, category="Молочные"),
+                    Product(name="Ряженка 4%", calories_per_100g=67, protein=2.9, carbs=4.2, fat=4.0, category="Молочные"),
+                    Product(name="Простокваша", calories_per_100g=58, protein=2.9, carbs=4.1, fat=3.2, category="Молочные"),
+
+                    # Сыры
+                    Product(name="Сыр российский", calories_per_100g=364, protein=23.2, carbs=0.3, fat=29.5, category="Сыры"),
+                    Product(name="Сыр голландский", calories_per_100g=352, protein=26.8, carbs=0.0, fat=26.8, category="Сыры"),
+                    Product(name="Сыр швейцарский", calories_per_100g=396, protein=24.9, carbs=0.0, fat=31.8, category="Сыры"),
+                    Product(name="Сыр моцарелла", calories_per_100g=280, protein=22.2, carbs=2.2, fat=22.4, category="Сыры"),
+                    Product(name="Сыр пармезан", calories_per_100g=431, protein=38.0, carbs=1.0, fat=29.0, category="Сыры"),
+                    Product(name="Сыр фета", calories_per_100g=264, protein=14.2, carbs=4.1, fat=21.3, category="Сыры"),
+                    Product(name="Сыр чеддер", calories_per_100g=402, protein=25.0, carbs=1.3, fat=33.1, category="Сыры"),
+                    Product(name="Сыр камамбер", calories_per_100g=299, protein=19.8, carbs=0.5, fat=24.3, category="Сыры"),
+                    Product(name="Сыр творожный", calories_per_100g=342, protein=22.6, carbs=4.1, fat=26.2, category="Сыры"),
+                    Product(name="Сыр плавленый", calories_per_100g=257, protein=16.8, carbs=23.8, fat=11.2, category="Сыры"),
+
+                    # Мясо и птица
+                    Product(name="Говядина постная", calories_per_100g=158, protein=22.2, carbs=0.0, fat=7.1, category="Мясо и птица"),
+                    Product(name="Свинина постная", calories_per_100g=142, protein=20.9, carbs=0.0, fat=6.1, category="Мясо и птица"),
                     Product(name="Баранина", calories_per_100g=203, protein=16.3, carbs=0.0, fat=15.3, category="Мясо и птица"),
                     Product(name="Телятина", calories_per_100g=97, protein=19.7, carbs=0.0, fat=1.2, category="Мясо и птица"),
                     Product(name="Курица грудка", calories_per_100g=165, protein=31.0, carbs=0.0, fat=3.6, category="Мясо и птица"),
@@ -485,11 +2584,9 @@ def auto_load_all_products():
                     Product(name="Бекон", calories_per_100g=500, protein=23.0, carbs=0.0, fat=45.0, category="Колбасные изделия"),
                     Product(name="Салями", calories_per_100g=568, protein=13.0, carbs=1.0, fat=57.0, category="Колбасные изделия")]
                 
-            for product in default_products:
-                db.session.add(product)
-                
-                db.session.commit()
-                logging.info(f"Added {len(default_products)} initial products")
+            added_count = insert_missing_products(default_products)
+            db.session.commit()
+            logging.info(f"Added {added_count} initial products")
             
             # Добавляем расширенные продукты если их мало
             if current_count < 50:
@@ -583,12 +2680,7 @@ def load_extended_products():
         Product(name="Киви", calories_per_100g=47, protein=1.0, carbs=10.3, fat=0.5, category="Фрукты")
     ]
     
-    added_count = 0
-    for product in extended_products:
-        existing = Product.query.filter_by(name=product.name).first()
-        if not existing:
-            db.session.add(product)
-            added_count += 1
+    added_count = insert_missing_products(extended_products)
     
     db.session.commit()
     logging.info(f"Added {added_count} extended products")
@@ -615,12 +2707,7 @@ def load_mega_products_auto():
         Product(name="Мед", calories_per_100g=329, protein=0.8, carbs=80.3, fat=0.0, category="Сладости")
     ]
     
-    added_count = 0
-    for product in mega_products:
-        existing = Product.query.filter_by(name=product.name).first()
-        if not existing:
-            db.session.add(product)
-            added_count += 1
+    added_count = insert_missing_products(mega_products)
     
     db.session.commit()
     logging.info(f"Added {added_count} mega products")
@@ -645,182 +2732,728 @@ def ensure_tables_exist():
         logging.error(f"Error checking table existence: {str(e)}")
         return False
 
+# Онлайн-миграции больших таблиц: схема меняется неблокирующими шагами, данные заполняются пакетами по id.
+# Каждый шаг проверяет, сделан ли он, поэтому прерванная миграция при следующем запуске продолжается.
+ONLINE_MIGRATION_BATCH_SIZE = 5000
+ONLINE_MIGRATION_PAUSE = 0.1  # секунд между пакетами, чтобы заполнение не забирало весь ввод-вывод
+ONLINE_MIGRATION_LOCK_TIMEOUT = '5s'
+ONLINE_MIGRATION_DDL_RETRIES = 3
+FOOD_ENTRIES_USER_BACKFILL_JOB = 'food_entries_user_id'
+USER_PROFILE_USER_BACKFILL_JOB = 'user_profile_user_id'
+ENTRY_NUTRIENTS_BACKFILL_JOB = 'food_entries_nutrients'
+PRODUCT_STATS_REBUILD_JOB = 'user_product_stats'
+_food_entries_migrated = False
+_user_profile_migrated = False
+_entry_nutrients_migrated = False
+_product_stats_migrated = False
+
+def online_ddl(statement: str):
+    """DDL с коротким lock_timeout (PostgreSQL): ALTER не выстраивает за собой очередь запросов, а повторяется"""
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    for attempt in range(1, ONLINE_MIGRATION_DDL_RETRIES + 1):
+        try:
+            if is_postgres:
+                db.session.execute(text(f"SET LOCAL lock_timeout = '{ONLINE_MIGRATION_LOCK_TIMEOUT}'"))
+            db.session.execute(text(statement))
+            db.session.commit()
+            return
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == ONLINE_MIGRATION_DDL_RETRIES:
+                raise
+            logging.warning(f"DDL не получил блокировку (попытка {attempt}): {statement}: {e}")
+            time.sleep(attempt)
+
+def column_info(table: str, column: str) -> Optional[dict]:
+    for info in sa_inspect(db.engine).get_columns(table):
+        if info['name'] == column:
+            return info
+    return None
+
+def constraint_validated(name: str) -> Optional[bool]:
+    """convalidated ограничения на PostgreSQL; None - ограничения нет"""
+    return db.session.execute(text("SELECT convalidated FROM pg_constraint WHERE conname = :name"),
+                              {'name': name}).scalar()
+
+def add_column_online(table: str, column: str, ddl_type: str) -> bool:
+    """Колонка добавляется nullable и без DEFAULT: на PostgreSQL это меняет только каталог, таблица не переписывается"""
+    if column_info(table, column) is not None:
+        return False
+    logging.info(f"Adding {table}.{column} (nullable)...")
+    online_ddl(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+    return True
+
+def backfill_in_batches(job: str, table: str, assignment: str, condition: str, params: Optional[dict] = None,
+                        batch_size: int = ONLINE_MIGRATION_BATCH_SIZE, pause: float = ONLINE_MIGRATION_PAUSE,
+                        report=None) -> int:
+    """UPDATE table SET assignment по диапазонам id с контрольной точкой в batch_checkpoints.
+    
+    Каждый пакет - короткая транзакция вместе со сдвигом контрольной точки, между пакетами пауза;
+    прерванный проход продолжается с последнего зафиксированного id. report(progress, message) -
+    необязательный отчет фоновой задачи.
+    """
+    checkpoint = get_checkpoint(job)
+    db.session.commit()
+    max_id = db.session.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0
+    started = time.perf_counter()
+    while True:
+        last_id = int(checkpoint.cursor or 0)
+        upper = db.session.execute(text(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > :last_id ORDER BY id LIMIT :n) batch"
+        ), {'last_id': last_id, 'n': batch_size}).scalar()
+        if upper is None:
+            advance_checkpoint(checkpoint, str(last_id), 0, finished=True)
+            db.session.commit()
+            break
+        updated = db.session.execute(text(
+            f"UPDATE {table} SET {assignment} WHERE id > :last_id AND id <= :upper AND ({condition})"
+        ), dict(params or {}, last_id=last_id, upper=upper)).rowcount
+        advance_checkpoint(checkpoint, str(upper), max(updated or 0, 0))
+        db.session.commit()
+        if report is not None:
+            report(min(99, upper * 100 // max_id) if max_id else None, f'{table}: обработано до id {upper}')
+        if pause:
+            time.sleep(pause)
+    logging.info(f"Backfill {job} finished: {checkpoint.processed} rows in {time.perf_counter() - started:.1f}s")
+    return checkpoint.processed
+
+def set_not_null_online(table: str, column: str) -> bool:
+    """NOT NULL без долгой блокировки записи (PostgreSQL 12+).
+    
+    CHECK (column IS NOT NULL) NOT VALID добавляется мгновенно, VALIDATE CONSTRAINT проверяет строки,
+    не блокируя запись, а SET NOT NULL использует проверенное ограничение вместо полного сканирования.
+    """
+    info = column_info(table, column)
+    if info is None or not info['nullable']:
+        return False
+    if db.engine.dialect.name != 'postgresql':
+        logging.debug(f"{table}.{column}: NOT NULL добавляется только на PostgreSQL")
+        return False
+    check = f'ck_{table}_{column}_not_null'
+    if constraint_validated(check) is None:
+        online_ddl(f"ALTER TABLE {table} ADD CONSTRAINT {check} CHECK ({column} IS NOT NULL) NOT VALID")
+    online_ddl(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}")
+    online_ddl(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+    online_ddl(f"ALTER TABLE {table} DROP CONSTRAINT {check}")
+    logging.info(f"{table}.{column} is now NOT NULL")
+    return True
+
+def add_foreign_key_online(table: str, name: str, column: str, reference: str) -> bool:
+    """Внешний ключ через NOT VALID и отдельный VALIDATE CONSTRAINT (PostgreSQL)"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    existing = [fk['name'] for fk in sa_inspect(db.engine).get_foreign_keys(table) if fk['constrained_columns'] == [column]]
+    if existing and constraint_validated(existing[0]):
+        return False
+    if not existing:
+        online_ddl(f"ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {reference} NOT VALID")
+    online_ddl(f"ALTER TABLE {table} VALIDATE CONSTRAINT {existing[0] if existing else name}")
+    logging.info(f"Foreign key on {table}.{column} validated")
+    return True
+
+def add_unique_online(table: str, name: str, column: str) -> bool:
+    """Уникальность через CREATE UNIQUE INDEX CONCURRENTLY и ADD CONSTRAINT ... USING INDEX (PostgreSQL)"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    inspector = sa_inspect(db.engine)
+    if any(uc['column_names'] == [column] for uc in inspector.get_unique_constraints(table)):
+        return False
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        valid = conn.execute(text("""
+            SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name
+        """), {'name': name}).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        if not valid:
+            conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY {name} ON {table} ({column})"))
+    online_ddl(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+    logging.info(f"Unique constraint {name} added")
+    return True
+
+def legacy_rows_owner_id() -> int:
+    """Владелец старых строк без user_id: первый пользователь или созданный для них admin"""
+    first_user = db.session.execute(text("SELECT id FROM users ORDER BY id LIMIT 1")).scalar()
+    if first_user is not None:
+        return first_user
+    logging.info("No users found, creating default user for legacy rows...")
+    default_password_hash = 'pbkdf2:sha256:600000$default$c8c1a3d4e5f6789abc123def456789abc123def456789abc123def456789abc'
+    db.session.execute(text(
+        "INSERT INTO users (username, password_hash, created_at) VALUES ('admin', :password_hash, :now)"
+    ), {'password_hash': default_password_hash, 'now': datetime.utcnow()})
+    db.session.commit()
+    return db.session.execute(text("SELECT id FROM users WHERE username = 'admin'")).scalar()
+
+USER_ID_BACKFILL_JOBS = {
+    'food_entries': FOOD_ENTRIES_USER_BACKFILL_JOB,
+    'user_profile': USER_PROFILE_USER_BACKFILL_JOB,
+}
+
+def finish_user_id_column(table: str) -> bool:
+    """NOT NULL, внешний ключ и (для user_profile) уникальность user_id - после заполнения колонки"""
+    changed = set_not_null_online(table, 'user_id')
+    changed = add_foreign_key_online(table, f'fk_{table}_user_id', 'user_id', 'users(id)') or changed
+    if table == 'user_profile':
+        changed = add_unique_online('user_profile', 'uq_user_profile_user_id', 'user_id') or changed
+    return changed
+
+def migrate_user_id_column(table: str) -> bool:
+    """user_id в старой таблице: nullable-колонка сразу, заполнение пакетами - фоновой задачей backfill_user_id,
+    которая затем ставит NOT NULL и внешний ключ"""
+    changed = add_column_online(table, 'user_id', 'INTEGER')
+    if column_info(table, 'user_id')['nullable'] and db.session.execute(
+            text(f"SELECT 1 FROM {table} WHERE user_id IS NULL LIMIT 1")).fetchone():
+        db.session.commit()
+        enqueue_job('backfill_user_id', {'table': table})
+        return True
+    return finish_user_id_column(table) or changed
+
+@job_handler('backfill_user_id')
+def backfill_user_id_job(report, table: str) -> dict:
+    """Отдает старые строки без user_id первому пользователю и завершает миграцию колонки"""
+    if table not in USER_ID_BACKFILL_JOBS:
+        raise ValueError(f'Неизвестная таблица: {table}')
+    owner_id = legacy_rows_owner_id()
+    logging.info(f"Assigning existing {table} rows to user_id: {owner_id}")
+    filled = backfill_in_batches(USER_ID_BACKFILL_JOBS[table], table, 'user_id = :owner_id', 'user_id IS NULL',
+                                 {'owner_id': owner_id}, report=report)
+    report(99, f'{table}: NOT NULL и внешний ключ')
+    finish_user_id_column(table)
+    return {'message': f'{table}: user_id заполнен для {filled} строк', 'category': 'success'}
+
 def migrate_food_entries_table():
-    """Migrate food_entries table to add missing user_id column"""
+    """Migrate food_entries table to add missing user_id column (online, resumable)"""
+    global _food_entries_migrated
+    if _food_entries_migrated:
+        return False
     try:
-        from sqlalchemy import text
         logging.info("Starting food_entries table migration...")
-        
-        # Check if food_entries table exists
-        table_check = db.session.execute(text(
-            "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'food_entries')"
-        ))
-        table_exists = table_check.scalar()
-        
-        if not table_exists:
+        if not sa_inspect(db.engine).has_table('food_entries'):
             logging.info("food_entries table doesn't exist, creating it...")
             db.create_all()
             logging.info("food_entries table created successfully")
+            _food_entries_migrated = True
             return True
         
-        # Check if user_id column exists
-        column_check = db.session.execute(text(
-            "SELECT column_name FROM information_schema.columns WHERE table_name='food_entries' AND column_name='user_id'"
-        ))
-        user_id_exists = column_check.fetchone() is not None
-        
-        if not user_id_exists:
-            logging.info("user_id column missing in food_entries, adding it...")
-            
-            # First, check if there are existing records
-            record_count = db.session.execute(text("SELECT COUNT(*) FROM food_entries")).scalar() or 0
-            logging.info(f"Found {record_count} existing records in food_entries")
+        changed = migrate_user_id_column('food_entries')
+        logging.info("user_id column in food_entries migrated" if changed else "food_entries table already has user_id column")
+        _food_entries_migrated = True
+        return changed
             
-            # Add the user_id column
-            db.session.execute(text("ALTER TABLE food_entries ADD COLUMN user_id INTEGER"))
-            
-            if record_count > 0:
-                # If there are existing records, we need to handle them
-                # First, get the first user ID from users table
-                first_user = db.session.execute(text("SELECT id FROM users LIMIT 1")).fetchone()
-                if first_user:
-                    first_user_id = first_user[0]
-                    logging.info(f"Assigning existing food entries to user_id: {first_user_id}")
-                    
-                    # Update existing records to point to the first user
-                    db.session.execute(text(
-                        "UPDATE food_entries SET user_id = :user_id WHERE user_id IS NULL"
-                    ), {'user_id': first_user_id})
-                else:
-                    # No users exist, create a default user
-                    logging.info("No users found, creating default user for food entries...")
-                    default_password_hash = 'pbkdf2:sha256:600000$default$c8c1a3d4e5f6789abc123def456789abc123def456789abc123def456789abc'
-                    db.session.execute(text(
-                        "INSERT INTO users (username, password_hash, created_at) VALUES ('admin', :password_hash, NOW())"
-                    ), {'password_hash': default_password_hash})
-                    
-                    # Get the new user ID
-                    new_user = db.session.execute(text("SELECT id FROM users WHERE username = 'admin'")).fetchone()
-                    if new_user:
-                        new_user_id = new_user[0]
-                        db.session.execute(text(
-                            "UPDATE food_entries SET user_id = :user_id WHERE user_id IS NULL"
-                        ), {'user_id': new_user_id})
-            
-            # Make the column NOT NULL after updating existing records
-            db.session.execute(text("ALTER TABLE food_entries ALTER COLUMN user_id SET NOT NULL"))
-            
-            # Add foreign key constraint
-            try:
-                db.session.execute(text(
-                    "ALTER TABLE food_entries ADD CONSTRAINT fk_food_entries_user_id FOREIGN KEY (user_id) REFERENCES users(id)"
-                ))
-            except Exception as fk_error:
-                logging.warning(f"Could not add foreign key constraint to food_entries: {fk_error}")
-            
-            db.session.commit()
-            logging.info("user_id column added to food_entries successfully")
+    except Exception as e:
+        logging.error(f"Error during food_entries migration: {str(e)}")
+        db.session.rollback()
+        raise
+
+def migrate_user_profile_table():
+    """Migrate user_profile table to add missing user_id column (online, resumable)"""
+    global _user_profile_migrated
+    if _user_profile_migrated:
+        return False
+    try:
+        logging.info("Starting user_profile table migration...")
+        if not sa_inspect(db.engine).has_table('user_profile'):
+            logging.info("user_profile table doesn't exist, creating it...")
+            db.create_all()
+            logging.info("user_profile table created successfully")
+            _user_profile_migrated = True
             return True
-        else:
-            logging.info("food_entries table already has user_id column")
-            return False
+        
+        changed = migrate_user_id_column('user_profile')
+        logging.info("user_id column in user_profile migrated" if changed else "user_profile table already has user_id column")
+        _user_profile_migrated = True
+        return changed
             
     except Exception as e:
-        logging.error(f"Error during food_entries migration: {str(e)}")
+        logging.error(f"Error during user_profile migration: {str(e)}")
+        db.session.rollback()
+        raise
+
+def migrate_food_entry_nutrients():
+    """Колонки снимка КБЖУ в food_entries; старые строки заполняет фоновая задача backfill_entry_nutrients"""
+    global _entry_nutrients_migrated
+    if _entry_nutrients_migrated:
+        return False
+    try:
+        added = False
+        for column in ENTRY_NUTRIENTS:
+            added = add_column_online('food_entries', column, 'FLOAT') or added
+        checkpoint = db.session.get(BatchCheckpoint, ENTRY_NUTRIENTS_BACKFILL_JOB)
+        db.session.commit()
+        if added or (checkpoint is not None and checkpoint.finished_at is None):
+            enqueue_job('backfill_entry_nutrients')
+        _entry_nutrients_migrated = True
+        return added
+    except Exception as e:
+        logging.error(f"Error during food_entries nutrients migration: {str(e)}")
+        db.session.rollback()
+        raise
+
+@job_handler('backfill_entry_nutrients')
+def backfill_entry_nutrients_job(report) -> dict:
+    """Заполняет снимок КБЖУ записей, добавленных до появления колонок, по текущим значениям продуктов"""
+    assignment = ', '.join(
+        f"{column} = (SELECT COALESCE(p.{source}, 0) * food_entries.weight / 100 "
+        f"FROM products p WHERE p.id = food_entries.product_id)"
+        for column, source in ENTRY_NUTRIENTS.items()
+    )
+    filled = backfill_in_batches(ENTRY_NUTRIENTS_BACKFILL_JOB, 'food_entries', assignment,
+                                 'calories IS NULL', report=report)
+    return {'message': f'Снимок КБЖУ заполнен для {filled} записей', 'category': 'success'}
+
+def migrate_user_product_stats():
+    """Один раз ставит в очередь заполнение user_product_stats по истории дневника.
+    
+    Граница - последний id записи на момент миграции: более новые записи этот процесс уже учитывает сам.
+    """
+    global _product_stats_migrated
+    if _product_stats_migrated:
+        return False
+    try:
+        _product_stats_migrated = True
+        if Job.query.filter_by(kind='rebuild_product_stats').first() is not None:
+            return False
+        upto_id = db.session.execute(select(func.max(FoodEntry.id))).scalar()
+        db.session.commit()
+        if not upto_id:
+            return False
+        enqueue_job('rebuild_product_stats', {'upto_id': upto_id})
+        return True
+    except Exception as e:
+        logging.error(f"Error scheduling user_product_stats rebuild: {str(e)}")
+        db.session.rollback()
+        return False
+
+@job_handler('rebuild_product_stats')
+def rebuild_product_stats_job(report, upto_id: int) -> dict:
+    """Заполняет user_product_stats по записям дневника с id до upto_id пакетами с контрольной точкой"""
+    checkpoint = get_checkpoint(PRODUCT_STATS_REBUILD_JOB)
+    db.session.commit()
+    while True:
+        last_id = int(checkpoint.cursor or 0)
+        rows = db.session.execute(
+            select(FoodEntry.id, FoodEntry.user_id, FoodEntry.product_id, FoodEntry.weight,
+                   FoodEntry.date, FoodEntry.created_at)
+            .where(FoodEntry.id > last_id, FoodEntry.id <= upto_id)
+            .order_by(FoodEntry.id).limit(ONLINE_MIGRATION_BATCH_SIZE)
+        ).all()
+        if not rows:
+            advance_checkpoint(checkpoint, str(last_id), 0, finished=True)
+            db.session.commit()
+            break
+        record_product_usage([{
+            'user_id': row.user_id, 'product_id': row.product_id, 'weight': row.weight,
+            'created_at': row.created_at or datetime.combine(row.date, dt.time(12))
+        } for row in rows])
+        advance_checkpoint(checkpoint, str(rows[-1].id), len(rows))
+        db.session.commit()
+        report(min(99, rows[-1].id * 100 // upto_id), f'Обработано записей: {checkpoint.processed}')
+    return {'message': f'Статистика продуктов собрана по {checkpoint.processed} записям', 'category': 'success'}
+
+# Помесячное секционирование food_entries на PostgreSQL: секции food_entries_pYYYYMM по date
+# и секция по умолчанию для дат вне созданного диапазона
+PARTITIONING_JOB = 'food_entries_partitioning'
+PARTITIONING_COPY_BATCH = 20000
+PARTITIONING_STAGING_TABLE = 'food_entries_partitioned'
+PARTITION_MAINTENANCE_INTERVAL = 3600
+_partition_maintained_at = 0.0
+_partitioning_checked = False
+
+def month_start(day: dt.date, shift: int = 0) -> dt.date:
+    index = day.year * 12 + day.month - 1 + shift
+    return dt.date(index // 12, index % 12 + 1, 1)
+
+def food_entry_partition_name(month: dt.date) -> str:
+    return f'food_entries_p{month:%Y%m}'
+
+def food_entries_partitioned() -> bool:
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE relname = 'food_entries' AND relnamespace = 'public'::regnamespace"
+    )).scalar() is True
+
+def create_food_entry_partition(parent: str, month: dt.date) -> bool:
+    """Секция месяца; строки этого месяца, попавшие в секцию по умолчанию, переносятся в нее.
+    
+    Секция создается отдельной таблицей и присоединяется ATTACH PARTITION: при непустой секции
+    по умолчанию CREATE TABLE ... PARTITION OF завершился бы ошибкой.
+    """
+    name = food_entry_partition_name(month)
+    if db.session.execute(text("SELECT 1 FROM pg_class WHERE relname = :name"), {'name': name}).scalar():
+        return False
+    bounds = {'lower': month, 'upper': month_start(month, 1)}
+    db.session.execute(text(f"SET LOCAL lock_timeout = '{ONLINE_MIGRATION_LOCK_TIMEOUT}'"))
+    db.session.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS)"))
+    db.session.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {parent}_default WHERE date >= :lower AND date < :upper RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds)
+    db.session.execute(text(
+        f"ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+    ))
+    db.session.commit()
+    logging.info(f"Partition {name} created")
+    return True
+
+def ensure_food_entry_partitions(parent: str = 'food_entries', first_month: Optional[dt.date] = None) -> int:
+    """Секции от first_month (по умолчанию текущего месяца) до FOOD_ENTRIES_PARTITIONS_AHEAD месяцев вперед"""
+    current = month_start(dt.date.today())
+    month = month_start(first_month) if first_month else current
+    created = 0
+    while month <= month_start(current, app.config['FOOD_ENTRIES_PARTITIONS_AHEAD']):
+        created += create_food_entry_partition(parent, month)
+        month = month_start(month, 1)
+    return created
+
+def detach_old_food_entry_partitions(retain_months: int) -> list:
+    """Отсоединяет секции старше retain_months месяцев: они остаются отдельными таблицами для архива или DROP.
+    
+    На PostgreSQL 14+ используется DETACH PARTITION CONCURRENTLY (вне транзакции, без блокировки записи).
+    """
+    cutoff = month_start(dt.date.today(), -retain_months)
+    names = db.session.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'food_entries' AND c.relname ~ '^food_entries_p[0-9]{6}$'
+    """)).scalars().all()
+    db.session.commit()
+    old = sorted(name for name in names if name[len('food_entries_p'):] < f'{cutoff:%Y%m}')
+    if not old:
+        return []
+    concurrently = int(db.session.execute(text("SHOW server_version_num")).scalar()) >= 140000
+    db.session.commit()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for name in old:
+            conn.execute(text(f"ALTER TABLE food_entries DETACH PARTITION {name}{' CONCURRENTLY' if concurrently else ''}"))
+            logging.info(f"Partition {name} detached from food_entries")
+    return old
+
+def maintain_food_entry_partitions() -> dict:
+    """Будущие секции и отсоединение старых по сроку хранения"""
+    if not food_entries_partitioned():
+        return {}
+    result = {'created': ensure_food_entry_partitions()}
+    retain_months = app.config['FOOD_ENTRIES_RETENTION_MONTHS']
+    if retain_months > 0:
+        result['detached'] = detach_old_food_entry_partitions(retain_months)
+    return result
+
+def maybe_maintain_food_entry_partitions():
+    """Обслуживание секций не чаще раза в PARTITION_MAINTENANCE_INTERVAL секунд на процесс"""
+    global _partition_maintained_at
+    if db.engine.dialect.name != 'postgresql' or time.time() - _partition_maintained_at < PARTITION_MAINTENANCE_INTERVAL:
+        return
+    _partition_maintained_at = time.time()
+    try:
+        maintain_food_entry_partitions()
+    except Exception as e:
+        logging.error(f"Error maintaining food_entries partitions: {str(e)}")
         db.session.rollback()
-        raise
 
-def migrate_user_profile_table():
-    """Migrate user_profile table to add missing columns"""
+def migrate_food_entries_partitioning():
+    """Переход на секционированную таблицу выполняется фоновой задачей; здесь она только ставится в очередь"""
+    global _partitioning_checked
+    if _partitioning_checked or db.engine.dialect.name != 'postgresql' or not app.config['FOOD_ENTRIES_PARTITIONING']:
+        return False
     try:
-        from sqlalchemy import text
-        logging.info("Starting user_profile table migration...")
-        
-        # Check if user_profile table exists
-        table_check = db.session.execute(text(
-            "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'user_profile')"
-        ))
-        table_exists = table_check.scalar()
-        
-        if not table_exists:
-            logging.info("user_profile table doesn't exist, creating it...")
-            db.create_all()
-            logging.info("user_profile table created successfully")
-            return True
-        
-        # Check if user_id column exists
-        column_check = db.session.execute(text(
-            "SELECT column_name FROM information_schema.columns WHERE table_name='user_profile' AND column_name='user_id'"
+        _partitioning_checked = True
+        if food_entries_partitioned():
+            ensure_food_entry_partitions()
+            return False
+        enqueue_job('partition_food_entries')
+        return True
+    except Exception as e:
+        logging.error(f"Error scheduling food_entries partitioning: {str(e)}")
+        db.session.rollback()
+        return False
+
+@job_handler('partition_food_entries')
+def partition_food_entries_job(report) -> dict:
+    """Перевод food_entries на помесячные секции без остановки записи.
+    
+    1. Рядом создается секционированная копия (PRIMARY KEY (id, date), индексы, внешние ключи, секции
+       от самого раннего месяца до FOOD_ENTRIES_PARTITIONS_AHEAD вперед), триггер на старой таблице
+       повторяет в ней все вставки, изменения и удаления.
+    2. Строки копируются пакетами по id с контрольной точкой, повтор задачи продолжает копирование.
+    3. В короткой транзакции таблицы меняются именами; старая остается как food_entries_legacy
+       без внешних ключей.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return {'message': 'Секционирование поддерживается только на PostgreSQL', 'category': 'info'}
+    if food_entries_partitioned():
+        return {'message': 'Таблица food_entries уже секционирована', 'category': 'info'}
+    staging = PARTITIONING_STAGING_TABLE
+    entries_indexes = [spec for spec in MANAGED_INDEXES if spec['table'] == 'food_entries']
+    
+    report(0, 'Создание секционированной таблицы')
+    db.session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {staging} (LIKE food_entries INCLUDING DEFAULTS, PRIMARY KEY (id, date))
+        PARTITION BY RANGE (date)
+    """))
+    db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {staging}_default PARTITION OF {staging} DEFAULT"))
+    for spec in entries_indexes:
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {spec['name']}_next ON {staging} {spec['columns']}"))
+    for column, reference in (('user_id', 'users(id)'), ('product_id', 'products(id)')):
+        if constraint_validated(f'{staging}_{column}_fkey') is None:
+            db.session.execute(text(
+                f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_{column}_fkey FOREIGN KEY ({column}) REFERENCES {reference}"
+            ))
+    db.session.commit()
+    
+    first_day = db.session.execute(text("SELECT MIN(date) FROM food_entries")).scalar()
+    db.session.commit()
+    ensure_food_entry_partitions(staging, first_day)
+    # Секция по умолчанию станет food_entries_default после переименования
+    
+    # Строку, которую параллельно вставил пакет копирования, триггер перезаписывает свежей версией,
+    # а не падает на уникальности (иначе откатилась бы запись пользователя)
+    columns = db.session.execute(text(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'food_entries' ORDER BY ordinal_position"
+    )).scalars().all()
+    refresh = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column not in ('id', 'date'))
+    db.session.execute(text(f"""
+        CREATE OR REPLACE FUNCTION food_entries_mirror() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {staging} WHERE id = OLD.id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO {staging} SELECT (NEW).* ON CONFLICT (id, date) DO UPDATE SET {refresh};
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    db.session.execute(text("DROP TRIGGER IF EXISTS food_entries_mirror ON food_entries"))
+    db.session.execute(text(
+        "CREATE TRIGGER food_entries_mirror AFTER INSERT OR UPDATE OR DELETE ON food_entries "
+        "FOR EACH ROW EXECUTE FUNCTION food_entries_mirror()"
+    ))
+    db.session.commit()
+    
+    # Копирование пакетами; строки, которые уже повторил триггер, пропускаются.
+    # FOR SHARE упорядочивает пакет с параллельными DELETE/UPDATE: строка, удаленная или перенесенная
+    # на другую дату после снимка пакета, перечитывается и не возвращается в новую таблицу устаревшей копией
+    checkpoint = get_checkpoint(PARTITIONING_JOB)
+    db.session.commit()
+    max_id = db.session.execute(text("SELECT MAX(id) FROM food_entries")).scalar() or 0
+    while True:
+        last_id = int(checkpoint.cursor or 0)
+        upper = db.session.execute(text(
+            "SELECT MAX(id) FROM (SELECT id FROM food_entries WHERE id > :last_id ORDER BY id LIMIT :n) batch"
+        ), {'last_id': last_id, 'n': PARTITIONING_COPY_BATCH}).scalar()
+        if upper is None:
+            break
+        copied = db.session.execute(text(f"""
+            INSERT INTO {staging}
+            SELECT * FROM food_entries WHERE id > :last_id AND id <= :upper ORDER BY id FOR SHARE
+            ON CONFLICT DO NOTHING
+        """), {'last_id': last_id, 'upper': upper}).rowcount
+        advance_checkpoint(checkpoint, str(upper), max(copied or 0, 0))
+        db.session.commit()
+        report(min(95, upper * 95 // max_id) if max_id else None, f'Скопировано строк: {checkpoint.processed}')
+        time.sleep(ONLINE_MIGRATION_PAUSE)
+    
+    report(95, 'Переключение таблиц')
+    sequence = db.session.execute(text("SELECT pg_get_serial_sequence('food_entries', 'id')")).scalar()
+    db.session.execute(text(f"SET LOCAL lock_timeout = '{ONLINE_MIGRATION_LOCK_TIMEOUT}'"))
+    db.session.execute(text("LOCK TABLE food_entries IN ACCESS EXCLUSIVE MODE"))
+    db.session.execute(text("DROP TRIGGER food_entries_mirror ON food_entries"))
+    db.session.execute(text("DROP FUNCTION food_entries_mirror()"))
+    # Старая таблица - только архив: без внешних ключей она не мешает удалять продукты и пользователей
+    legacy_fkeys = db.session.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'food_entries'::regclass AND contype = 'f'"
+    )).scalars().all()
+    for name in legacy_fkeys:
+        db.session.execute(text(f"ALTER TABLE food_entries DROP CONSTRAINT {name}"))
+    db.session.execute(text("ALTER TABLE food_entries RENAME TO food_entries_legacy"))
+    db.session.execute(text("ALTER TABLE food_entries_legacy RENAME CONSTRAINT food_entries_pkey TO food_entries_legacy_pkey"))
+    for spec in entries_indexes:
+        db.session.execute(text(f"ALTER INDEX IF EXISTS {spec['name']} RENAME TO {spec['name']}_legacy"))
+        db.session.execute(text(f"ALTER INDEX {spec['name']}_next RENAME TO {spec['name']}"))
+    db.session.execute(text(f"ALTER TABLE {staging} RENAME TO food_entries"))
+    db.session.execute(text(f"ALTER TABLE food_entries RENAME CONSTRAINT {staging}_pkey TO food_entries_pkey"))
+    for column in ('user_id', 'product_id'):
+        db.session.execute(text(
+            f"ALTER TABLE food_entries RENAME CONSTRAINT {staging}_{column}_fkey TO food_entries_{column}_fkey"
         ))
-        user_id_exists = column_check.fetchone() is not None
+    db.session.execute(text(f"ALTER TABLE {staging}_default RENAME TO food_entries_default"))
+    if sequence:
+        db.session.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY food_entries.id"))
+    advance_checkpoint(checkpoint, checkpoint.cursor, 0, finished=True)
+    db.session.commit()
+    
+    logging.info(f"food_entries partitioned: {checkpoint.processed} rows copied, old table kept as food_entries_legacy")
+    return {'message': f'food_entries переведена на помесячные секции, скопировано {checkpoint.processed} строк. '
+                       f'Старая таблица сохранена как food_entries_legacy.',
+            'category': 'success', 'copied': checkpoint.processed}
+
+# Управляемые индексы горячих путей доступа
+# sqlite_columns - вариант выражения для SQLite, precheck - запрос, который должен вернуть пустой результат
+MANAGED_INDEXES = [
+    {
+        'name': 'ix_food_entries_user_date_meal',
+        'table': 'food_entries',
+        'columns': '(user_id, date, meal_type)',
+    },
+    {
+        'name': 'ix_products_name_id',
+        'table': 'products',
+        'columns': '(name, id)',
+    },
+    {
+        'name': 'ix_food_entries_product_id',
+        'table': 'food_entries',
+        'columns': '(product_id)',
+    },
+    {
+        'name': 'ux_products_name_key',
+        'table': 'products',
+        'columns': '(name_key)',
+        'unique': True,
+        'precheck': "SELECT 1 FROM products WHERE name_key IS NOT NULL GROUP BY name_key HAVING COUNT(*) > 1 LIMIT 1",
+        'precheck_message': 'в каталоге есть дубликаты названий, сначала выполните /cleanup_duplicates',
+    },
+    {
+        'name': 'ix_products_category_id_name',
+        'table': 'products',
+        'columns': '(category_id, name, id)',
+    },
+    {
+        'name': 'ix_user_levels_experience',
+        'table': 'user_levels',
+        'columns': '(experience DESC)',
+    },
+    {
+        'name': 'ix_jobs_status_id',
+        'table': 'jobs',
+        'columns': '(status, id)',
+    },
+    {
+        'name': 'ix_products_search_vector',
+        'table': 'products',
+        'columns': 'USING GIN (search_vector)',
+        'dialects': ('postgresql',),
+    },
+]
+# Индексы, замененные другими: удаляются при проверке
+RETIRED_INDEXES = ['ux_products_name_normalized', 'ix_products_category_name_id', 'ix_products_name']
+MANAGED_INDEXES_LOCK_KEY = 720301  # ключ advisory lock, чтобы индексы строил один воркер
+_managed_indexes_checked = False
+
+def managed_index_ddl(spec: dict, dialect: str, concurrently: bool = True) -> str:
+    unique = 'UNIQUE ' if spec.get('unique') else ''
+    if dialect == 'postgresql':
+        # CONCURRENTLY не поддерживается для секционированных таблиц
+        mode = 'CONCURRENTLY ' if concurrently else ''
+        return f"CREATE {unique}INDEX {mode}IF NOT EXISTS {spec['name']} ON {spec['table']} {spec['columns']}"
+    columns = spec.get('sqlite_columns', spec['columns'])
+    return f"CREATE {unique}INDEX IF NOT EXISTS {spec['name']} ON {spec['table']} {columns}"
+
+def ensure_managed_indexes(force: bool = False) -> dict:
+    """Создать недостающие управляемые индексы.
+    
+    На PostgreSQL индексы строятся CREATE INDEX CONCURRENTLY вне транзакции,
+    невалидные остатки прерванных построений пересоздаются.
+    """
+    global _managed_indexes_checked
+    if _managed_indexes_checked and not force:
+        return {}
+    
+    status = {}
+    dialect = db.engine.dialect.name
+    
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if dialect == 'postgresql':
+            if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': MANAGED_INDEXES_LOCK_KEY}).scalar():
+                logging.info("Managed indexes are being built by another worker")
+                return {'_': 'locked by another worker'}
+            existing = {
+                row[0]: row[1] for row in conn.execute(text("""
+                    SELECT c.relname, i.indisvalid
+                    FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = ANY(:names)
+                """), {'names': [spec['name'] for spec in MANAGED_INDEXES]})
+            }
+            partitioned = set(conn.execute(text("SELECT relname FROM pg_class WHERE relkind = 'p'")).scalars())
+        else:
+            partitioned = set()
+            existing = {
+                row[0]: True for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))
+            }
         
-        if not user_id_exists:
-            logging.info("user_id column missing, adding it...")
-            
-            # First, check if there are existing records
-            record_count = db.session.execute(text("SELECT COUNT(*) FROM user_profile")).scalar() or 0
-            logging.info(f"Found {record_count} existing records in user_profile")
-            
-            # Add the user_id column
-            db.session.execute(text("ALTER TABLE user_profile ADD COLUMN user_id INTEGER"))
+        try:
+            for name in RETIRED_INDEXES:
+                if dialect == 'postgresql':
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                else:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
             
-            if record_count > 0:
-                # If there are existing records, we need to handle them
-                # First, get the first user ID from users table
-                first_user = db.session.execute(text("SELECT id FROM users LIMIT 1")).fetchone()
-                if first_user:
-                    first_user_id = first_user[0]
-                    logging.info(f"Assigning existing profiles to user_id: {first_user_id}")
+            for spec in MANAGED_INDEXES:
+                name = spec['name']
+                if dialect not in spec.get('dialects', (dialect,)):
+                    continue
+                try:
+                    if existing.get(name) is True:
+                        status[name] = 'exists'
+                        continue
+                    if existing.get(name) is False:
+                        logging.warning(f"Index {name} is invalid, rebuilding")
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
                     
-                    # Update existing records to point to the first user
-                    db.session.execute(text(
-                        "UPDATE user_profile SET user_id = :user_id WHERE user_id IS NULL"
-                    ), {'user_id': first_user_id})
-                else:
-                    # No users exist, create a default user
-                    logging.info("No users found, creating default user...")
-                    db.session.execute(text(
-                        "INSERT INTO users (username, password_hash, created_at) VALUES ('admin', 'pbkdf2:sha256:600000$default$hash', NOW())"
-                    ))
+                    precheck = spec.get('precheck') if dialect == 'postgresql' else spec.get('sqlite_precheck', spec.get('precheck'))
+                    if precheck and conn.execute(text(precheck)).fetchone():
+                        status[name] = f"skipped: {spec['precheck_message']}"
+                        logging.warning(f"Index {name} skipped: {spec['precheck_message']}")
+                        continue
                     
-                    # Get the new user ID
-                    new_user = db.session.execute(text("SELECT id FROM users WHERE username = 'admin'")).fetchone()
-                    if new_user:
-                        new_user_id = new_user[0]
-                        db.session.execute(text(
-                            "UPDATE user_profile SET user_id = :user_id WHERE user_id IS NULL"
-                        ), {'user_id': new_user_id})
-            
-            # Make the column NOT NULL after updating existing records
-            db.session.execute(text("ALTER TABLE user_profile ALTER COLUMN user_id SET NOT NULL"))
-            
-            # Add foreign key constraint
-            try:
-                db.session.execute(text(
-                    "ALTER TABLE user_profile ADD CONSTRAINT fk_user_profile_user_id FOREIGN KEY (user_id) REFERENCES users(id)"
-                ))
-            except Exception as fk_error:
-                logging.warning(f"Could not add foreign key constraint: {fk_error}")
-            
-            # Add unique constraint
-            try:
-                db.session.execute(text(
-                    "ALTER TABLE user_profile ADD CONSTRAINT uq_user_profile_user_id UNIQUE (user_id)"
-                ))
-            except Exception as uq_error:
-                logging.warning(f"Could not add unique constraint: {uq_error}")
-            
-            db.session.commit()
-            logging.info("user_id column added successfully")
-            return True
-        else:
-            logging.info("user_profile table already has user_id column")
-            return False
-            
-    except Exception as e:
-        logging.error(f"Error during user_profile migration: {str(e)}")
-        db.session.rollback()
-        raise
+                    started = time.perf_counter()
+                    conn.execute(text(managed_index_ddl(spec, dialect, concurrently=spec['table'] not in partitioned)))
+                    status[name] = 'created'
+                    logging.info(f"Index {name} created in {time.perf_counter() - started:.1f}s")
+                except Exception as index_error:
+                    status[name] = f'error: {index_error}'
+                    logging.error(f"Could not create index {name}: {index_error}")
+        finally:
+            if dialect == 'postgresql':
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MANAGED_INDEXES_LOCK_KEY})
+    
+    _managed_indexes_checked = not any(value.startswith(('error', 'skipped')) for value in status.values())
+    return status
+
+def index_usage_report() -> list:
+    """Статистика использования индексов (неиспользуемые - кандидаты на удаление)"""
+    managed = {spec['name'] for spec in MANAGED_INDEXES}
+    if db.engine.dialect.name != 'postgresql':
+        rows = db.session.execute(text(
+            "SELECT tbl_name, name FROM sqlite_master WHERE type = 'index' ORDER BY tbl_name, name"
+        )).fetchall()
+        return [{'table': row[0], 'index': row[1], 'managed': row[1] in managed, 'scans': None} for row in rows]
+    
+    rows = db.session.execute(text("""
+        SELECT s.relname, s.indexrelname, s.idx_scan, s.idx_tup_read, s.idx_tup_fetch,
+               pg_relation_size(s.indexrelid), i.indisunique, i.indisprimary, i.indisvalid
+        FROM pg_stat_user_indexes s
+        JOIN pg_index i ON i.indexrelid = s.indexrelid
+        ORDER BY s.idx_scan, pg_relation_size(s.indexrelid) DESC
+    """)).fetchall()
+    return [{
+        'table': row[0],
+        'index': row[1],
+        'scans': row[2],
+        'tuples_read': row[3],
+        'tuples_fetched': row[4],
+        'size_bytes': row[5],
+        'unique': row[6],
+        'primary': row[7],
+        'valid': row[8],
+        'managed': row[1] in managed,
+        # Уникальные и первичные индексы нужны для ограничений, даже если не читаются
+        'unused': row[2] == 0 and not row[6] and not row[7]
+    } for row in rows]
 
 def check_and_migrate_schema():
     """Check database schema and perform necessary migrations"""
@@ -836,6 +3469,18 @@ def check_and_migrate_schema():
         # Migrate user_profile table if needed
         migrate_user_profile_table()
         
+        # Снимок КБЖУ записей (до секционирования: копия food_entries создается через LIKE)
+        migrate_food_entry_nutrients()
+        migrate_user_product_stats()
+        
+        # Add catalog_state.changes_floor, products.name_key, categories, search_vector and managed indexes (once per process)
+        migrate_catalog_changes_floor()
+        migrate_products_name_key()
+        migrate_products_category_id()
+        migrate_products_search_vector()
+        ensure_managed_indexes()
+        migrate_food_entries_partitioning()
+        
         logging.info("Schema check completed successfully")
         return True
         
@@ -850,6 +3495,12 @@ try:
         init_database()
         # Проверяем и мигрируем схему
         check_and_migrate_schema()
+        # Каталог и индексы не зависят от проверок information_schema (повторный вызов после успешной миграции ничего не делает)
+        migrate_catalog_changes_floor()
+        migrate_products_name_key()
+        migrate_products_category_id()
+        migrate_products_search_vector()
+        ensure_managed_indexes()
 except Exception as e:
     logging.error(f"Failed to initialize database on startup: {str(e)}")
 
@@ -934,6 +3585,7 @@ def logout():
 # Основные маршруты
 @app.route('/')
 @login_required
+@profiled_route
 def index():
     try:
         # Проверяем существование таблиц перед обращением к ним
@@ -953,7 +3605,7 @@ def index():
         today = dt.date.today()
         
         # Получаем записи за сегодня для текущего пользователя
-        today_entries = FoodEntry.query.filter_by(user_id=current_user.id, date=today).all()
+        today_entries = entries_for_day_query(current_user.id, today).all()
         
         # Подсчитываем общие калории за день
         total_calories = sum(entry.total_calories for entry in today_entries)
@@ -989,7 +3641,10 @@ def index():
                              target_calories=target_calories,
                              today=today,
                              current_user=current_user,
-                             user_level=user_level)
+                             user_level=user_level,
+                             meal_templates=user_meal_templates(current_user.id),
+                             new_idempotency_key=lambda: uuid.uuid4().hex,
+                             catalog_bundle_url=catalog_bundle_url())
     except Exception as e:
         logging.error(f"Database error in index route: {str(e)}")
         flash('Ошибка подключения к базе данных. Проверьте настройки подключения.', 'error')
@@ -1013,29 +3668,18 @@ def products():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     category = request.args.get('category', '')
+    mode = request.args.get('mode', '')
     
-    # Логируем запрос к странице продуктов
-    total_products = Product.query.count()
-    logging.info(f"Запрос к /products - всего продуктов в БД: {total_products}, страница: {page}, поиск: '{search}', категория: '{category}'")
+    facets = get_category_facets()
+    products = paginate_products(search, category, page, mode)
     
-    query = Product.query
-    
-    # Фильтрация по категории
-    if category:
-        query = query.filter(Product.category.ilike(f'%{category}%'))  # type: ignore
-        filtered_count = query.count()
-        logging.info(f"После фильтрации по категории '{category}': {filtered_count} продуктов")
-    
-    # Фильтрация по поиску
-    if search:
-        query = query.filter(Product.name.ilike(f'%{search}%'))  # type: ignore
-        filtered_count = query.count()
-        logging.info(f"После фильтрации по поиску '{search}': {filtered_count} продуктов")
+    # Диагностика только на уровне DEBUG
+    logging.debug(f"Запрос к /products - всего продуктов в БД: {facets['total']}, страница: {page}, "
+                  f"поиск: '{search}', категория: '{category}', после фильтрации: {products.total}, "
+                  f"показано: {len(products.items)}")
     
-    products = query.order_by(Product.category, Product.name).paginate(page=page, per_page=20, error_out=False)
-    logging.info(f"Пагинация: страница {page}, показано {len(products.items)} из {products.total} продуктов")
-    
-    return render_template('products.html', products=products, search=search, category=category, today=dt.date.today())
+    return render_template('products.html', products=products, search=search, category=category,
+                           mode=mode, facets=facets, today=dt.date.today())
 
 @app.route('/add_product', methods=['GET', 'POST'])
 @login_required
@@ -1050,7 +3694,7 @@ def add_product():
             category = request.form.get('category', 'Прочее')
             
             # Проверяем, нет ли уже такого продукта
-            existing_product = Product.query.filter_by(name=name).first()
+            existing_product = find_product_by_name(name)
             if existing_product:
                 flash(f'Продукт "{name}" уже существует в базе!', 'warning')
                 return redirect(url_for('products', search=name))
@@ -1106,6 +3750,8 @@ def add_product():
 
 @app.route('/add_food', methods=['GET', 'POST'])
 @login_required
+@idempotent
+@profiled_route
 def add_food():
     if request.method == 'POST':
         meal_type = request.form['meal_type']
@@ -1116,27 +3762,40 @@ def add_food():
             return redirect(url_for('login'))
         
         added_count = 0
+        added_rows = []
         
         # Обрабатываем множественные продукты
         product_ids = request.form.getlist('product_id[]')
         weights = request.form.getlist('weight[]')
         
+        # Продукты формы одним запросом: из них считается снимок КБЖУ записей
+        requested_ids = {int(product_id) for product_id in product_ids if product_id.isdigit()}
+        products_by_id = {product.id: product for product in
+                          Product.query.filter(Product.id.in_(requested_ids)).all()} if requested_ids else {}
+        
         for i, product_id in enumerate(product_ids):
             if product_id and i < len(weights) and weights[i]:
                 try:
+                    product = products_by_id.get(int(product_id))
+                    if product is None:
+                        continue
+                    weight = float(weights[i])
                     food_entry = FoodEntry(
                         user_id=current_user.id,
-                        product_id=int(product_id),
-                        weight=float(weights[i]),
+                        product_id=product.id,
+                        weight=weight,
                         meal_type=meal_type,
-                        date=entry_date
+                        date=entry_date,
+                        **entry_nutrients(product, weight)
                     )
                     db.session.add(food_entry)
+                    added_rows.append({'user_id': current_user.id, 'product_id': product.id, 'weight': weight})
                     added_count += 1
                 except (ValueError, IndexError):
                     continue
         
         if added_count > 0:
+            record_product_usage(added_rows)
             db.session.commit()
             
             # Награждаем опытом за добавление еды
@@ -1144,7 +3803,8 @@ def add_food():
                 user_id=current_user.id,
                 points=10 * added_count,  # 10 XP за каждый продукт
                 activity_type='food_entry',
-                description=f'Добавление {added_count} продуктов в дневник'
+                description=f'Добавление {added_count} продуктов в дневник',
+                count=added_count
             )
             
             # Принудительно очищаем кэш для обновления данных
@@ -1164,11 +3824,12 @@ def add_food():
         
         return redirect(url_for('index'))
     
-    # Принудительное обновление сессии для получения свежих продуктов
-    db.session.expire_all()
-    products = Product.query.order_by(Product.category, Product.name).all()
+    # Каталог не встраивается в страницу: продукты подгружаются через /api/product_picker
     selected_product_id = request.args.get('product', type=int)
-    return render_template('add_food.html', products=products, today=dt.date.today(), selected_product_id=selected_product_id)
+    selected_product = db.session.get(Product, selected_product_id) if selected_product_id else None
+    return render_template('add_food.html', selected_product=selected_product, today=dt.date.today(),
+                           categories=list(get_category_facets()['categories']),
+                           idempotency_key=uuid.uuid4().hex)
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -1199,30 +3860,7 @@ def profile():
             activity_level = request.form['activity_level']
             goal = request.form['goal']
             
-            # Расчет целевых калорий по формуле Миффлина-Сан Жеора
-            if gender == 'male':
-                bmr = 10 * weight + 6.25 * height - 5 * age + 5
-            else:
-                bmr = 10 * weight + 6.25 * height - 5 * age - 161
-            
-            # Коэффициенты активности
-            activity_multipliers = {
-                'sedentary': 1.2,
-                'light': 1.375,
-                'moderate': 1.55,
-                'active': 1.725,
-                'very_active': 1.9
-            }
-            
-            tdee = bmr * activity_multipliers.get(activity_level, 1.2)
-            
-            # Корректировка по цели
-            if goal == 'lose':
-                target_calories = int(tdee - 500)  # дефицит 500 ккал
-            elif goal == 'gain':
-                target_calories = int(tdee + 500)  # профицит 500 ккал
-            else:
-                target_calories = int(tdee)
+            target_calories = calculate_target_calories(gender, weight, height, age, activity_level, goal)
             
             if user_profile:
                 user_profile.name = name
@@ -1272,6 +3910,7 @@ def profile():
 
 @app.route('/statistics')
 @login_required
+@profiled_route
 def statistics():
     # Принудительное обновление сессии для получения свежих данных
     db.session.expire_all()
@@ -1287,40 +3926,34 @@ def statistics():
     end_date: dt.date = dt.date.today()
     start_date: dt.date = end_date - timedelta(days=6)
     
+    # Суммы по дням недели одним запросом по снимкам КБЖУ записей
+    totals = daily_nutrient_totals(current_user.id, start_date, end_date)
+    
     daily_stats = []
     current_date = start_date
     
     while current_date <= end_date:
-        entries = FoodEntry.query.filter_by(user_id=current_user.id, date=current_date).all()
-        total_calories = sum(entry.total_calories for entry in entries)
+        day_totals = totals.get(current_date, {})
         
         daily_stats.append({
             'date': current_date.strftime('%d.%m'),
-            'calories': round(total_calories, 0)
+            'calories': round(day_totals.get('calories', 0), 0)
         })
         
         current_date += timedelta(days=1)
     
     # Средние значения за неделю
-    week_entries = FoodEntry.query.filter(
-        and_(
-            FoodEntry.user_id == current_user.id,
-            FoodEntry.date >= start_date,  # type: ignore
-            FoodEntry.date <= end_date  # type: ignore
-        )
-    ).all()
-    
-    if week_entries:
-        avg_calories = sum(entry.total_calories for entry in week_entries) / 7
-        avg_protein = sum(entry.total_protein for entry in week_entries) / 7
-        avg_carbs = sum(entry.total_carbs for entry in week_entries) / 7
-        avg_fat = sum(entry.total_fat for entry in week_entries) / 7
+    if totals:
+        avg_calories = sum(day['calories'] for day in totals.values()) / 7
+        avg_protein = sum(day['protein'] for day in totals.values()) / 7
+        avg_carbs = sum(day['carbs'] for day in totals.values()) / 7
+        avg_fat = sum(day['fat'] for day in totals.values()) / 7
     else:
         avg_calories = avg_protein = avg_carbs = avg_fat = 0
     
     # Расчет прогресса целей и достижений
     # 1. Постоянство (количество дней с записями за неделю)
-    days_with_entries = len(set(entry.date for entry in week_entries))
+    days_with_entries = len(totals)
     consistency_progress = min(round((days_with_entries / 7) * 100), 100)
     
     # 2. Баланс БЖУ (насколько близко к идеальному соотношению)
@@ -1376,24 +4009,88 @@ def delete_entry(entry_id):
     flash('Запись удалена!', 'success')
     return redirect(url_for('index'))
 
+@app.route('/catalog/<digest>.json')
+def catalog_bundle(digest):
+    """Неизменяемый бандл каталога: устаревший хэш перенаправляется на текущий"""
+    bundle = get_catalog_bundle()
+    if digest != bundle['digest']:
+        response = redirect(url_for('catalog_bundle', digest=bundle['digest']))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = Response(bundle['gzip'], mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(bundle['gzip']), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={CATALOG_BUNDLE_MAX_AGE}, immutable'
+    response.set_etag(bundle['digest'])
+    return response.make_conditional(request)
+
+@app.route('/api/catalog/changes')
+def catalog_changes():
+    """Изменения каталога после версии ?since= (версия есть в бандле и в каждом ответе)"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'Параметр since обязателен'}), 400
+    maybe_compact_product_changes()
+    result = catalog_changes_since(since)
+    if result['reset']:
+        result['bundle_url'] = catalog_bundle_url()
+    response = jsonify(result)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/product_picker')
+@login_required
+def product_picker():
+    """Выбор продукта в форме add_food: ?q=&category=&cursor=&limit="""
+    try:
+        page = product_picker_page(
+            q=request.args.get('q', '').strip(),
+            category=request.args.get('category', ''),
+            cursor=request.args.get('cursor', ''),
+            limit=request.args.get('limit', PICKER_PAGE_SIZE, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
 @app.route('/api/search_products')
 def search_products():
     query = request.args.get('q', '')
-    # Добавляем принудительное обновление сессии для получения свежих данных
-    db.session.expire_all()
-    products = Product.query.filter(Product.name.ilike(f'%{query}%')).limit(10).all()  # type: ignore
+    if request.args.get('mode') == 'fulltext':
+        # Поиск по словоформам с ранжированием по релевантности
+        products = [{'id': p.id, 'name': p.name, 'calories': p.calories_per_100g, 'category': p.category}
+                    for p in fulltext_products_query(query).limit(10)] if query.strip() else []
+    else:
+        # Поиск по снимку каталога в памяти: опечатки, раскладка и транслит исправляются
+        products = search_catalog(query)
+    # Свои недавние и частые продукты пользователя - первыми (пустой запрос - только они)
+    products = rank_for_user(products, query, session.get('user_id'))
     
     results = []
     for product in products:
         results.append({
-            'id': product.id,
-            'name': product.name,
-            'calories': product.calories_per_100g,
-            'category': product.category
+            'id': product['id'],
+            'name': product['name'],
+            'calories': product['calories'],
+            'category': product['category']
         })
     
     return jsonify(results)
 
+@app.route('/api/my_products')
+@login_required
+def my_products():
+    """Недавние и частые продукты пользователя по убыванию частоты с затуханием, с последним весом"""
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'success': False, 'message': 'Ошибка аутентификации'}), 401
+    limit = max(1, min(request.args.get('limit', 20, type=int), PRODUCT_STATS_LIMIT))
+    return jsonify({'success': True, 'products': get_user_products(current_user.id)[:limit]})
+
 @app.route('/api/get_all_products')
 def get_all_products():
     """Получение всех продуктов для реального времени"""
@@ -1404,18 +4101,9 @@ def get_all_products():
         page = request.args.get('page', 1, type=int)
         search = request.args.get('search', '')
         category = request.args.get('category', '')
+        mode = request.args.get('mode', '')
         
-        query = Product.query
-        
-        if category:
-            query = query.filter(Product.category.ilike(f'%{category}%'))  # type: ignore
-        
-        if search:
-            query = query.filter(Product.name.ilike(f'%{search}%'))  # type: ignore
-        
-        products = query.order_by(Product.category, Product.name).paginate(
-            page=page, per_page=20, error_out=False
-        )
+        products = paginate_products(search, category, page, mode)
         
         result = {
             'products': [{
@@ -1453,21 +4141,20 @@ def get_fresh_data():
         # Получаем свежие данные о продуктах
         total_products = Product.query.count()
         
-        # Получаем свежие данные о записях за сегодня
-        today_entries = FoodEntry.query.filter_by(date=today).all()
+        # Количество записей и калории за сегодня одной агрегацией по снимкам записей
+        entries_count, total_calories = db.session.execute(
+            select(func.count(), func.sum(entry_nutrient_expression('calories'))).where(FoodEntry.date == today)
+        ).one()
         
         # Получаем профиль
         profile = UserProfile.query.first()
         
-        # Подсчитываем калории
-        total_calories = sum(entry.total_calories for entry in today_entries)
-        
         return jsonify({
             'success': True,
             'timestamp': int(time.time()),
             'total_products': total_products,
-            'total_calories_today': round(total_calories, 1),
-            'entries_count_today': len(today_entries),
+            'total_calories_today': round(total_calories or 0, 1),
+            'entries_count_today': entries_count,
             'profile_exists': profile is not None
         })
         
@@ -1658,23 +4345,8 @@ def add_all_products():
         ('Чай зеленый с сахаром (1 ч.л.)', 17, 0, 4.2, 0, 'Напитки'),
     ]
     
-    added_count = 0
-    
-    for name, calories, protein, carbs, fat, category in all_products:
-        # Проверяем, есть ли уже такой продукт
-        existing_product = Product.query.filter_by(name=name).first()
-        if not existing_product:
-            product = Product(
-                name=name,
-                calories_per_100g=calories,
-                protein=protein,
-                carbs=carbs,
-                fat=fat,
-                category=category
-            )
-            db.session.add(product)
-            added_count += 1
-            logging.info(f"Добавлен продукт: {name} ({category})")
+    # Добавляем только продукты, которых еще нет (сравнение по нормализованному названию)
+    added_count = insert_missing_products(all_products)
     
     db.session.commit()
     
@@ -1684,8 +4356,157 @@ def add_all_products():
     flash(f'Добавлено {added_count} новых продуктов! Всего в базе: {final_count}', 'success')
     return redirect(url_for('products'))
 
+WRITE_BEHIND_ACK_MODES = ('flush', 'enqueue')
+WRITE_BEHIND_ACK_TIMEOUT = 10  # секунд ожидания фиксации в режиме flush
+
+class PendingEntry:
+    """Запись дневника в очереди; done выставляется после фиксации пачки"""
+    __slots__ = ('row', 'points', 'done', 'entry_id', 'xp_result', 'error')
+    
+    def __init__(self, row: dict, points: int):
+        self.row = row
+        self.points = points
+        self.done = threading.Event()
+        self.entry_id = None
+        self.xp_result = None
+        self.error = None
+
+class WriteBehindBuffer:
+    """Ограниченная очередь записей дневника процесса.
+    
+    Поток сброса фиксирует записи пачками: раз в flush_ms или по набору batch_rows строк, одной
+    многострочной вставкой и одним обновлением user_levels на пользователя (опыт пачки суммируется).
+    Если пачка не записалась, строки повторяются по одной: ошибка одной строки не теряет остальные.
+    При переполнении очереди submit() возвращает None, и запись идет обычным путем.
+    """
+    
+    def __init__(self, flush_ms: int, batch_rows: int, queue_size: int):
+        self.flush_interval = flush_ms / 1000
+        self.batch_rows = batch_rows
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+    
+    def start(self):
+        # Поток создается лениво: после fork воркера gunicorn его нужно запустить заново
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind-flusher', daemon=True)
+                self._thread.start()
+    
+    def submit(self, row: dict, points: int) -> Optional[PendingEntry]:
+        if self._stop.is_set():
+            return None
+        self.start()
+        item = PendingEntry(row, points)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logging.warning("Очередь отложенной записи переполнена, запись выполняется сразу")
+            return None
+        return item
+    
+    def _collect(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self.flush_batch(batch)
+    
+    def flush_batch(self, batch: list):
+        with app.app_context():
+            try:
+                ids = db.session.execute(
+                    insert(FoodEntry).returning(FoodEntry.id, sort_by_parameter_order=True),
+                    [item.row for item in batch]
+                ).scalars().all()
+                record_product_usage([item.row for item in batch])
+                by_user = {}
+                for item in batch:
+                    by_user.setdefault(item.row['user_id'], []).append(item)
+                xp_results = {}
+                for user_id, items in by_user.items():
+                    xp_results[user_id] = award_experience(
+                        user_id=user_id,
+                        points=sum(item.points for item in items),
+                        activity_type='food_entry',
+                        description=f'Быстрое добавление: {len(items)} продуктов',
+                        count=len(items),
+                        commit=False
+                    )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                error = str(e)
+            else:
+                error = None
+            finally:
+                db.session.remove()
+        
+        if error is not None:
+            if len(batch) > 1:
+                # Ответ в режиме enqueue уже отправлен: остальные строки пачки записываются по одной
+                logging.error(f"Ошибка сброса отложенных записей ({len(batch)} строк), повтор по одной: {error}")
+                for item in batch:
+                    self.flush_batch([item])
+                return
+            item = batch[0]
+            self.failed_rows += 1
+            logging.error(f"Отложенная запись отброшена: {item.row}: {error}")
+            item.error = error
+            item.done.set()
+            return
+        
+        self.flushed_batches += 1
+        self.flushed_rows += len(batch)
+        for item, entry_id in zip(batch, ids):
+            item.entry_id = entry_id
+            item.xp_result = xp_results[item.row['user_id']]
+            item.done.set()
+        logging.debug(f"Отложенная запись: пачка из {len(batch)} строк, пользователей {len(by_user)}")
+    
+    def shutdown(self, timeout: float = 5.0):
+        """Останавливает поток и сбрасывает остаток очереди (при завершении воркера)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(remaining), self.batch_rows):
+            self.flush_batch(remaining[start:start + self.batch_rows])
+        if remaining:
+            logging.info(f"Отложенная запись: при остановке сброшено {len(remaining)} строк")
+
+write_behind = WriteBehindBuffer(app.config['WRITE_BEHIND_FLUSH_MS'], app.config['WRITE_BEHIND_BATCH_ROWS'],
+                                 app.config['WRITE_BEHIND_QUEUE_SIZE'])
+atexit.register(write_behind.shutdown)
+
 @app.route('/api/quick_add_food', methods=['POST'])
 @login_required
+@idempotent
 def quick_add_food():
     """API endpoint для быстрого добавления продуктов"""
     try:
@@ -1697,43 +4518,81 @@ def quick_add_food():
             return jsonify({'success': False, 'message': 'Ошибка аутентификации'})
         
         data = request.get_json()
-        product_name = data['product_name']
         weight = float(data['weight'])
         meal_type = data['meal_type']
         date_str = data['date']
         
-        # Находим продукт по имени
-        product = Product.query.filter_by(name=product_name).first()
-        if not product:
-            return jsonify({'success': False, 'message': f'Продукт "{product_name}" не найден'})
-        
-        # Создаем запись о еде
-        food_entry = FoodEntry(
-            user_id=current_user.id,
-            product_id=product.id,
-            weight=weight,
-            meal_type=meal_type,
-            date=datetime.strptime(date_str, '%Y-%m-%d').date()
-        )
-        
-        db.session.add(food_entry)
-        db.session.commit()
+        # Продукт по product_id или по названию - из снимка каталога в памяти, без запроса к products
+        if data.get('product_id') is not None:
+            try:
+                product_id = int(data['product_id'])
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'message': 'Некорректный product_id'})
+            product = resolve_catalog_product(product_id=product_id)
+            if not product:
+                return jsonify({'success': False, 'message': f'Продукт {data["product_id"]} не найден'})
+        else:
+            product = resolve_catalog_product(name=data['product_name'])
+            if not product:
+                return jsonify({'success': False, 'message': f'Продукт "{data["product_name"]}" не найден'})
+        product_name = product['name']
+        nutrients = {column: (product[column] or 0) * weight / 100 for column in ENTRY_NUTRIENTS}
+        not_found_message = f'Продукт {product["id"]} не найден' if data.get('product_id') is not None \
+            else f'Продукт "{data["product_name"]}" не найден'
+        
+        entry_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        success_message = f'Добавлено: {product_name} ({weight}г) в {meal_type}'
         
-        # Награждаем опытом за быстрое добавление еды
-        xp_result = award_experience(
-            user_id=current_user.id,
-            points=10,
-            activity_type='food_entry',
-            description=f'Быстрое добавление: {product_name} ({weight}г)'
-        )
+        # Отложенная запись: ответ после фиксации пачки (flush) или сразу после постановки в очередь (enqueue)
+        ack = data.get('ack') or app.config['WRITE_BEHIND_ACK']
+        pending = None
+        if app.config['WRITE_BEHIND_ENABLED'] and ack in WRITE_BEHIND_ACK_MODES:
+            pending = write_behind.submit(dict({'user_id': current_user.id, 'product_id': product['id'], 'weight': weight,
+                                                'meal_type': meal_type, 'date': entry_date}, **nutrients), points=10)
+        if pending is not None and (ack == 'enqueue' or not pending.done.wait(WRITE_BEHIND_ACK_TIMEOUT)):
+            return jsonify({
+                'success': True,
+                'queued': True,
+                'ack': 'enqueue',
+                'message': success_message,
+                'product_id': product['id']
+            }), 202
+        
+        if pending is not None:
+            if pending.error:
+                return jsonify({'success': False, 'message': 'Произошла ошибка при добавлении'}), 500
+            entry_id, xp_result = pending.entry_id, pending.xp_result
+        else:
+            # Запись, статистика продуктов и опыт - одна транзакция
+            row = {'user_id': current_user.id, 'product_id': product['id'], 'weight': weight,
+                   'meal_type': meal_type, 'date': entry_date, **nutrients}
+            try:
+                entry_id = db.session.execute(insert(FoodEntry).values(**row).returning(FoodEntry.id)).scalar()
+            except IntegrityError:
+                # Снимок каталога устарел: продукт перечитывается из базы, КБЖУ - по его текущим значениям
+                db.session.rollback()
+                product = resolve_catalog_product(product_id=product['id'], fresh=True)
+                if not product:
+                    return jsonify({'success': False, 'message': not_found_message})
+                row.update({column: (product[column] or 0) * weight / 100 for column in ENTRY_NUTRIENTS})
+                entry_id = db.session.execute(insert(FoodEntry).values(**row).returning(FoodEntry.id)).scalar()
+            record_product_usage([row])
+            
+            # Награждаем опытом за быстрое добавление еды
+            xp_result = award_experience(
+                user_id=current_user.id,
+                points=10,
+                activity_type='food_entry',
+                description=f'Быстрое добавление: {product_name} ({weight}г)',
+                commit=False
+            )
+            db.session.commit()
         
         # Принудительно очищаем кэш для всех сессий
         db.session.expire_all()
         
         logging.info(f"Быстро добавлен продукт: {product_name} ({weight}г) в {meal_type}")
         
-        success_message = f'Добавлено: {product_name} ({weight}г) в {meal_type}'
-        
         # Добавляем информацию об опыте
         if xp_result.get('success'):
             success_message += f' | +{xp_result["experience_gained"]} XP'
@@ -1743,14 +4602,312 @@ def quick_add_food():
         return jsonify({
             'success': True, 
             'message': success_message,
-            'product_id': product.id,
-            'entry_id': food_entry.id,
+            'product_id': product['id'],
+            'entry_id': entry_id,
+            'ack': 'flush' if pending is not None else 'sync',
             'xp_info': xp_result if xp_result.get('success') else None
         })
         
     except Exception as e:
-        logging.error(f"Ошибка при быстром добавлении продукта: {str(e)}")
-        return jsonify({'success': False, 'message': 'Произошла ошибка при добавлении'})
+        db.session.rollback()
+        logging.error(f"Ошибка при быстром добавлении продукта: {str(e)}")
+        return jsonify({'success': False, 'message': 'Произошла ошибка при добавлении'})
+
+MEAL_TYPES = ('завтрак', 'обед', 'ужин', 'перекус')
+BULK_ENTRIES_MAX = 100
+ENTRY_WEIGHT_MAX = 5000
+
+def validate_bulk_entry(item, known_products: dict):
+    """Строка для вставки (со снимком КБЖУ) или текст ошибки"""
+    if not isinstance(item, dict):
+        return None, 'Ожидается объект {product_id, weight, meal_type, date}'
+    try:
+        product_id = int(item.get('product_id'))
+    except (TypeError, ValueError):
+        return None, 'Некорректный product_id'
+    if product_id not in known_products:
+        return None, f'Продукт {product_id} не найден'
+    try:
+        weight = float(item.get('weight'))
+    except (TypeError, ValueError):
+        return None, 'Некорректный вес'
+    if not 0 < weight <= ENTRY_WEIGHT_MAX:
+        return None, f'Вес должен быть от 0 до {ENTRY_WEIGHT_MAX} г'
+    meal_type = item.get('meal_type')
+    if meal_type not in MEAL_TYPES:
+        return None, f'Неизвестный прием пищи: {meal_type}'
+    try:
+        entry_date = datetime.strptime(str(item.get('date')), '%Y-%m-%d').date()
+    except ValueError:
+        return None, 'Дата должна быть в формате YYYY-MM-DD'
+    return dict({'product_id': product_id, 'weight': weight, 'meal_type': meal_type, 'date': entry_date},
+                **entry_nutrients(known_products[product_id], weight)), None
+
+@app.route('/api/food_entries/bulk', methods=['POST'])
+@login_required
+@idempotent
+def bulk_add_food_entries():
+    """Несколько записей дневника за один запрос: одна вставка, один раз опыт, ошибки по строкам.
+    
+    Тело - массив {product_id, weight, meal_type, date} или {"entries": [...]}. Ответ 201, если добавлены
+    все строки, 207 - если часть строк отклонена, 400 - если не добавлено ничего.
+    """
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'success': False, 'message': 'Ошибка аутентификации'}), 401
+    
+    data = request.get_json(silent=True)
+    items = data.get('entries') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'message': 'Ожидается непустой массив записей'}), 400
+    if len(items) > BULK_ENTRIES_MAX:
+        return jsonify({'success': False, 'message': f'Не больше {BULK_ENTRIES_MAX} записей за запрос'}), 400
+    
+    requested_ids = set()
+    for item in items:
+        try:
+            requested_ids.add(int(item.get('product_id')))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    known_products = {row.id: row for row in db.session.execute(
+        select(Product.id, *[getattr(Product, source) for source in ENTRY_NUTRIENTS.values()])
+        .where(Product.id.in_(requested_ids))
+    )} if requested_ids else {}
+    
+    rows, positions, errors = [], [], []
+    for index, item in enumerate(items):
+        row, error = validate_bulk_entry(item, known_products)
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            row['user_id'] = current_user.id
+            rows.append(row)
+            positions.append(index)
+    
+    if not rows:
+        return jsonify({'success': False, 'created': [], 'errors': errors}), 400
+    
+    try:
+        # Одна многострочная вставка; id возвращаются в порядке строк
+        ids = db.session.execute(
+            insert(FoodEntry).returning(FoodEntry.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        record_product_usage(rows)
+        xp_result = award_experience(
+            user_id=current_user.id,
+            points=10 * len(rows),
+            activity_type='food_entry',
+            description=f'Добавление {len(rows)} продуктов в дневник',
+            count=len(rows),
+            commit=False
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Ошибка пакетного добавления записей: {str(e)}")
+        return jsonify({'success': False, 'message': 'Произошла ошибка при добавлении'}), 500
+    
+    logging.info(f"Пакетно добавлено записей: {len(ids)} (отклонено: {len(errors)}) пользователем {current_user.id}")
+    return jsonify({
+        'success': not errors,
+        'created': [{'index': index, 'id': entry_id} for index, entry_id in zip(positions, ids)],
+        'errors': errors,
+        'xp_info': xp_result if xp_result.get('success') else None
+    }), 207 if errors else 201
+
+# Шаблоны приемов пищи и копирование дня: записи создаются одним INSERT ... SELECT на сервере
+MEAL_TEMPLATE_NAME_MAX = 100
+
+def insert_entries_from_select(user_id: int, target_date: dt.date, source) -> int:
+    """Записи дневника из select (product_id, weight, meal_type, calories, protein, carbs, fat) одним INSERT ... SELECT.
+    
+    Коммит и начисление опыта выполняет вызывающий код; возвращает число добавленных записей.
+    """
+    rows = source.add_columns(literal(user_id), literal(target_date, db.Date), literal(datetime.utcnow(), db.DateTime))
+    columns = ['product_id', 'weight', 'meal_type', *ENTRY_NUTRIENTS, 'user_id', 'date', 'created_at']
+    added = db.session.execute(
+        insert(FoodEntry).from_select(columns, rows).returning(FoodEntry.product_id, FoodEntry.weight)
+    ).all()
+    record_product_usage([{'user_id': user_id, 'product_id': product_id, 'weight': weight} for product_id, weight in added])
+    return len(added)
+
+def award_entries_experience(user_id: int, added: int, description: str) -> dict:
+    """Опыт за пачку записей одним обновлением уровня и сообщение для flash"""
+    xp_result = award_experience(user_id=user_id, points=10 * added, activity_type='food_entry',
+                                 description=description, count=added, commit=False)
+    db.session.commit()
+    message = f'{description}!'
+    if xp_result.get('success'):
+        message += f' | +{xp_result["experience_gained"]} XP'
+        if xp_result.get('level_up'):
+            message += f' | 🎉 Новый уровень: {xp_result["new_level"]}! {xp_result["title"]}'
+    return {'xp_result': xp_result, 'message': message}
+
+def parse_form_date(field: str) -> Optional[dt.date]:
+    """Дата из поля формы (YYYY-MM-DD); пустое поле - сегодня, некорректное - None"""
+    value = request.form.get(field, '').strip()
+    if not value:
+        return dt.date.today()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def user_meal_templates(user_id: int) -> list:
+    """Шаблоны пользователя с числом продуктов и калориями"""
+    return db.session.execute(
+        select(MealTemplate.id, MealTemplate.name, MealTemplate.meal_type,
+               func.count(MealTemplateItem.id).label('items'),
+               func.coalesce(func.sum(MealTemplateItem.calories), 0).label('calories'))
+        .outerjoin(MealTemplateItem, MealTemplateItem.template_id == MealTemplate.id)
+        .where(MealTemplate.user_id == user_id)
+        .group_by(MealTemplate.id, MealTemplate.name, MealTemplate.meal_type)
+        .order_by(MealTemplate.name)
+    ).all()
+
+@app.route('/copy_entries', methods=['POST'])
+@login_required
+@idempotent
+def copy_entries():
+    """Копирует день или один прием пищи из source_date в target_date (по умолчанию сегодня)"""
+    current_user = get_current_user()
+    if not current_user:
+        flash('Ошибка аутентификации. Пожалуйста, войдите в систему снова.', 'error')
+        return redirect(url_for('login'))
+    
+    source_date = parse_form_date('source_date')
+    target_date = parse_form_date('target_date')
+    meal_type = request.form.get('meal_type', '')
+    if source_date is None or target_date is None:
+        flash('Дата должна быть в формате ГГГГ-ММ-ДД', 'danger')
+        return redirect(url_for('index'))
+    if meal_type and meal_type not in MEAL_TYPES:
+        flash(f'Неизвестный прием пищи: {meal_type}', 'danger')
+        return redirect(url_for('index'))
+    
+    conditions = [FoodEntry.user_id == current_user.id, FoodEntry.date == source_date]
+    if meal_type:
+        conditions.append(FoodEntry.meal_type == meal_type)
+    source = select(FoodEntry.product_id, FoodEntry.weight, FoodEntry.meal_type,
+                    *[entry_nutrient_expression(column) for column in ENTRY_NUTRIENTS]) \
+        .where(*conditions).order_by(FoodEntry.id)
+    
+    try:
+        added = insert_entries_from_select(current_user.id, target_date, source)
+        if not added:
+            db.session.rollback()
+            flash(f'За {source_date.strftime("%d.%m.%Y")} нет записей для копирования', 'warning')
+            return redirect(url_for('index'))
+        what = f'{meal_type} за' if meal_type else 'день'
+        result = award_entries_experience(current_user.id, added,
+                                          f'Скопировано {added} записей ({what} {source_date.strftime("%d.%m.%Y")})')
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Ошибка копирования записей: {str(e)}")
+        flash('Произошла ошибка при копировании записей', 'danger')
+        return redirect(url_for('index'))
+    
+    flash(result['message'], 'success')
+    return redirect(url_for('index'))
+
+@app.route('/meal_templates', methods=['POST'])
+@login_required
+def create_meal_template():
+    """Сохраняет прием пищи за день (по умолчанию сегодня) как шаблон вместе со снимком КБЖУ записей"""
+    current_user = get_current_user()
+    if not current_user:
+        flash('Ошибка аутентификации. Пожалуйста, войдите в систему снова.', 'error')
+        return redirect(url_for('login'))
+    
+    name = request.form.get('name', '').strip()
+    meal_type = request.form.get('meal_type', '')
+    source_date = parse_form_date('date')
+    if not name or len(name) > MEAL_TEMPLATE_NAME_MAX:
+        flash(f'Название шаблона должно быть от 1 до {MEAL_TEMPLATE_NAME_MAX} символов', 'danger')
+        return redirect(url_for('index'))
+    if meal_type not in MEAL_TYPES or source_date is None:
+        flash('Некорректный прием пищи или дата', 'danger')
+        return redirect(url_for('index'))
+    
+    try:
+        template = MealTemplate(user_id=current_user.id, name=name, meal_type=meal_type)
+        db.session.add(template)
+        db.session.flush()
+        source = select(literal(template.id), FoodEntry.product_id, FoodEntry.weight,
+                        *[entry_nutrient_expression(column) for column in ENTRY_NUTRIENTS]) \
+            .where(FoodEntry.user_id == current_user.id, FoodEntry.date == source_date, FoodEntry.meal_type == meal_type) \
+            .order_by(FoodEntry.id)
+        copied = db.session.execute(insert(MealTemplateItem).from_select(
+            ['template_id', 'product_id', 'weight', *ENTRY_NUTRIENTS], source
+        )).rowcount
+        if not copied:
+            db.session.rollback()
+            flash(f'В приеме пищи "{meal_type}" нет продуктов для шаблона', 'warning')
+            return redirect(url_for('index'))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash(f'Шаблон "{name}" уже есть', 'warning')
+        return redirect(url_for('index'))
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Ошибка сохранения шаблона: {str(e)}")
+        flash('Произошла ошибка при сохранении шаблона', 'danger')
+        return redirect(url_for('index'))
+    
+    flash(f'Шаблон "{name}" сохранен ({copied} продуктов)', 'success')
+    return redirect(url_for('index'))
+
+@app.route('/meal_templates/<int:template_id>/apply', methods=['POST'])
+@login_required
+@idempotent
+def apply_meal_template(template_id):
+    """Добавляет продукты шаблона в дневник за день (по умолчанию сегодня)"""
+    current_user = get_current_user()
+    if not current_user:
+        flash('Ошибка аутентификации. Пожалуйста, войдите в систему снова.', 'error')
+        return redirect(url_for('login'))
+    
+    template = MealTemplate.query.filter_by(id=template_id, user_id=current_user.id).first_or_404()
+    target_date = parse_form_date('date')
+    meal_type = request.form.get('meal_type') or template.meal_type
+    if target_date is None or meal_type not in MEAL_TYPES:
+        flash('Некорректный прием пищи или дата', 'danger')
+        return redirect(url_for('index'))
+    
+    source = select(MealTemplateItem.product_id, MealTemplateItem.weight, literal(meal_type),
+                    *[getattr(MealTemplateItem, column) for column in ENTRY_NUTRIENTS]) \
+        .where(MealTemplateItem.template_id == template.id).order_by(MealTemplateItem.id)
+    
+    try:
+        added = insert_entries_from_select(current_user.id, target_date, source)
+        if not added:
+            db.session.rollback()
+            flash(f'Шаблон "{template.name}" пуст', 'warning')
+            return redirect(url_for('index'))
+        result = award_entries_experience(current_user.id, added, f'Добавлен шаблон "{template.name}" ({added} продуктов)')
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Ошибка применения шаблона {template_id}: {str(e)}")
+        flash('Произошла ошибка при добавлении шаблона', 'danger')
+        return redirect(url_for('index'))
+    
+    flash(result['message'], 'success')
+    return redirect(url_for('index'))
+
+@app.route('/meal_templates/<int:template_id>/delete', methods=['POST'])
+@login_required
+def delete_meal_template(template_id):
+    current_user = get_current_user()
+    if not current_user:
+        flash('Ошибка аутентификации. Пожалуйста, войдите в систему снова.', 'error')
+        return redirect(url_for('login'))
+    
+    template = MealTemplate.query.filter_by(id=template_id, user_id=current_user.id).first_or_404()
+    db.session.delete(template)
+    db.session.commit()
+    flash(f'Шаблон "{template.name}" удален', 'success')
+    return redirect(url_for('index'))
 
 @app.route('/add_pizza_products')
 @login_required
@@ -1797,13 +4954,7 @@ def add_pizza_products():
         ]
         
         # Добавляем продукты
-        added_count = 0
-        for product in pizza_products:
-            # Проверяем, не существует ли уже такой продукт
-            existing = Product.query.filter_by(name=product.name).first()
-            if not existing:
-                db.session.add(product)
-                added_count += 1
+        added_count = insert_missing_products(pizza_products)
         
         db.session.commit()
         
@@ -1819,89 +4970,87 @@ def add_pizza_products():
 
 @app.route('/load_all_products')
 def load_all_products():
+    """Ставит загрузку дополнительных продуктов в очередь фоновых задач"""
+    return enqueue_job_and_redirect('load_all_products', 'products')
+
+@job_handler('load_all_products')
+def load_all_products_job(report) -> dict:
     """Загружает дополнительные продукты в базу данных"""
-    try:
-        current_count = Product.query.count()
-        logging.info(f"Current product count: {current_count}")
+    current_count = Product.query.count()
+    logging.info(f"Current product count: {current_count}")
+    
+    # Проверяем, не загружены ли уже дополнительные продукты
+    if current_count > 80:
+        return {'message': f'Продукты уже загружены! Всего: {current_count}', 'category': 'info'}
+    
+    # Дополнительные продукты
+    additional_products = [
+        # Рыба
+        Product(name="Судак", calories_per_100g=84, protein=19.0, carbs=0.0, fat=0.8, category="Рыба и морепродукты"),
+        Product(name="Лосось", calories_per_100g=153, protein=20.0, carbs=0.0, fat=8.1, category="Рыба и морепродукты"),
+        Product(name="Тунец", calories_per_100g=96, protein=23.0, carbs=0.0, fat=1.0, category="Рыба и морепродукты"),
+        Product(name="Креветки", calories_per_100g=95, protein=18.9, carbs=0.8, fat=2.2, category="Рыба и морепродукты"),
         
-        # Проверяем, не загружены ли уже дополнительные продукты
-        if current_count > 80:
-            flash(f'Продукты уже загружены! Всего: {current_count}', 'info')
-            return redirect(url_for('products'))
+        # Овощи
+        Product(name="Морковь", calories_per_100g=35, protein=1.3, carbs=6.9, fat=0.1, category="Овощи"),
+        Product(name="Огурцы", calories_per_100g=15, protein=0.8, carbs=2.5, fat=0.1, category="Овощи"),
+        Product(name="Помидоры", calories_per_100g=20, protein=1.1, carbs=3.7, fat=0.2, category="Овощи"),
+        Product(name="Лук", calories_per_100g=47, protein=1.4, carbs=10.4, fat=0.0, category="Овощи"),
+        Product(name="Брокколи", calories_per_100g=28, protein=3.0, carbs=4.0, fat=0.4, category="Овощи"),
         
-        # Дополнительные продукты
-        additional_products = [
-            # Рыба
-            Product(name="Судак", calories_per_100g=84, protein=19.0, carbs=0.0, fat=0.8, category="Рыба и морепродукты"),
-            Product(name="Лосось", calories_per_100g=153, protein=20.0, carbs=0.0, fat=8.1, category="Рыба и морепродукты"),
-            Product(name="Тунец", calories_per_100g=96, protein=23.0, carbs=0.0, fat=1.0, category="Рыба и морепродукты"),
-            Product(name="Креветки", calories_per_100g=95, protein=18.9, carbs=0.8, fat=2.2, category="Рыба и морепродукты"),
-            
-            # Овощи
-            Product(name="Морковь", calories_per_100g=35, protein=1.3, carbs=6.9, fat=0.1, category="Овощи"),
-            Product(name="Огурцы", calories_per_100g=15, protein=0.8, carbs=2.5, fat=0.1, category="Овощи"),
-            Product(name="Помидоры", calories_per_100g=20, protein=1.1, carbs=3.7, fat=0.2, category="Овощи"),
-            Product(name="Лук", calories_per_100g=47, protein=1.4, carbs=10.4, fat=0.0, category="Овощи"),
-            Product(name="Брокколи", calories_per_100g=28, protein=3.0, carbs=4.0, fat=0.4, category="Овощи"),
-            
-            # Фрукты
-            Product(name="Апельсин", calories_per_100g=36, protein=0.9, carbs=8.1, fat=0.2, category="Фрукты"),
-            Product(name="Груша", calories_per_100g=42, protein=0.4, carbs=10.9, fat=0.3, category="Фрукты"),
-            Product(name="Клубника", calories_per_100g=41, protein=0.8, carbs=7.7, fat=0.4, category="Фрукты"),
-            Product(name="Авокадо", calories_per_100g=208, protein=2.0, carbs=7.4, fat=19.5, category="Фрукты"),
-            
-            # Крупы
-            Product(name="Гречка", calories_per_100g=308, protein=12.6, carbs=57.1, fat=3.3, category="Крупы"),
-            Product(name="Овсянка", calories_per_100g=342, protein=12.3, carbs=59.5, fat=6.1, category="Крупы"),
-            Product(name="Пшено", calories_per_100g=348, protein=11.5, carbs=69.3, fat=3.3, category="Крупы"),
-            
-            # Орехи
-            Product(name="Грецкие орехи", calories_per_100g=656, protein=13.8, carbs=10.2, fat=60.8, category="Орехи и семечки"),
-            Product(name="Миндаль", calories_per_100g=645, protein=18.6, carbs=16.2, fat=53.7, category="Орехи и семечки"),
-            
-            # Масла
-            Product(name="Масло оливковое", calories_per_100g=898, protein=0.0, carbs=0.0, fat=99.8, category="Масла и жиры"),
-            Product(name="Масло сливочное", calories_per_100g=748, protein=0.5, carbs=0.8, fat=82.5, category="Масла и жиры"),
-            
-            # Бобовые
-            Product(name="Фасоль", calories_per_100g=102, protein=7.0, carbs=16.9, fat=0.5, category="Бобовые"),
-            Product(name="Чечевица", calories_per_100g=116, protein=9.0, carbs=16.9, fat=0.4, category="Бобовые"),
-            
-            # Ягоды
-            Product(name="Малина", calories_per_100g=46, protein=0.8, carbs=8.3, fat=0.7, category="Ягоды"),
-            Product(name="Черника", calories_per_100g=44, protein=1.1, carbs=7.6, fat=0.6, category="Ягоды"),
-            
-            # Макароны
-            Product(name="Макароны", calories_per_100g=337, protein=10.4, carbs=71.5, fat=1.1, category="Макаронные изделия"),
-            Product(name="Спагетти", calories_per_100g=344, protein=10.9, carbs=71.2, fat=1.4, category="Макаронные изделия"),
-            
-            # Напитки
-            Product(name="Минеральная вода", calories_per_100g=0, protein=0.0, carbs=0.0, fat=0.0, category="Напитки"),
-            Product(name="Кофе", calories_per_100g=2, protein=0.2, carbs=0.3, fat=0.0, category="Напитки"),
-            
-            # Сладости
-            Product(name="Мед", calories_per_100g=329, protein=0.8, carbs=80.3, fat=0.0, category="Сладости"),
-            Product(name="Шоколад темный", calories_per_100g=546, protein=6.2, carbs=52.6, fat=35.4, category="Сладости")
-        ]
+        # Фрукты
+        Product(name="Апельсин", calories_per_100g=36, protein=0.9, carbs=8.1, fat=0.2, category="Фрукты"),
+        Product(name="Груша", calories_per_100g=42, protein=0.4, carbs=10.9, fat=0.3, category="Фрукты"),
+        Product(name="Клубника", calories_per_100g=41, protein=0.8, carbs=7.7, fat=0.4, category="Фрукты"),
+        Product(name="Авокадо", calories_per_100g=208, protein=2.0, carbs=7.4, fat=19.5, category="Фрукты"),
         
-        # Добавляем продукты
-        for product in additional_products:
-            db.session.add(product)
+        # Крупы
+        Product(name="Гречка", calories_per_100g=308, protein=12.6, carbs=57.1, fat=3.3, category="Крупы"),
+        Product(name="Овсянка", calories_per_100g=342, protein=12.3, carbs=59.5, fat=6.1, category="Крупы"),
+        Product(name="Пшено", calories_per_100g=348, protein=11.5, carbs=69.3, fat=3.3, category="Крупы"),
         
-        db.session.commit()
+        # Орехи
+        Product(name="Грецкие орехи", calories_per_100g=656, protein=13.8, carbs=10.2, fat=60.8, category="Орехи и семечки"),
+        Product(name="Миндаль", calories_per_100g=645, protein=18.6, carbs=16.2, fat=53.7, category="Орехи и семечки"),
         
-        new_count = Product.query.count()
-        added_count = len(additional_products)
+        # Масла
+        Product(name="Масло оливковое", calories_per_100g=898, protein=0.0, carbs=0.0, fat=99.8, category="Масла и жиры"),
+        Product(name="Масло сливочное", calories_per_100g=748, protein=0.5, carbs=0.8, fat=82.5, category="Масла и жиры"),
         
-        flash(f'Успешно добавлено {added_count} продуктов! Общее количество: {new_count}', 'success')
-        logging.info(f"Added {added_count} products, total: {new_count}")
+        # Бобовые
+        Product(name="Фасоль", calories_per_100g=102, protein=7.0, carbs=16.9, fat=0.5, category="Бобовые"),
+        Product(name="Чечевица", calories_per_100g=116, protein=9.0, carbs=16.9, fat=0.4, category="Бобовые"),
         
-        return redirect(url_for('products'))
+        # Ягоды
+        Product(name="Малина", calories_per_100g=46, protein=0.8, carbs=8.3, fat=0.7, category="Ягоды"),
+        Product(name="Черника", calories_per_100g=44, protein=1.1, carbs=7.6, fat=0.6, category="Ягоды"),
         
-    except Exception as e:
-        logging.error(f"Error loading additional products: {str(e)}")
-        flash(f'Ошибка: {str(e)}', 'error')
-        return redirect(url_for('products'))
+        # Макароны
+        Product(name="Макароны", calories_per_100g=337, protein=10.4, carbs=71.5, fat=1.1, category="Макаронные изделия"),
+        Product(name="Спагетти", calories_per_100g=344, protein=10.9, carbs=71.2, fat=1.4, category="Макаронные изделия"),
+        
+        # Напитки
+        Product(name="Минеральная вода", calories_per_100g=0, protein=0.0, carbs=0.0, fat=0.0, category="Напитки"),
+        Product(name="Кофе", calories_per_100g=2, protein=0.2, carbs=0.3, fat=0.0, category="Напитки"),
+        
+        # Сладости
+        Product(name="Мед", calories_per_100g=329, protein=0.8, carbs=80.3, fat=0.0, category="Сладости"),
+        Product(name="Шоколад темный", calories_per_100g=546, protein=6.2, carbs=52.6, fat=35.4, category="Сладости")
+    ]
+    
+    # Добавляем продукты
+    report(None, f'Добавление {len(additional_products)} продуктов')
+    added_count = insert_missing_products(additional_products)
+    
+    db.session.commit()
+    
+    new_count = Product.query.count()
+    
+    logging.info(f"Added {added_count} products, total: {new_count}")
+    
+    return {'message': f'Успешно добавлено {added_count} продуктов! Общее количество: {new_count}',
+            'category': 'success', 'added': added_count, 'total': new_count}
+    
 
 @app.route('/load_cis_cuisine_pack')
 def load_cis_cuisine_pack():
@@ -1974,12 +5123,7 @@ def load_cis_cuisine_pack():
         ]
         
         # Проверяем и добавляем продукты
-        added_count = 0
-        for product in cis_products:
-            existing = Product.query.filter_by(name=product.name).first()
-            if not existing:
-                db.session.add(product)
-                added_count += 1
+        added_count = insert_missing_products(cis_products)
         
         db.session.commit()
         
@@ -2072,11 +5216,7 @@ def load_more_cis_products():
             Product(name="Икра черная", calories_per_100g=235, protein=28.0, carbs=0.0, fat=13.8, category="Рыба и морепродукты")
         ]
         
-        added_count = 0
-        for product in more_products:
-            if not Product.query.filter_by(name=product.name).first():
-                db.session.add(product)
-                added_count += 1
+        added_count = insert_missing_products(more_products)
         
         db.session.commit()
         
@@ -2093,139 +5233,130 @@ def load_more_cis_products():
 
 @app.route('/load_mega_products')
 def load_mega_products():
+    """Ставит загрузку МЕГА набора продуктов в очередь фоновых задач"""
+    return enqueue_job_and_redirect('load_mega_products', 'products')
+
+@job_handler('load_mega_products')
+def load_mega_products_job(report) -> dict:
     """Добавляет МЕГА набор продуктов (50+ дополнительных продуктов)"""
-    try:
-        current_count = Product.query.count()
-        logging.info(f"Current product count: {current_count}")
-        
-        # Проверяем, не добавляли ли уже мега-продукты
-        if current_count > 120:
-            flash('Мега-продукты уже добавлены! Используйте другие endpoints для добавления.', 'info')
-            return redirect(url_for('products'))
-        
-        mega_products = [
-            # Дополнительная рыба и морепродукты
-            Product(name="Судак", calories_per_100g=84, protein=19.0, carbs=0.0, fat=0.8, category="Рыба и морепродукты"),
-            Product(name="Семга", calories_per_100g=219, protein=20.8, carbs=0.0, fat=15.1, category="Рыба и морепродукты"),
-            Product(name="Тунец", calories_per_100g=96, protein=23.0, carbs=0.0, fat=1.0, category="Рыба и морепродукты"),
-            Product(name="Горбуша", calories_per_100g=147, protein=21.0, carbs=0.0, fat=7.0, category="Рыба и морепродукты"),
-            Product(name="Камбала", calories_per_100g=83, protein=16.1, carbs=0.0, fat=2.6, category="Рыба и морепродукты"),
-            Product(name="Щука", calories_per_100g=84, protein=18.8, carbs=0.0, fat=1.1, category="Рыба и морепродукты"),
-            Product(name="Кальмары", calories_per_100g=74, protein=18.0, carbs=0.3, fat=0.3, category="Рыба и морепродукты"),
-            Product(name="Мидии", calories_per_100g=77, protein=11.5, carbs=3.3, fat=2.0, category="Рыба и морепродукты"),
-            Product(name="Краб", calories_per_100g=85, protein=16.0, carbs=0.0, fat=3.6, category="Рыба и морепродукты"),
-            
-            # Дополнительные овощи
-            Product(name="Капуста цветная", calories_per_100g=30, protein=2.5, carbs=4.2, fat=0.3, category="Овощи"),
-            Product(name="Перец болгарский красный", calories_per_100g=27, protein=1.3, carbs=5.3, fat=0.1, category="Овощи"),
-            Product(name="Чеснок", calories_per_100g=143, protein=6.5, carbs=29.9, fat=0.5, category="Овощи"),
-            Product(name="Свекла", calories_per_100g=40, protein=1.5, carbs=8.8, fat=0.1, category="Овощи"),
-            Product(name="Редис", calories_per_100g=19, protein=1.2, carbs=3.4, fat=0.1, category="Овощи"),
-            Product(name="Салат листовой", calories_per_100g=12, protein=1.5, carbs=1.3, fat=0.2, category="Овощи"),
-            Product(name="Шпинат", calories_per_100g=22, protein=2.9, carbs=2.0, fat=0.3, category="Овощи"),
-            Product(name="Кабачки", calories_per_100g=24, protein=0.6, carbs=4.6, fat=0.3, category="Овощи"),
-            Product(name="Баклажаны", calories_per_100g=24, protein=1.2, carbs=4.5, fat=0.1, category="Овощи"),
-            Product(name="Тыква", calories_per_100g=22, protein=1.0, carbs=4.4, fat=0.1, category="Овощи"),
-            Product(name="Петрушка", calories_per_100g=47, protein=3.7, carbs=7.6, fat=0.4, category="Овощи"),
-            Product(name="Укроп", calories_per_100g=40, protein=2.5, carbs=6.3, fat=0.5, category="Овощи"),
-            
-            # Дополнительные фрукты и ягоды
-            Product(name="Мандарин", calories_per_100g=38, protein=0.8, carbs=7.5, fat=0.2, category="Фрукты"),
-            Product(name="Лимон", calories_per_100g=16, protein=0.9, carbs=3.0, fat=0.1, category="Фрукты"),
-            Product(name="Виноград", calories_per_100g=65, protein=0.6, carbs=15.4, fat=0.2, category="Фрукты"),
-            Product(name="Вишня", calories_per_100g=52, protein=1.1, carbs=11.3, fat=0.2, category="Фрукты"),
-            Product(name="Черешня", calories_per_100g=50, protein=1.1, carbs=10.6, fat=0.4, category="Фрукты"),
-            Product(name="Слива", calories_per_100g=42, protein=0.8, carbs=9.6, fat=0.3, category="Фрукты"),
-            Product(name="Персик", calories_per_100g=46, protein=0.9, carbs=11.1, fat=0.1, category="Фрукты"),
-            Product(name="Абрикос", calories_per_100g=44, protein=0.9, carbs=9.0, fat=0.1, category="Фрукты"),
-            Product(name="Киви", calories_per_100g=47, protein=1.0, carbs=10.3, fat=0.5, category="Фрукты"),
-            Product(name="Ананас", calories_per_100g=52, protein=0.4, carbs=11.8, fat=0.1, category="Фрукты"),
-            Product(name="Манго", calories_per_100g=67, protein=0.6, carbs=15.0, fat=0.4, category="Фрукты"),
-            Product(name="Смородина черная", calories_per_100g=44, protein=1.0, carbs=7.3, fat=0.4, category="Ягоды"),
-            Product(name="Смородина красная", calories_per_100g=43, protein=0.6, carbs=7.7, fat=0.2, category="Ягоды"),
-            Product(name="Крыжовник", calories_per_100g=45, protein=0.7, carbs=9.1, fat=0.2, category="Ягоды"),
-            Product(name="Брусника", calories_per_100g=43, protein=0.7, carbs=8.2, fat=0.5, category="Ягоды"),
-            Product(name="Клюква", calories_per_100g=28, protein=0.5, carbs=6.8, fat=0.2, category="Ягоды"),
-            
-            # Дополнительные орехи и семечки
-            Product(name="Фундук", calories_per_100g=704, protein=16.1, carbs=9.9, fat=66.9, category="Орехи и семечки"),
-            Product(name="Арахис", calories_per_100g=548, protein=26.3, carbs=9.9, fat=45.2, category="Орехи и семечки"),
-            Product(name="Кешью", calories_per_100g=553, protein=25.7, carbs=13.2, fat=42.2, category="Орехи и семечки"),
-            Product(name="Фисташки", calories_per_100g=556, protein=20.0, carbs=7.0, fat=50.0, category="Орехи и семечки"),
-            Product(name="Семечки подсолнуха", calories_per_100g=601, protein=20.7, carbs=10.5, fat=52.9, category="Орехи и семечки"),
-            Product(name="Семечки тыквы", calories_per_100g=559, protein=24.5, carbs=4.7, fat=49.1, category="Орехи и семечки"),
-            
-            # Дополнительные молочные продукты
-            Product(name="Молоко 1.5%", calories_per_100g=44, protein=2.8, carbs=4.7, fat=1.5, category="Молочные продукты"),
-            Product(name="Кефир 1%", calories_per_100g=40, protein=2.8, carbs=4.0, fat=1.0, category="Молочные продукты"),
-            Product(name="Сметана 15%", calories_per_100g=158, protein=2.6, carbs=3.0, fat=15.0, category="Молочные продукты"),
-            Product(name="Сыр голландский", calories_per_100g=377, protein=26.0, carbs=0.0, fat=31.0, category="Молочные продукты"),
-            Product(name="Брынза", calories_per_100g=260, protein=17.9, carbs=0.0, fat=20.1, category="Молочные продукты"),
-            Product(name="Простокваша", calories_per_100g=53, protein=2.9, carbs=4.1, fat=2.5, category="Молочные продукты"),
-            
-            # Дополнительные крупы и злаки
-            Product(name="Рис бурый", calories_per_100g=337, protein=6.3, carbs=65.1, fat=4.4, category="Крупы"),
-            Product(name="Перловка", calories_per_100g=315, protein=9.3, carbs=73.7, fat=1.1, category="Крупы"),
-            Product(name="Манка", calories_per_100g=328, protein=10.3, carbs=70.6, fat=1.0, category="Крупы"),
-            Product(name="Кукурузная крупа", calories_per_100g=328, protein=8.3, carbs=71.0, fat=1.2, category="Крупы"),
-            Product(name="Булгур", calories_per_100g=342, protein=12.3, carbs=57.6, fat=1.3, category="Крупы"),
-            
-            # Дополнительные масла
-            Product(name="Масло подсолнечное", calories_per_100g=899, protein=0.0, carbs=0.0, fat=99.9, category="Масла и жиры"),
-            Product(name="Маргарин", calories_per_100g=743, protein=0.5, carbs=1.0, fat=82.0, category="Масла и жиры"),
-            
-            # Дополнительные бобовые
-            Product(name="Фасоль белая", calories_per_100g=102, protein=7.0, carbs=16.9, fat=0.5, category="Бобовые"),
-            Product(name="Фасоль красная", calories_per_100g=93, protein=8.4, carbs=13.7, fat=0.3, category="Бобовые"),
-            Product(name="Горох", calories_per_100g=298, protein=20.5, carbs=53.3, fat=2.0, category="Бобовые"),
-            Product(name="Нут", calories_per_100g=364, protein=19.3, carbs=61.0, fat=6.0, category="Бобовые"),
-            
-            # Дополнительные напитки
-            Product(name="Чай черный", calories_per_100g=1, protein=0.0, carbs=0.3, fat=0.0, category="Напитки"),
-            Product(name="Сок апельсиновый", calories_per_100g=36, protein=0.7, carbs=8.1, fat=0.2, category="Напитки"),
-            Product(name="Сок яблочный", calories_per_100g=46, protein=0.1, carbs=11.3, fat=0.1, category="Напитки"),
-            Product(name="Компот", calories_per_100g=60, protein=0.2, carbs=15.0, fat=0.1, category="Напитки"),
-            
-            # Дополнительные сладости
-            Product(name="Сахар", calories_per_100g=387, protein=0.0, carbs=99.7, fat=0.0, category="Сладости"),
-            Product(name="Шоколад молочный", calories_per_100g=534, protein=7.6, carbs=60.2, fat=29.7, category="Сладости"),
-            Product(name="Печенье овсяное", calories_per_100g=437, protein=6.5, carbs=71.4, fat=14.1, category="Сладости"),
-            Product(name="Зефир", calories_per_100g=304, protein=0.8, carbs=79.8, fat=0.0, category="Сладости"),
-        ]
+    current_count = Product.query.count()
+    logging.info(f"Current product count: {current_count}")
+    
+    # Проверяем, не добавляли ли уже мега-продукты
+    if current_count > 120:
+        return {'message': 'Мега-продукты уже добавлены! Используйте другие endpoints для добавления.', 'category': 'info'}
+    
+    mega_products = [
+        # Дополнительная рыба и морепродукты
+        Product(name="Судак", calories_per_100g=84, protein=19.0, carbs=0.0, fat=0.8, category="Рыба и морепродукты"),
+        Product(name="Семга", calories_per_100g=219, protein=20.8, carbs=0.0, fat=15.1, category="Рыба и морепродукты"),
+        Product(name="Тунец", calories_per_100g=96, protein=23.0, carbs=0.0, fat=1.0, category="Рыба и морепродукты"),
+        Product(name="Горбуша", calories_per_100g=147, protein=21.0, carbs=0.0, fat=7.0, category="Рыба и морепродукты"),
+        Product(name="Камбала", calories_per_100g=83, protein=16.1, carbs=0.0, fat=2.6, category="Рыба и морепродукты"),
+        Product(name="Щука", calories_per_100g=84, protein=18.8, carbs=0.0, fat=1.1, category="Рыба и морепродукты"),
+        Product(name="Кальмары", calories_per_100g=74, protein=18.0, carbs=0.3, fat=0.3, category="Рыба и морепродукты"),
+        Product(name="Мидии", calories_per_100g=77, protein=11.5, carbs=3.3, fat=2.0, category="Рыба и морепродукты"),
+        Product(name="Краб", calories_per_100g=85, protein=16.0, carbs=0.0, fat=3.6, category="Рыба и морепродукты"),
         
-        # Добавляем мега-продукты
-        for product in mega_products:
-            db.session.add(product)
+        # Дополнительные овощи
+        Product(name="Капуста цветная", calories_per_100g=30, protein=2.5, carbs=4.2, fat=0.3, category="Овощи"),
+        Product(name="Перец болгарский красный", calories_per_100g=27, protein=1.3, carbs=5.3, fat=0.1, category="Овощи"),
+        Product(name="Чеснок", calories_per_100g=143, protein=6.5, carbs=29.9, fat=0.5, category="Овощи"),
+        Product(name="Свекла", calories_per_100g=40, protein=1.5, carbs=8.8, fat=0.1, category="Овощи"),
+        Product(name="Редис", calories_per_100g=19, protein=1.2, carbs=3.4, fat=0.1, category="Овощи"),
+        Product(name="Салат листовой", calories_per_100g=12, protein=1.5, carbs=1.3, fat=0.2, category="Овощи"),
+        Product(name="Шпинат", calories_per_100g=22, protein=2.9, carbs=2.0, fat=0.3, category="Овощи"),
+        Product(name="Кабачки", calories_per_100g=24, protein=0.6, carbs=4.6, fat=0.3, category="Овощи"),
+        Product(name="Баклажаны", calories_per_100g=24, protein=1.2, carbs=4.5, fat=0.1, category="Овощи"),
+        Product(name="Тыква", calories_per_100g=22, protein=1.0, carbs=4.4, fat=0.1, category="Овощи"),
+        Product(name="Петрушка", calories_per_100g=47, protein=3.7, carbs=7.6, fat=0.4, category="Овощи"),
+        Product(name="Укроп", calories_per_100g=40, protein=2.5, carbs=6.3, fat=0.5, category="Овощи"),
+        
+        # Дополнительные фрукты и ягоды
+        Product(name="Мандарин", calories_per_100g=38, protein=0.8, carbs=7.5, fat=0.2, category="Фрукты"),
+        Product(name="Лимон", calories_per_100g=16, protein=0.9, carbs=3.0, fat=0.1, category="Фрукты"),
+        Product(name="Виноград", calories_per_100g=65, protein=0.6, carbs=15.4, fat=0.2, category="Фрукты"),
+        Product(name="Вишня", calories_per_100g=52, protein=1.1, carbs=11.3, fat=0.2, category="Фрукты"),
+        Product(name="Черешня", calories_per_100g=50, protein=1.1, carbs=10.6, fat=0.4, category="Фрукты"),
+        Product(name="Слива", calories_per_100g=42, protein=0.8, carbs=9.6, fat=0.3, category="Фрукты"),
+        Product(name="Персик", calories_per_100g=46, protein=0.9, carbs=11.1, fat=0.1, category="Фрукты"),
+        Product(name="Абрикос", calories_per_100g=44, protein=0.9, carbs=9.0, fat=0.1, category="Фрукты"),
+        Product(name="Киви", calories_per_100g=47, protein=1.0, carbs=10.3, fat=0.5, category="Фрукты"),
+        Product(name="Ананас", calories_per_100g=52, protein=0.4, carbs=11.8, fat=0.1, category="Фрукты"),
+        Product(name="Манго", calories_per_100g=67, protein=0.6, carbs=15.0, fat=0.4, category="Фрукты"),
+        Product(name="Смородина черная", calories_per_100g=44, protein=1.0, carbs=7.3, fat=0.4, category="Ягоды"),
+        Product(name="Смородина красная", calories_per_100g=43, protein=0.6, carbs=7.7, fat=0.2, category="Ягоды"),
+        Product(name="Крыжовник", calories_per_100g=45, protein=0.7, carbs=9.1, fat=0.2, category="Ягоды"),
+        Product(name="Брусника", calories_per_100g=43, protein=0.7, carbs=8.2, fat=0.5, category="Ягоды"),
+        Product(name="Клюква", calories_per_100g=28, protein=0.5, carbs=6.8, fat=0.2, category="Ягоды"),
+        
+        # Дополнительные орехи и семечки
+        Product(name="Фундук", calories_per_100g=704, protein=16.1, carbs=9.9, fat=66.9, category="Орехи и семечки"),
+        Product(name="Арахис", calories_per_100g=548, protein=26.3, carbs=9.9, fat=45.2, category="Орехи и семечки"),
+        Product(name="Кешью", calories_per_100g=553, protein=25.7, carbs=13.2, fat=42.2, category="Орехи и семечки"),
+        Product(name="Фисташки", calories_per_100g=556, protein=20.0, carbs=7.0, fat=50.0, category="Орехи и семечки"),
+        Product(name="Семечки подсолнуха", calories_per_100g=601, protein=20.7, carbs=10.5, fat=52.9, category="Орехи и семечки"),
+        Product(name="Семечки тыквы", calories_per_100g=559, protein=24.5, carbs=4.7, fat=49.1, category="Орехи и семечки"),
         
-        db.session.commit()
+        # Дополнительные молочные продукты
+        Product(name="Молоко 1.5%", calories_per_100g=44, protein=2.8, carbs=4.7, fat=1.5, category="Молочные продукты"),
+        Product(name="Кефир 1%", calories_per_100g=40, protein=2.8, carbs=4.0, fat=1.0, category="Молочные продукты"),
+        Product(name="Сметана 15%", calories_per_100g=158, protein=2.6, carbs=3.0, fat=15.0, category="Молочные продукты"),
+        Product(name="Сыр голландский", calories_per_100g=377, protein=26.0, carbs=0.0, fat=31.0, category="Молочные продукты"),
+        Product(name="Брынза", calories_per_100g=260, protein=17.9, carbs=0.0, fat=20.1, category="Молочные продукты"),
+        Product(name="Простокваша", calories_per_100g=53, protein=2.9, carbs=4.1, fat=2.5, category="Молочные продукты"),
+        
+        # Дополнительные крупы и злаки
+        Product(name="Рис бурый", calories_per_100g=337, protein=6.3, carbs=65.1, fat=4.4, category="Крупы"),
+        Product(name="Перловка", calories_per_100g=315, protein=9.3, carbs=73.7, fat=1.1, category="Крупы"),
+        Product(name="Манка", calories_per_100g=328, protein=10.3, carbs=70.6, fat=1.0, category="Крупы"),
+        Product(name="Кукурузная крупа", calories_per_100g=328, protein=8.3, carbs=71.0, fat=1.2, category="Крупы"),
+        Product(name="Булгур", calories_per_100g=342, protein=12.3, carbs=57.6, fat=1.3, category="Крупы"),
         
-        new_count = Product.query.count()
-        added_count = len(mega_products)
+        # Дополнительные масла
+        Product(name="Масло подсолнечное", calories_per_100g=899, protein=0.0, carbs=0.0, fat=99.9, category="Масла и жиры"),
+        Product(name="Маргарин", calories_per_100g=743, protein=0.5, carbs=1.0, fat=82.0, category="Масла и жиры"),
         
-        flash(f'🎉 МЕГА успех! Добавлено {added_count} продуктов! Общее количество: {new_count}', 'success')
-        logging.info(f"Added {added_count} mega products, total: {new_count}")
+        # Дополнительные бобовые
+        Product(name="Фасоль белая", calories_per_100g=102, protein=7.0, carbs=16.9, fat=0.5, category="Бобовые"),
+        Product(name="Фасоль красная", calories_per_100g=93, protein=8.4, carbs=13.7, fat=0.3, category="Бобовые"),
+        Product(name="Горох", calories_per_100g=298, protein=20.5, carbs=53.3, fat=2.0, category="Бобовые"),
+        Product(name="Нут", calories_per_100g=364, protein=19.3, carbs=61.0, fat=6.0, category="Бобовые"),
         
-        return redirect(url_for('products'))
+        # Дополнительные напитки
+        Product(name="Чай черный", calories_per_100g=1, protein=0.0, carbs=0.3, fat=0.0, category="Напитки"),
+        Product(name="Сок апельсиновый", calories_per_100g=36, protein=0.7, carbs=8.1, fat=0.2, category="Напитки"),
+        Product(name="Сок яблочный", calories_per_100g=46, protein=0.1, carbs=11.3, fat=0.1, category="Напитки"),
+        Product(name="Компот", calories_per_100g=60, protein=0.2, carbs=15.0, fat=0.1, category="Напитки"),
         
-    except Exception as e:
-        logging.error(f"Error loading mega products: {str(e)}")
-        flash(f'Ошибка при добавлении мега-продуктов: {str(e)}', 'error')
-        return redirect(url_for('products'))
+        # Дополнительные сладости
+        Product(name="Сахар", calories_per_100g=387, protein=0.0, carbs=99.7, fat=0.0, category="Сладости"),
+        Product(name="Шоколад молочный", calories_per_100g=534, protein=7.6, carbs=60.2, fat=29.7, category="Сладости"),
+        Product(name="Печенье овсяное", calories_per_100g=437, protein=6.5, carbs=71.4, fat=14.1, category="Сладости"),
+        Product(name="Зефир", calories_per_100g=304, protein=0.8, carbs=79.8, fat=0.0, category="Сладости"),
+    ]
+    
+    # Добавляем мега-продукты
+    report(None, f'Добавление {len(mega_products)} продуктов')
+    added_count = insert_missing_products(mega_products)
+    
+    db.session.commit()
+    
+    new_count = Product.query.count()
+    
+    logging.info(f"Added {added_count} mega products, total: {new_count}")
+    
+    return {'message': f'🎉 МЕГА успех! Добавлено {added_count} продуктов! Общее количество: {new_count}',
+            'category': 'success', 'added': added_count, 'total': new_count}
+    
 
 @app.route('/product_count')
 def product_count():
     """Показывает текущее количество продуктов в базе"""
     try:
-        count = Product.query.count()
-        # Получаем категории с количеством
-        from sqlalchemy import text
-        category_result = db.session.execute(text("""
-            SELECT category, COUNT(*) as count 
-            FROM products 
-            GROUP BY category 
-            ORDER BY category
-        """))
-        category_info = {row[0]: row[1] for row in category_result}
+        facets = get_category_facets()
+        count = facets['total']
+        category_info = facets['categories']
         
         return jsonify({
             'total_products': count,
@@ -2237,14 +5368,15 @@ def product_count():
 
 @app.route('/reload_products')
 def reload_products():
+    """Ставит перезагрузку всех продуктов в очередь фоновых задач"""
+    return enqueue_job_and_redirect('reload_products', 'products')
+
+@job_handler('reload_products')
+def reload_products_job(report) -> dict:
     """Принудительная перезагрузка всех продуктов"""
-    try:
-        auto_load_all_products()
-        flash('Продукты успешно перезагружены!', 'success')
-        return redirect(url_for('products'))
-    except Exception as e:
-        flash(f'Ошибка при перезагрузке продуктов: {str(e)}', 'error')
-        return redirect(url_for('products'))
+    auto_load_all_products()
+    return {'message': 'Продукты успешно перезагружены!', 'category': 'success'}
+
 def check_schema():
     """Check database schema status"""
     try:
@@ -2335,35 +5467,33 @@ def check_schema():
 
 @app.route('/migrate_all')
 def migrate_all_route():
-    """Comprehensive migration endpoint for all tables"""
-    try:
-        logging.info("Comprehensive migration requested")
-        
-        # Run all migrations
-        results = {
-            'schema_check': check_and_migrate_schema(),
-            'food_entries': False,
-            'user_profile': False
-        }
-        
-        messages = []
-        
-        if results['schema_check']:
-            messages.append('Общая миграция схемы выполнена успешно')
-        
-        success_count = sum(1 for result in results.values() if result)
-        
-        if success_count > 0:
-            flash(f'Миграция завершена! Выполнено {success_count} операций. {" | ".join(messages)}', 'success')
-        else:
-            flash('Миграция не требуется - все таблицы уже в порядке!', 'info')
-        
-        return redirect(url_for('index'))
-        
-    except Exception as e:
-        logging.error(f"Comprehensive migration failed: {str(e)}")
-        flash(f'Ошибка комплексной миграции: {str(e)}', 'error')
-        return redirect(url_for('index'))
+    """Ставит комплексную миграцию всех таблиц в очередь фоновых задач"""
+    return enqueue_job_and_redirect('migrate_all', 'index')
+
+@job_handler('migrate_all')
+def migrate_all_job(report) -> dict:
+    """Comprehensive migration for all tables"""
+    logging.info("Comprehensive migration requested")
+    
+    # Run all migrations
+    report(0, 'Проверка и миграция схемы')
+    results = {
+        'schema_check': check_and_migrate_schema(),
+        'food_entries': False,
+        'user_profile': False
+    }
+    
+    messages = []
+    
+    if results['schema_check']:
+        messages.append('Общая миграция схемы выполнена успешно')
+    
+    success_count = sum(1 for result in results.values() if result)
+    
+    if success_count > 0:
+        return {'message': f'Миграция завершена! Выполнено {success_count} операций. {" | ".join(messages)}',
+                'category': 'success'}
+    return {'message': 'Миграция не требуется - все таблицы уже в порядке!', 'category': 'info'}
 
 @app.route('/migrate_food_entries')
 def migrate_food_entries_route():
@@ -2450,117 +5580,196 @@ def initialize_database():
         flash(f'Ошибка инициализации базы данных: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """Состояние фоновой задачи: статус, прогресс, последнее сообщение и результат"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/cleanup_duplicates')
 def cleanup_duplicates():
-    """Оптимизированная очистка дубликатов (избегаем timeout)"""
-    try:
-        logging.info("Начинаем оптимизированную очистку дубликатов...")
-        
-        db.session.expire_all()
-        from sqlalchemy import text
-        
-        # Шаг 1: Обновляем food_entries пакетно
-        logging.info("Обновляем food_entries...")
-        update_result = db.session.execute(text("""
-            UPDATE food_entries 
-            SET product_id = (
-                SELECT MIN(p2.id) 
-                FROM products p2 
-                WHERE p2.name = (SELECT name FROM products p3 WHERE p3.id = food_entries.product_id)
-            )
-            WHERE product_id IN (
-                SELECT p.id
-                FROM products p
-                JOIN (
-                    SELECT name, MIN(id) as min_id
-                    FROM products
-                    GROUP BY name
-                    HAVING COUNT(id) > 1
-                ) dups ON p.name = dups.name AND p.id != dups.min_id
-            )
-        """))
-        
-        # Handle rowcount access for SQLAlchemy 2.x compatibility
-        updated_entries = getattr(update_result, 'rowcount', 0)
-        logging.info(f"Обновлено {updated_entries} food_entries")
-        
-        # Шаг 2: Удаляем дубликаты одним запросом
-        logging.info("Удаляем дубликаты...")
-        delete_result = db.session.execute(text("""
-            DELETE FROM products 
-            WHERE id IN (
-                SELECT p.id
-                FROM (
-                    SELECT p.id, p.name,
-                           ROW_NUMBER() OVER (PARTITION BY p.name ORDER BY p.id) as rn
-                    FROM products p
-                ) p
-                WHERE p.name IN (
-                    SELECT name
-                    FROM products
-                    GROUP BY name
-                    HAVING COUNT(id) > 1
-                )
-                AND p.rn > 1
-            )
-        """))
-        
-        # Handle rowcount access for SQLAlchemy 2.x compatibility
-        deleted_count = getattr(delete_result, 'rowcount', 0)
-        logging.info(f"Удалено {deleted_count} дубликатов")
-        
-        db.session.commit()
-        db.session.expire_all()
-        
-        flash(f'✅ Очистка завершена! Удалено {deleted_count} дубликатов, обновлено {updated_entries} записей.', 'success')
-        
-    except Exception as e:
-        logging.error(f"Ошибка в cleanup_duplicates: {str(e)}")
-        db.session.rollback()
-        flash(f'Ошибка: {str(e)}', 'danger')
+    """Ставит очистку дубликатов в очередь фоновых задач"""
+    return enqueue_job_and_redirect('cleanup_duplicates', 'products')
+
+@job_handler('cleanup_duplicates')
+def cleanup_duplicates_job(report) -> dict:
+    """Пакетная очистка дубликатов по нормализованному названию (продолжается с места остановки)"""
+    logging.info("Начинаем пакетную очистку дубликатов...")
     
-    return redirect(url_for('products'))
+    # Проходы с ограничением времени: между ними фиксируется прогресс задачи
+    totals = {'groups': 0, 'remapped_entries': 0, 'deleted': 0}
+    while True:
+        result = dedupe_products(time_budget=20)
+        for key in totals:
+            totals[key] += result[key]
+        if result['finished']:
+            break
+        report(None, f'Обработано {totals["groups"]} групп дубликатов (удалено {totals["deleted"]})')
+    logging.info(f"Очистка дубликатов: {totals}")
+    
+    return {'message': f'✅ Очистка завершена! Удалено {totals["deleted"]} дубликатов, '
+                       f'обновлено {totals["remapped_entries"]} записей.', 'category': 'success', **totals}
+
+def build_duplicate_report() -> dict:
+    """Группы дубликатов с участниками; число записей дневника - на момент построения"""
+    groups = []
+    for row in db.session.execute(duplicate_report_query()).mappings():
+        if not groups or groups[-1]['key'] != row['name_key']:
+            groups.append({'key': row['name_key'], 'name': row['group_name'], 'count': row['group_size'],
+                           'usage': 0, 'products': []})
+        groups[-1]['products'].append(dict(row))
+        groups[-1]['usage'] += row['usage_count']
+    return {
+        'groups': groups,
+        'total_duplicates': sum(group['count'] - 1 for group in groups),
+        'built_at': datetime.utcnow()
+    }
+
+def get_duplicate_report() -> dict:
+    return catalog_cached('duplicate_report', build_duplicate_report)
+
+# Похожие продукты: MinHash по триграммам названия + LSH, проверка кандидатов по цифрам и БЖУ
+MINHASH_PERMUTATIONS = 64
+MINHASH_BAND_ROWS = 4  # 16 полос по 4 строки: кандидатами становятся пары с Жаккаром примерно от 0.5
+NEAR_DUPLICATE_MIN_SIMILARITY = 0.6
+NEAR_DUPLICATE_MAX_CALORIE_DIFF = 0.2  # относительная разница калорийности
+NEAR_DUPLICATE_MIN_MACRO_COSINE = 0.98
+LSH_MAX_BUCKET = 200  # слишком общие корзины пропускаются, чтобы не было квадратичного перебора
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20250902)
+_MINHASH_PARAMS = [(_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+                   for _ in range(MINHASH_PERMUTATIONS)]
+_shingle_hashes = {}
+
+def near_duplicate_name(name: str) -> str:
+    """Название для сравнения: без уточнений в скобках, с десятичной точкой и слитным процентом"""
+    value = normalize_product_name(name)
+    value = re.sub(r'\([^)]*\)', ' ', value)
+    value = re.sub(r'(\d)\s*,\s*(\d)', r'\1.\2', value)
+    value = re.sub(r'\s+%', '%', value)
+    value = re.sub(r'[^\w%.\s]', ' ', value)
+    return ' '.join(value.split())
+
+def name_numbers(value: str) -> tuple:
+    return tuple(sorted(re.findall(r'\d+(?:\.\d+)?', value)))
+
+def name_shingles(value: str) -> set:
+    padded = f' {value} '
+    return {padded[i:i + 3] for i in range(max(len(padded) - 2, 1))}
+
+def minhash_signature(shingles: set) -> tuple:
+    vectors = []
+    for shingle in shingles:
+        vector = _shingle_hashes.get(shingle)
+        if vector is None:
+            x = zlib.crc32(shingle.encode('utf-8'))
+            vector = _shingle_hashes[shingle] = tuple((a * x + b) % _MINHASH_PRIME for a, b in _MINHASH_PARAMS)
+        vectors.append(vector)
+    return tuple(map(min, zip(*vectors)))
+
+def macros_similar(first: dict, second: dict) -> bool:
+    calories = max(first['calories_per_100g'] or 0, second['calories_per_100g'] or 0)
+    if calories and abs((first['calories_per_100g'] or 0) - (second['calories_per_100g'] or 0)) / calories > NEAR_DUPLICATE_MAX_CALORIE_DIFF:
+        return False
+    a = [first['protein'] or 0, first['carbs'] or 0, first['fat'] or 0]
+    b = [second['protein'] or 0, second['carbs'] or 0, second['fat'] or 0]
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    if not norm:
+        return not any(a) and not any(b)
+    return sum(x * y for x, y in zip(a, b)) / norm >= NEAR_DUPLICATE_MIN_MACRO_COSINE
+
+def find_near_duplicate_clusters(products: list) -> list:
+    """Кластеры похожих продуктов (списки словарей, отсортированы по id).
+    
+    Сравниваются только пары из общих LSH-корзин, поэтому время растет почти линейно
+    с размером каталога.
+    """
+    signatures = []
+    for product in products:
+        value = near_duplicate_name(product['name'])
+        signatures.append((name_numbers(value), minhash_signature(name_shingles(value))))
+    
+    buckets = {}
+    for index, (_, signature) in enumerate(signatures):
+        for start in range(0, MINHASH_PERMUTATIONS, MINHASH_BAND_ROWS):
+            buckets.setdefault((start, signature[start:start + MINHASH_BAND_ROWS]), []).append(index)
+    
+    parent = list(range(len(products)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    checked = set()
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        if len(members) > LSH_MAX_BUCKET:
+            logging.warning(f"LSH bucket with {len(members)} products skipped")
+            continue
+        for position, i in enumerate(members):
+            for j in members[position + 1:]:
+                if (i, j) in checked or find(i) == find(j):
+                    continue
+                checked.add((i, j))
+                numbers_i, signature_i = signatures[i]
+                numbers_j, signature_j = signatures[j]
+                if numbers_i != numbers_j or not macros_similar(products[i], products[j]):
+                    continue
+                similarity = sum(map(operator.eq, signature_i, signature_j)) / MINHASH_PERMUTATIONS
+                if similarity >= NEAR_DUPLICATE_MIN_SIMILARITY:
+                    parent[find(j)] = find(i)
+    
+    clusters = {}
+    for index in range(len(products)):
+        clusters.setdefault(find(index), []).append(products[index])
+    return [sorted(members, key=lambda p: p['id']) for members in clusters.values() if len(members) > 1]
+
+def build_near_duplicate_report() -> dict:
+    """Группы похожих продуктов в формате отчета о дубликатах"""
+    columns = [Product.id, Product.name, Category.name.label('category'), Product.calories_per_100g,
+               Product.protein, Product.carbs, Product.fat, Product.created_at]
+    products = [dict(row) for row in db.session.execute(
+        select(*columns).outerjoin_from(Product, Category, Product.category_id == Category.id).order_by(Product.id)
+    ).mappings()]
+    clusters = find_near_duplicate_clusters(products)
+    
+    ids = [product['id'] for members in clusters for product in members]
+    usage = {}
+    for start in range(0, len(ids), 500):
+        usage.update(db.session.execute(
+            select(FoodEntry.product_id, func.count()).where(FoodEntry.product_id.in_(ids[start:start + 500]))
+            .group_by(FoodEntry.product_id)
+        ).all())
+    
+    groups = []
+    for members in sorted(clusters, key=lambda m: normalize_product_name(m[0]['name'])):
+        for product in members:
+            product['usage_count'] = usage.get(product['id'], 0)
+        groups.append({'key': str(members[0]['id']), 'name': members[0]['name'], 'count': len(members),
+                       'usage': sum(product['usage_count'] for product in members), 'products': members})
+    return {
+        'groups': groups,
+        'total_duplicates': sum(group['count'] - 1 for group in groups),
+        'built_at': datetime.utcnow()
+    }
+
+def get_near_duplicate_report() -> dict:
+    return catalog_cached('near_duplicate_report', build_near_duplicate_report)
 
 @app.route('/api/get_duplicate_count')
 def get_duplicate_count():
     """Получить количество дубликатов в базе"""
     try:
-        # Принудительное обновление сессии
-        db.session.expire_all()
-        
-        from sqlalchemy import text
-        
-        # Подсчитываем количество дубликатов
-        result = db.session.execute(text("""
-            SELECT COUNT(*) as duplicate_count
-            FROM (
-                SELECT name
-                FROM products 
-                GROUP BY name 
-                HAVING COUNT(id) > 1
-            ) as duplicates
-        """))
-        
-        duplicate_groups = result.scalar() or 0
-        
-        # Подсчитываем общее количество лишних продуктов
-        result2 = db.session.execute(text("""
-            SELECT SUM(count - 1) as total_duplicates
-            FROM (
-                SELECT COUNT(id) as count
-                FROM products 
-                GROUP BY name 
-                HAVING COUNT(id) > 1
-            ) as duplicates
-        """))
-        
-        total_duplicates = result2.scalar() or 0
-        
+        report = get_duplicate_report()
         return jsonify({
             'success': True,
-            'duplicate_groups': duplicate_groups,
-            'total_duplicates': total_duplicates,
-            'total_products': Product.query.count()
+            'duplicate_groups': len(report['groups']),
+            'total_duplicates': report['total_duplicates'],
+            'total_products': catalog_cached('product_count', lambda: Product.query.count())
         })
         
     except Exception as e:
@@ -2569,56 +5778,59 @@ def get_duplicate_count():
 
 @app.route('/show_duplicates')
 def show_duplicates():
-    """Показать список дубликатов без удаления"""
+    """Показать список дубликатов без удаления (?mode=near - похожие продукты)"""
     try:
-        # Принудительное обновление сессии
-        db.session.expire_all()
-        
-        from sqlalchemy import func, text
-        
-        # Используем прямой SQL запрос для поиска дубликатов
-        duplicate_query = db.session.execute(text("""
-            SELECT name, COUNT(id) as count
-            FROM products 
-            GROUP BY name 
-            HAVING COUNT(id) > 1
-            ORDER BY name
-        """))
-        
-        duplicates = duplicate_query.fetchall()
+        mode = 'near' if request.args.get('mode') == 'near' else 'exact'
+        report = get_near_duplicate_report() if mode == 'near' else get_duplicate_report()
+        groups = report['groups']
         
-        if not duplicates:
-            flash('Дубликаты не найдены! База данных чистая.', 'info')
+        if not groups:
+            flash('Похожие продукты не найдены.' if mode == 'near' else 'Дубликаты не найдены! База данных чистая.', 'info')
             return redirect(url_for('products'))
         
-        # Получаем детальную информацию о каждом дубликате
-        duplicate_details = []
-        total_duplicates = 0
-        
-        for duplicate in duplicates:
-            product_name = duplicate[0]  # name
-            count = duplicate[1]        # count
-            
-            # Находим все продукты с одинаковым именем
-            same_name_products = Product.query.filter_by(name=product_name).order_by(Product.id).all()
-            
-            duplicate_details.append({
-                'name': product_name,
-                'count': count,
-                'products': same_name_products
-            })
-            
-            total_duplicates += (int(count) - 1)  # Исключаем оригинал
+        pages = (len(groups) + DUPLICATE_GROUPS_PER_PAGE - 1) // DUPLICATE_GROUPS_PER_PAGE
+        page = min(max(request.args.get('page', 1, type=int), 1), pages)
+        start = (page - 1) * DUPLICATE_GROUPS_PER_PAGE
         
-        flash(f'Найдено {len(duplicates)} групп дубликатов. Всего дубликатов для удаления: {total_duplicates}', 'warning')
+        if mode == 'near':
+            flash(f'Найдено {len(groups)} групп похожих продуктов. Проверьте их и объедините вручную.', 'warning')
+        else:
+            flash(f'Найдено {len(groups)} групп дубликатов. Всего дубликатов для удаления: {report["total_duplicates"]}', 'warning')
         
         # Рендерим специальную страницу для показа дубликатов
-        return render_template('show_duplicates.html', duplicate_details=duplicate_details, total_duplicates=total_duplicates)
+        return render_template('show_duplicates.html', mode=mode,
+                               duplicate_details=groups[start:start + DUPLICATE_GROUPS_PER_PAGE],
+                               total_groups=len(groups),
+                               total_duplicates=report['total_duplicates'],
+                               page=page, pages=pages)
         
     except Exception as e:
         logging.error(f"Ошибка при поиске дубликатов: {str(e)}")
         flash(f'Ошибка при поиске дубликатов: {str(e)}', 'danger')
         return redirect(url_for('products'))
+
+@app.route('/merge_products', methods=['POST'])
+@admin_required
+def merge_products():
+    """Объединяет выбранные похожие продукты в один (записи дневника переносятся)"""
+    try:
+        keep_id = int(request.form['keep_id'])
+        product_ids = {int(value) for value in request.form.getlist('product_id[]')}
+        existing = {row[0] for row in db.session.query(Product.id).filter(Product.id.in_(product_ids | {keep_id}))}
+        if keep_id not in existing:
+            flash('Продукт для сохранения не найден', 'danger')
+            return redirect(url_for('show_duplicates', mode='near'))
+        
+        remapped = merge_products_into({product_id: keep_id for product_id in existing})
+        db.session.commit()
+        logging.info(f"Merged products {sorted(existing - {keep_id})} into {keep_id}, remapped {remapped} entries")
+        flash(f'Объединено продуктов: {len(existing) - 1}, перенесено записей: {remapped}', 'success')
+    except Exception as e:
+        logging.error(f"Ошибка объединения продуктов: {str(e)}")
+        db.session.rollback()
+        flash(f'Ошибка: {str(e)}', 'danger')
+    return redirect(url_for('show_duplicates', mode='near'))
+
 @app.route('/load_qwen_products')
 def load_qwen_products():
     """Оптимизированная загрузка Qwen продуктов через прямой SQL"""
@@ -2661,26 +5873,9 @@ def load_qwen_products():
             ("Тофу", 56.0, 8.0, 2.0, 4.0, "Веганские")
         ]
         
-        added_count = 0
-        salad_count = 0
-        
-        for name, calories, protein, carbs, fat, category in products:
-            existing = db.session.execute(
-                text("SELECT 1 FROM products WHERE name = :name LIMIT 1"),
-                {'name': name}
-            ).fetchone()
-            
-            if not existing:
-                db.session.execute(text("""
-                    INSERT INTO products (name, calories_per_100g, protein, carbs, fat, category, created_at)
-                    VALUES (:name, :calories, :protein, :carbs, :fat, :category, NOW())
-                """), {
-                    'name': name, 'calories': calories, 'protein': protein,
-                    'carbs': carbs, 'fat': fat, 'category': category
-                })
-                added_count += 1
-                if category == "Салаты":
-                    salad_count += 1
+        new_products = [Product(*row) for row in products]
+        added_count = insert_missing_products(new_products)
+        salad_count = sum(1 for product in new_products if product in db.session.new and product.category == "Салаты")
         
         db.session.commit()
         new_count = Product.query.count()
@@ -2696,60 +5891,52 @@ def load_qwen_products():
 
 @app.route('/migrate_categories')
 def migrate_categories():
+    """Ставит миграцию категорий в очередь фоновых задач"""
+    return enqueue_job_and_redirect('migrate_categories', 'products')
+
+@job_handler('migrate_categories')
+def migrate_categories_job(report) -> dict:
     """Миграция категорий: объединяем мясо и яйца в 'Мясо и птица'"""
-    try:
-        # Обновляем продукты с категорией 'Мясо и яйца'
-        products_meat_eggs = Product.query.filter_by(category='Мясо и яйца').all()
-        for product in products_meat_eggs:
-            product.category = 'Мясо и птица'
-        
-        # Обновляем яйца из 'Молочные продукты'
-        all_dairy_products = Product.query.filter_by(category='Молочные продукты').all()
-        egg_products = [p for p in all_dairy_products if 'яйц' in p.name.lower()]
-        for product in egg_products:
-            product.category = 'Мясо и птица'
-        
-        # Обновляем продукты с категорией 'Яйца'
-        egg_category_products = Product.query.filter_by(category='Яйца').all()
-        for product in egg_category_products:
-            product.category = 'Мясо и птица'
-        
+    target = get_or_create_category('Мясо и птица')
+    before = target.product_count
+    
+    # Категории 'Мясо и яйца' и 'Яйца' сливаются целиком
+    for source_name in ('Мясо и яйца', 'Яйца'):
+        merge_categories(source_name, 'Мясо и птица')
+    report(50, 'Категории объединены')
+    
+    # Яйца из 'Молочные продукты' переносим одним UPDATE
+    dairy = get_category('Молочные продукты')
+    if dairy is not None:
+        egg_ids = db.session.execute(text(
+            "SELECT id FROM products WHERE category_id = :dairy AND LOWER(name) LIKE :pattern"
+        ), {'dairy': dairy.id, 'pattern': '%яйц%'}).scalars().all()
+        moved = len(egg_ids)
+        if egg_ids:
+            db.session.execute(Product.__table__.update().where(Product.__table__.c.id.in_(egg_ids))
+                               .values(category_id=target.id))
+        _change_category_count(db.session, dairy.id, -moved)
+        _change_category_count(db.session, target.id, moved)
+        log_product_changes(db.session, egg_ids)
         db.session.commit()
-        
-        total_updated = len(products_meat_eggs) + len(egg_products) + len(egg_category_products)
-        
-        logging.info(f"Миграция категорий успешно завершена. Обновлено: {total_updated} продуктов")
-        flash(f'Миграция успешно завершена! Обновлено {total_updated} продуктов в категории "Мясо и птица".', 'success')
-        return redirect(url_for('products'))
-        
-    except Exception as e:
-        logging.error(f"Ошибка при миграции категорий: {str(e)}")
-        flash(f'Ошибка при миграции категорий: {str(e)}', 'danger')
-        return redirect(url_for('products'))
+    
+    db.session.refresh(target)
+    total_updated = target.product_count - before
+    
+    logging.info(f"Миграция категорий успешно завершена. Обновлено: {total_updated} продуктов")
+    return {'message': f'Миграция успешно завершена! Обновлено {total_updated} продуктов в категории "Мясо и птица".',
+            'category': 'success', 'updated': total_updated}
 
 @app.route('/migrate_db')
 def migrate_db():
-    """Добавляет столбец category в существующую таблицу products"""
-    try:
-        # Проверяем, есть ли уже столбец category
-        from sqlalchemy import text
-        result = db.session.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name='products' AND column_name='category'"))
-        if result.fetchone():
-            flash('Столбец category уже существует!', 'info')
-            return redirect(url_for('products'))
-        
-        # Добавляем столбец category
-        db.session.execute(text("ALTER TABLE products ADD COLUMN category VARCHAR(50) DEFAULT 'Прочее'"))
-        db.session.commit()
-        
-        logging.info("Столбец category успешно добавлен в таблицу products")
-        flash('База данных обновлена! Столбец category добавлен.', 'success')
-        return redirect(url_for('products'))
-        
-    except Exception as e:
-        logging.error(f"Ошибка при миграции БД: {str(e)}")
-        flash(f'Ошибка при обновлении БД: {str(e)}', 'danger')
-        return redirect(url_for('products'))
+    """Переводит продукты на таблицу категорий (раньше добавлял строковый столбец category)"""
+    global _category_migrated
+    _category_migrated = False
+    if migrate_products_category_id():
+        flash('База данных обновлена! Категории вынесены в отдельную таблицу.', 'success')
+    else:
+        flash('Ошибка при обновлении БД, подробности в журнале приложения', 'danger')
+    return redirect(url_for('products'))
 
 def create_tables():
     """Create database tables if they don't exist"""
@@ -2771,11 +5958,10 @@ def create_tables():
                     Product(name="Картофель", calories_per_100g=80, protein=2.0, carbs=16.3, fat=0.4, category="Овощи")
                 ]
                 
-                for product in default_products:
-                    db.session.add(product)
+                added_count = insert_missing_products(default_products)
                 
                 db.session.commit()
-                logging.info(f"Added {len(default_products)} default products")
+                logging.info(f"Added {added_count} default products")
                 
     except Exception as e:
         logging.error(f"Error creating database tables: {str(e)}")
@@ -2793,6 +5979,67 @@ def check_database_connection():
         logging.error(f"Database connection failed: {str(e)}")
         return False
 
+@app.route('/admin/slow_queries')
+@admin_required
+def admin_slow_queries():
+    """Просмотр журнала медленных запросов"""
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+    route = request.args.get('route', '')
+    records = read_slow_query_log(limit)
+    if route:
+        records = [r for r in records if r.get('route') == route]
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'threshold_ms': app.config['SLOW_QUERY_THRESHOLD_MS'], 'records': records})
+    
+    return render_template('slow_queries.html',
+                         records=records,
+                         route=route,
+                         threshold_ms=app.config['SLOW_QUERY_THRESHOLD_MS'])
+
+@app.route('/admin/indexes')
+@admin_required
+def admin_indexes():
+    """Статистика использования индексов (досоздание управляемых индексов - POST /admin/indexes/ensure)"""
+    try:
+        report = index_usage_report()
+        stats_reset = None
+        if db.engine.dialect.name == 'postgresql':
+            stats_reset = db.session.execute(text(
+                "SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()"
+            )).scalar()
+        return jsonify({
+            'success': True,
+            'stats_reset': stats_reset.isoformat() if stats_reset else None,
+            'managed': [spec['name'] for spec in MANAGED_INDEXES],
+            'unused': [row['index'] for row in report if row.get('unused')],
+            'indexes': report
+        })
+    except Exception as e:
+        logging.error(f"Index usage report failed: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/indexes/ensure', methods=['POST'])
+@admin_required
+def admin_ensure_indexes():
+    """Ставит в очередь досоздание управляемых индексов (CREATE INDEX CONCURRENTLY - только не из GET)"""
+    job = enqueue_job('ensure_indexes', created_by=session.get('username'))
+    return jsonify({'success': True, 'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+
+@job_handler('ensure_indexes')
+def ensure_indexes_job(report) -> dict:
+    """Досоздает недостающие и пересоздает невалидные управляемые индексы"""
+    report(message='Проверяем управляемые индексы')
+    status = ensure_managed_indexes(force=True)
+    if '_' in status:
+        return {'message': 'Индексы уже создает другой воркер', 'category': 'warning', 'indexes': status}
+    created = [name for name, state in status.items() if state == 'created']
+    failed = [name for name, state in status.items() if state.startswith(('error', 'skipped'))]
+    message = f'Индексы созданы: {", ".join(created)}' if created else 'Все управляемые индексы на месте'
+    if failed:
+        message += f'; не созданы: {", ".join(failed)}'
+    return {'message': message, 'category': 'warning' if failed else 'success', 'indexes': status}
+
 @app.route('/toggle_theme')
 @login_required
 def toggle_theme():
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк горячих запросов приложения с контролем планов выполнения.
+
+Для каждого запроса из app.py (записи за день, недельная статистика, поиск
+по словоформам, пагинация каталога, поиск дубликатов, обновление опыта)
+снимается план (EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) на PostgreSQL,
+EXPLAIN QUERY PLAN на SQLite) и медианное время нескольких прогонов.
+Основной поиск (/api/search_products) идет по индексу каталога в памяти:
+для него замеряется только время. Скрипт завершается с кодом 1,
+если запрос читает большую таблицу последовательным сканированием или не
+укладывается в бюджет времени.
+
+Примеры:
+    python benchmark_queries.py --seed-users 10000
+    python benchmark_queries.py --budget today_entries=5 --output results/bench-indexes.json
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import func, text, update
+
+from app import (app, db, UserLevel, PRODUCTS_PER_PAGE, daily_nutrient_totals_query,
+                 catalog_page_query, duplicate_report_query, entries_for_day_query,
+                 filtered_products_query, fulltext_products_query, search_catalog)
+
+# Бюджеты по умолчанию (мс, медиана прогонов)
+DEFAULT_BUDGETS_MS = {
+    'today_entries': 20,
+    'weekly_stats': 50,
+    'product_search': 50,
+    'product_fulltext': 50,
+    'products_page': 50,
+    'products_count': 50,
+    'duplicate_groups': 200,
+    'xp_lookup': 10,
+    'xp_update': 10,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк горячих запросов и их планов')
+    parser.add_argument('--seed-users', type=int, default=0,
+                        help='сгенерировать данные, если синтетических пользователей меньше этого числа')
+    parser.add_argument('--seed-days', type=int, default=365, help='длина истории при генерации')
+    parser.add_argument('--prefix', default='load_user_', help='префикс синтетических пользователей')
+    parser.add_argument('--repeat', type=int, default=5, help='прогонов каждого запроса')
+    parser.add_argument('--large-table-rows', type=int, default=10000,
+                        help='таблица считается большой начиная с этого числа строк')
+    parser.add_argument('--budget', action='append', default=[], metavar='NAME=MS',
+                        help='переопределить бюджет запроса (можно несколько раз)')
+    parser.add_argument('--search-term', default='кур', help='строка поиска продуктов')
+    parser.add_argument('--fulltext-term', default='курицу', help='строка полнотекстового поиска')
+    parser.add_argument('--output', default=None, help='файл результатов (по умолчанию results/bench-<время>.json)')
+    return parser.parse_args(argv)
+
+
+def is_postgres() -> bool:
+    return db.engine.dialect.name == 'postgresql'
+
+
+def compile_statement(statement):
+    """SQL и параметры в формате драйвера для EXPLAIN"""
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return str(compiled), params
+
+
+def table_sizes(conn, tables) -> dict:
+    sizes = {}
+    for table in tables:
+        if is_postgres():
+            # У секционированной таблицы (food_entries после секционирования) строки лежат в секциях
+            value = conn.execute(text("""
+                SELECT SUM(GREATEST(c.reltuples, 0))::bigint FROM pg_class c
+                WHERE c.relname = :t OR c.oid IN (
+                    SELECT i.inhrelid FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t
+                )
+            """), {'t': table}).scalar()
+        else:
+            value = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        sizes[table] = int(value or 0)
+    return sizes
+
+
+def postgres_plan(conn, statement):
+    sql, params = compile_statement(statement)
+    row = conn.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params).fetchone()
+    plan = row[0] if not isinstance(row[0], str) else json.loads(row[0])
+    return plan[0]
+
+
+def partition_parents(conn) -> dict:
+    """Секция -> родительская таблица (план называет сканируемую секцию, а не food_entries)"""
+    return dict(conn.execute(text("""
+        SELECT child.relname, parent.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    """)).all())
+
+
+def postgres_seq_scans(plan_node: dict, parents: dict = None) -> list:
+    """Таблицы, которые план читает последовательным сканированием (секции - под именем родителя)"""
+    parents = parents or {}
+    found = []
+    if plan_node.get('Node Type') == 'Seq Scan':
+        relation = plan_node.get('Relation Name')
+        found.append(parents.get(relation, relation))
+    for child in plan_node.get('Plans', []):
+        found.extend(postgres_seq_scans(child, parents))
+    return found
+
+
+def sqlite_plan(conn, statement):
+    sql, params = compile_statement(statement)
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def sqlite_seq_scans(plan_lines: list) -> list:
+    found = []
+    for detail in plan_lines:
+        words = detail.split()
+        if words and words[0] == 'SCAN' and 'USING' not in words:
+            found.append(words[2] if len(words) > 2 and words[1] == 'TABLE' else words[1])
+    return found
+
+
+def time_callable(function, repeat: int) -> list:
+    """Время вызова поиска в памяти; первый вызов строит индекс и не учитывается"""
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def time_statement(conn, statement, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = conn.execute(statement)
+        if result.returns_rows:
+            result.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def pick_context(conn, args) -> dict:
+    """Пользователь с историей, его последний день и категория для пагинации"""
+    user_id = conn.execute(text(
+        "SELECT id FROM users WHERE username LIKE :pattern ORDER BY id LIMIT 1"
+    ), {'pattern': f'{args.prefix}%'}).scalar()
+    if user_id is None:
+        user_id = conn.execute(text("SELECT user_id FROM food_entries ORDER BY id DESC LIMIT 1")).scalar()
+    if user_id is None:
+        raise RuntimeError('В базе нет записей дневника: запустите с --seed-users или generate_dataset.py')
+    last_day = conn.execute(text("SELECT MAX(date) FROM food_entries WHERE user_id = :u"), {'u': user_id}).scalar()
+    if isinstance(last_day, str):
+        last_day = dt.date.fromisoformat(last_day)
+    category = conn.execute(text(
+        "SELECT name FROM categories ORDER BY product_count DESC LIMIT 1"
+    )).scalar() or ''
+    return {'user_id': user_id, 'day': last_day or dt.date.today(), 'category': category}
+
+
+def hot_queries(ctx: dict, args) -> list:
+    """(имя, оператор или функция поиска в памяти, проверяемые таблицы) - те же построители, что и в маршрутах"""
+    day = ctx['day']
+    category_query = filtered_products_query('', ctx['category'])
+    return [
+        ('today_entries', entries_for_day_query(ctx['user_id'], day).statement, ['food_entries']),
+        ('weekly_stats', daily_nutrient_totals_query(ctx['user_id'], day - dt.timedelta(days=6), day), ['food_entries']),
+        ('product_search', lambda: search_catalog(args.search_term), []),
+        ('product_fulltext', fulltext_products_query(args.fulltext_term).limit(PRODUCTS_PER_PAGE).statement, ['products']),
+        ('products_page', catalog_page_query('', ctx['category'])
+            .limit(PRODUCTS_PER_PAGE).offset(PRODUCTS_PER_PAGE * 2).statement, ['products']),
+        ('products_count', category_query.statement.with_only_columns(func.count()).order_by(None), ['products']),
+        ('duplicate_groups', duplicate_report_query(), ['products']),
+        ('xp_lookup', UserLevel.query.filter_by(user_id=ctx['user_id']).statement, ['user_levels']),
+        ('xp_update', update(UserLevel).where(UserLevel.user_id == ctx['user_id']).values(
+            experience=UserLevel.experience + 10, updated_at=dt.datetime.utcnow()), ['user_levels']),
+    ]
+
+
+def run_benchmark(args) -> dict:
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for item in args.budget:
+        name, _, value = item.partition('=')
+        budgets[name] = float(value)
+
+    with app.app_context():
+        if args.seed_users:
+            existing = db.session.execute(text("SELECT COUNT(*) FROM users WHERE username LIKE :p"),
+                                          {'p': f'{args.prefix}%'}).scalar() or 0
+            if existing < args.seed_users:
+                import generate_dataset
+                generate_dataset.generate_dataset(generate_dataset.parse_args([
+                    '--users', str(args.seed_users - existing), '--days', str(args.seed_days), '--prefix', args.prefix
+                ]))
+            db.session.remove()
+
+        results = []
+        dialect = db.engine.dialect.name
+        with db.engine.connect() as conn:
+            conn.info['skip_slow_query_log'] = True
+            transaction = conn.begin()
+            try:
+                ctx = pick_context(conn, args)
+                sizes = table_sizes(conn, ['food_entries', 'products', 'user_levels', 'users'])
+                parents = partition_parents(conn) if is_postgres() else {}
+                for name, statement, tables in hot_queries(ctx, args):
+                    if callable(statement):
+                        plan, seq_scans = None, []
+                        timings = time_callable(statement, args.repeat)
+                    else:
+                        if is_postgres():
+                            plan = postgres_plan(conn, statement)
+                            seq_scans = postgres_seq_scans(plan['Plan'], parents)
+                        else:
+                            plan = sqlite_plan(conn, statement)
+                            seq_scans = sqlite_seq_scans(plan)
+                        timings = time_statement(conn, statement, args.repeat)
+                    median_ms = statistics.median(timings)
+
+                    failures = []
+                    for table in sorted(set(seq_scans) & set(tables)):
+                        if sizes.get(table, 0) >= args.large_table_rows:
+                            failures.append(f'последовательное сканирование {table} ({sizes[table]} строк)')
+                    budget = budgets.get(name)
+                    if budget is not None and median_ms > budget:
+                        failures.append(f'медиана {median_ms:.1f} мс больше бюджета {budget:g} мс')
+
+                    results.append({
+                        'name': name,
+                        'median_ms': round(median_ms, 3),
+                        'max_ms': round(max(timings), 3),
+                        'budget_ms': budget,
+                        'seq_scans': seq_scans,
+                        'failures': failures,
+                        'plan': plan,
+                    })
+            finally:
+                transaction.rollback()
+
+    return {
+        'meta': {
+            'dialect': dialect,
+            'started_at': dt.datetime.utcnow().isoformat(timespec='seconds'),
+            'repeat': args.repeat,
+            'large_table_rows': args.large_table_rows,
+            'context': {k: str(v) for k, v in ctx.items()},
+            'table_rows': sizes,
+        },
+        'queries': results,
+        'failed': [r['name'] for r in results if r['failures']],
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run_benchmark(args)
+
+    print(f"\n{'запрос':<18}{'медиана, мс':>13}{'бюджет':>9}  результат")
+    for row in report['queries']:
+        status = 'OK' if not row['failures'] else 'FAIL: ' + '; '.join(row['failures'])
+        budget = f"{row['budget_ms']:g}" if row['budget_ms'] is not None else '-'
+        print(f"{row['name']:<18}{row['median_ms']:>13.2f}{budget:>9}  {status}")
+
+    output = args.output or os.path.join('results', f"bench-{dt.datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\nРезультаты сохранены: {output}")
+
+    return 1 if report['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических данных для нагрузочного тестирования.
+
+Создает пользователей, профили, уровни, записи дневника за выбранный период
+и статистику продуктов пользователей (user_product_stats) пакетными вставками (COPY на PostgreSQL, многострочный INSERT на остальных БД).
+
+Пример:
+    python generate_dataset.py --users 100000 --days 730 --batch-size 20000
+"""
+import argparse
+import datetime as dt
+import logging
+import random
+import sys
+import time
+
+from sqlalchemy import insert, select, text
+from werkzeug.security import generate_password_hash
+
+from app import (app, db, User, UserProfile, UserLevel, FoodEntry, Product, UserProductStat, ENTRY_NUTRIENTS,
+                 auto_load_all_products, calculate_target_calories, entry_nutrients, product_usage_weight)
+
+MEAL_TYPES = ['завтрак', 'обед', 'ужин', 'перекус']
+# Вероятность приема пищи в активный день
+MEAL_PROBABILITY = {'завтрак': 0.85, 'обед': 0.9, 'ужин': 0.85, 'перекус': 0.5}
+ACTIVITY_LEVELS = ['sedentary', 'light', 'moderate', 'active', 'very_active']
+GOALS = ['lose', 'maintain', 'gain']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Генерация синтетических пользователей и дневников питания')
+    parser.add_argument('--users', type=int, default=1000, help='количество пользователей')
+    parser.add_argument('--days', type=int, default=365, help='длина истории дневника в днях')
+    parser.add_argument('--activity', type=float, default=0.7, help='доля дней с записями (0..1)')
+    parser.add_argument('--favorites', type=int, default=30, help='размер набора "любимых" продуктов пользователя')
+    parser.add_argument('--batch-size', type=int, default=10000, help='строк в одной пакетной вставке')
+    parser.add_argument('--prefix', default='load_user_', help='префикс логина синтетических пользователей')
+    parser.add_argument('--password', default='loadtest', help='пароль всех синтетических пользователей')
+    parser.add_argument('--seed', type=int, default=42, help='seed генератора случайных чисел')
+    parser.add_argument('--end-date', type=dt.date.fromisoformat, default=None,
+                        help='последний день истории (YYYY-MM-DD, по умолчанию сегодня)')
+    parser.add_argument('--reset', action='store_true', help='удалить ранее сгенерированных пользователей с этим префиксом')
+    return parser.parse_args(argv)
+
+
+def is_postgres() -> bool:
+    return db.engine.dialect.name == 'postgresql'
+
+
+def bulk_insert(table, rows: list):
+    """Пакетная вставка строк: COPY на PostgreSQL, executemany на остальных БД"""
+    if not rows:
+        return
+    if is_postgres():
+        columns = list(rows[0].keys())
+        raw = db.session.connection().connection.driver_connection
+        with raw.cursor() as cursor:
+            with cursor.copy(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row([row[c] for c in columns])
+    else:
+        db.session.execute(insert(table), rows)
+
+
+def reset_synthetic_users(prefix: str):
+    """Удаляет синтетических пользователей и все связанные с ними данные"""
+    pattern = {'pattern': f'{prefix}%'}
+    user_ids = "SELECT id FROM users WHERE username LIKE :pattern"
+    for table in ('food_entries', 'user_product_stats', 'user_profile', 'user_levels'):
+        db.session.execute(text(f"DELETE FROM {table} WHERE user_id IN ({user_ids})"), pattern)
+    deleted = db.session.execute(text("DELETE FROM users WHERE username LIKE :pattern"), pattern).rowcount
+    db.session.commit()
+    logging.info(f"Удалено синтетических пользователей: {deleted}")
+
+
+def generate_users(args, rng: random.Random) -> list:
+    """Создает пользователей пакетами и возвращает их id"""
+    password_hash = generate_password_hash(args.password)
+    created_at = dt.datetime.utcnow() - dt.timedelta(days=args.days)
+    existing = db.session.execute(
+        text("SELECT COUNT(*) FROM users WHERE username LIKE :pattern"), {'pattern': f'{args.prefix}%'}
+    ).scalar() or 0
+
+    batch = []
+    for i in range(existing, existing + args.users):
+        batch.append({
+            'username': f'{args.prefix}{i}',
+            'email': None,
+            'password_hash': password_hash,
+            'created_at': created_at
+        })
+        if len(batch) >= args.batch_size:
+            bulk_insert(User.__table__, batch)
+            batch = []
+    bulk_insert(User.__table__, batch)
+    db.session.commit()
+
+    rows = db.session.execute(
+        text("SELECT id FROM users WHERE username LIKE :pattern ORDER BY id"), {'pattern': f'{args.prefix}%'}
+    ).fetchall()
+    user_ids = [row[0] for row in rows][existing:]
+    logging.info(f"Создано пользователей: {len(user_ids)}")
+    return user_ids
+
+
+def generate_profiles(user_ids: list, args, rng: random.Random):
+    created_at = dt.datetime.utcnow()
+    batch = []
+    for user_id in user_ids:
+        gender = rng.choice(['male', 'female'])
+        age = rng.randint(18, 70)
+        height = round(rng.gauss(178 if gender == 'male' else 165, 7), 1)
+        weight = round(rng.gauss(82 if gender == 'male' else 66, 12), 1)
+        activity_level = rng.choice(ACTIVITY_LEVELS)
+        goal = rng.choice(GOALS)
+        batch.append({
+            'user_id': user_id,
+            'name': f'Тестовый пользователь {user_id}',
+            'age': age,
+            'gender': gender,
+            'weight': weight,
+            'height': height,
+            'activity_level': activity_level,
+            'goal': goal,
+            'target_calories': calculate_target_calories(gender, weight, height, age, activity_level, goal),
+            'created_at': created_at
+        })
+        if len(batch) >= args.batch_size:
+            bulk_insert(UserProfile.__table__, batch)
+            batch = []
+    bulk_insert(UserProfile.__table__, batch)
+    db.session.commit()
+    logging.info(f"Создано профилей: {len(user_ids)}")
+
+
+def generate_food_entries(user_ids: list, products: dict, args, rng: random.Random) -> dict:
+    """Создает записи дневника со снимком КБЖУ и статистику продуктов пользователей
+    (как record_product_usage); возвращает статистику активности по пользователям"""
+    product_ids = list(products)
+    end_date = args.end_date or dt.date.today()
+    start_date = end_date - dt.timedelta(days=args.days - 1)
+    activity = {}
+    batch = []
+    stats_batch = []
+    total = 0
+    started = time.perf_counter()
+
+    for n, user_id in enumerate(user_ids, 1):
+        favorites = rng.sample(product_ids, min(args.favorites, len(product_ids)))
+        usage = {}
+        entries_count = 0
+        active_days = 0
+        last_date = None
+        day = start_date
+        while day <= end_date:
+            if rng.random() < args.activity:
+                active_days += 1
+                last_date = day
+                for meal_type in MEAL_TYPES:
+                    if rng.random() >= MEAL_PROBABILITY[meal_type]:
+                        continue
+                    for _ in range(rng.randint(1, 3)):
+                        # 80% записей - из привычного набора продуктов пользователя
+                        product_id = rng.choice(favorites) if rng.random() < 0.8 else rng.choice(product_ids)
+                        weight = float(rng.choice([30, 50, 100, 150, 200, 250, 300]))
+                        created_at = dt.datetime.combine(day, dt.time(rng.randint(7, 22), rng.randint(0, 59)))
+                        batch.append({
+                            'user_id': user_id,
+                            'product_id': product_id,
+                            'weight': weight,
+                            'date': day,
+                            'meal_type': meal_type,
+                            'created_at': created_at,
+                            **entry_nutrients(products[product_id], weight)
+                        })
+                        entries_count += 1
+                        stat = usage.setdefault(product_id, {'user_id': user_id, 'product_id': product_id,
+                                                             'score': 0.0, 'uses': 0})
+                        stat['score'] += product_usage_weight(created_at)
+                        stat['uses'] += 1
+                        if created_at >= stat.get('last_used_at', created_at):
+                            stat['last_weight'], stat['last_used_at'] = weight, created_at
+                if len(batch) >= args.batch_size:
+                    bulk_insert(FoodEntry.__table__, batch)
+                    bulk_insert(UserProductStat.__table__, stats_batch)
+                    db.session.commit()
+                    total += len(batch)
+                    batch = []
+                    stats_batch = []
+            day += dt.timedelta(days=1)
+        # Пользователь новый, поэтому его строки статистики вставляются без upsert
+        stats_batch.extend(usage.values())
+        activity[user_id] = (entries_count, active_days, last_date)
+        if n % 1000 == 0:
+            rate = (total + len(batch)) / max(time.perf_counter() - started, 1e-9)
+            logging.info(f"Пользователей обработано: {n}/{len(user_ids)}, записей: {total + len(batch)} ({rate:.0f}/с)")
+
+    bulk_insert(FoodEntry.__table__, batch)
+    bulk_insert(UserProductStat.__table__, stats_batch)
+    db.session.commit()
+    total += len(batch)
+    logging.info(f"Создано записей дневника: {total}")
+    return activity
+
+
+def generate_levels(activity: dict, args):
+    """Уровни считаются так же, как в init_user_levels_for_existing_users"""
+    now = dt.datetime.utcnow()
+    batch = []
+    for user_id, (entries_count, active_days, last_date) in activity.items():
+        experience = (entries_count * 10) + (active_days * 25)
+        batch.append({
+            'user_id': user_id,
+            'level': max(1, experience // 100),
+            'experience': experience,
+            'total_food_entries': entries_count,
+            'total_products_added': 0,
+            'days_active': active_days,
+            'last_activity_date': last_date,
+            'achievements': '[]',
+            'created_at': now,
+            'updated_at': now
+        })
+        if len(batch) >= args.batch_size:
+            bulk_insert(UserLevel.__table__, batch)
+            batch = []
+    bulk_insert(UserLevel.__table__, batch)
+    db.session.commit()
+    logging.info(f"Создано записей уровней: {len(activity)}")
+
+
+def generate_dataset(args) -> dict:
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+
+    with app.app_context():
+        db.create_all()
+        if args.reset:
+            reset_synthetic_users(args.prefix)
+
+        if Product.query.count() == 0:
+            auto_load_all_products()
+        products = {row.id: row for row in db.session.execute(
+            select(Product.id, *[getattr(Product, source) for source in ENTRY_NUTRIENTS.values()]).order_by(Product.id)
+        )}
+        if not products:
+            raise RuntimeError('В базе нет продуктов для генерации дневников')
+
+        user_ids = generate_users(args, rng)
+        generate_profiles(user_ids, args, rng)
+        activity = generate_food_entries(user_ids, products, args, rng)
+        generate_levels(activity, args)
+
+        if is_postgres():
+            db.session.execute(text("ANALYZE users, user_profile, user_levels, food_entries, user_product_stats"))
+            db.session.commit()
+
+    summary = {
+        'users': len(user_ids),
+        'food_entries': sum(a[0] for a in activity.values()),
+        'products': len(products),
+        'seconds': round(time.perf_counter() - started, 1)
+    }
+    logging.info(f"Генерация завершена: {summary}")
+    return summary
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        generate_dataset(args)
+    except Exception as e:
+        logging.error(f"Ошибка генерации данных: {str(e)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
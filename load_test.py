@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест основных маршрутов приложения.
+
+Виртуальные пользователи (аккаунты из generate_dataset.py) параллельно входят
+в систему и выполняют сценарий: главная, форма и отправка add_food, быстрое
+добавление, статистика и поиск продуктов. По каждому маршруту считаются
+p50/p95/p99, результат сохраняется в JSON для сравнения прогонов.
+
+Примеры:
+    python load_test.py --base-url http://127.0.0.1:5000 --concurrency 20 --duration 60
+    python load_test.py --in-process --requests 50 --compare results/load-baseline.json
+"""
+import argparse
+import datetime as dt
+import http.cookiejar
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Сценарий: маршрут и его вес (частота) в смеси запросов
+SCENARIO = [
+    ('index', 30),
+    ('add_food_form', 10),
+    ('add_food_submit', 5),
+    ('quick_add_food', 20),
+    ('statistics', 10),
+    ('search', 25),
+]
+SEARCH_TERMS = ['хлеб', 'молоко', 'кур', 'сыр', 'яблоко', 'рис', 'греч', 'твор', 'суп', 'пицца', 'чай', 'мас']
+MEAL_TYPES = ['завтрак', 'обед', 'ужин', 'перекус']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест маршрутов приложения')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='адрес запущенного приложения')
+    parser.add_argument('--in-process', action='store_true', help='гонять запросы через Flask test client без HTTP')
+    parser.add_argument('--concurrency', type=int, default=10, help='число одновременных виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=0, help='длительность теста в секундах')
+    parser.add_argument('--requests', type=int, default=100, help='запросов на пользователя (если не задан --duration)')
+    parser.add_argument('--users', type=int, default=1000, help='сколько синтетических аккаунтов использовать')
+    parser.add_argument('--prefix', default='load_user_', help='префикс логина синтетических пользователей')
+    parser.add_argument('--password', default='loadtest', help='пароль синтетических пользователей')
+    parser.add_argument('--timeout', type=float, default=30, help='таймаут одного запроса в секундах')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='', help='метка прогона в результатах')
+    parser.add_argument('--output', default=None, help='файл результатов (по умолчанию results/load-<время>.json)')
+    parser.add_argument('--compare', default=None, help='файл прошлого прогона для сравнения')
+    return parser.parse_args(argv)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Редиректы не выполняются, чтобы измерять время каждого маршрута отдельно"""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    """HTTP-клиент одного виртуального пользователя со своими cookie"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def request(self, method: str, path: str, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class InProcessClient:
+    """Клиент поверх Flask test client (приложение импортируется в этот процесс)"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method: str, path: str, form=None, json_body=None):
+        response = self.client.open(path, method=method, data=form, json=json_body)
+        return response.status_code, response.get_data()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route: str, seconds: float, ok: bool):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds * 1000)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'errors': errors,
+        'rps': round(len(values) / elapsed, 2) if elapsed else 0,
+        'mean_ms': round(sum(values) / len(values), 2) if values else 0,
+        'p50_ms': round(percentile(values, 50), 2),
+        'p95_ms': round(percentile(values, 95), 2),
+        'p99_ms': round(percentile(values, 99), 2),
+        'max_ms': round(values[-1], 2) if values else 0,
+    }
+
+
+def timed(stats: Stats, client, route: str, method: str, path: str, ok_statuses=(200,), **kwargs):
+    started = time.perf_counter()
+    try:
+        status, body = client.request(method, path, **kwargs)
+        ok = status in ok_statuses
+    except Exception:
+        status, body, ok = None, b'', False
+    stats.record(route, time.perf_counter() - started, ok)
+    return status, body
+
+
+def virtual_user(worker: int, args, make_client, stats: Stats, deadline: float):
+    rng = random.Random(args.seed * 1000 + worker)
+    client = make_client()
+    username = f'{args.prefix}{rng.randrange(args.users)}'
+    status, _ = timed(stats, client, 'login', 'POST', '/login', ok_statuses=(302,),
+                      form={'username': username, 'password': args.password})
+    if status != 302:
+        logging.warning(f"Пользователь {username} не смог войти (статус {status})")
+        return
+
+    # Продукты для добавления берем из поиска, как это делает интерфейс
+    known_products = []
+    routes = [name for name, _ in SCENARIO]
+    weights = [weight for _, weight in SCENARIO]
+    done = 0
+    while (time.time() < deadline) if args.duration else (done < args.requests):
+        done += 1
+        route = rng.choices(routes, weights)[0]
+        today = dt.date.today().isoformat()
+        if route == 'index':
+            timed(stats, client, route, 'GET', '/')
+        elif route == 'add_food_form':
+            timed(stats, client, route, 'GET', '/add_food')
+        elif route == 'statistics':
+            timed(stats, client, route, 'GET', '/statistics')
+        elif route == 'search':
+            term = rng.choice(SEARCH_TERMS)
+            status, body = timed(stats, client, route, 'GET', '/api/search_products?' + urllib.parse.urlencode({'q': term}))
+            if status == 200:
+                try:
+                    known_products.extend(json.loads(body)[:5])
+                    del known_products[:-50]
+                except ValueError:
+                    pass
+        elif route == 'quick_add_food' and known_products:
+            product = rng.choice(known_products)
+            timed(stats, client, route, 'POST', '/api/quick_add_food', json_body={
+                'product_name': product['name'], 'weight': rng.choice([50, 100, 150, 200]),
+                'meal_type': rng.choice(MEAL_TYPES), 'date': today
+            })
+        elif route == 'add_food_submit' and known_products:
+            chosen = rng.sample(known_products, min(len(known_products), rng.randint(1, 3)))
+            timed(stats, client, route, 'POST', '/add_food', ok_statuses=(302,), form={
+                'meal_type': rng.choice(MEAL_TYPES), 'date': today,
+                'product_id[]': [str(p['id']) for p in chosen],
+                'weight[]': [str(rng.choice([50, 100, 150])) for _ in chosen]
+            })
+
+
+def compare_results(current: dict, baseline: dict):
+    """Печатает изменение перцентилей относительно прошлого прогона"""
+    print(f"\nСравнение с прогоном {baseline.get('meta', {}).get('label') or baseline.get('meta', {}).get('started_at')}:")
+    print(f"{'маршрут':<18}{'p50':>22}{'p95':>22}{'p99':>22}")
+    for route, now in current['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if not before:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            delta = ((now[key] - before[key]) / before[key] * 100) if before[key] else 0
+            cells.append(f"{before[key]:.1f}->{now[key]:.1f} ({delta:+.0f}%)")
+        print(f"{route:<18}" + ''.join(f"{c:>22}" for c in cells))
+
+
+def run(args) -> dict:
+    if args.in_process:
+        from app import app as flask_app
+        make_client = lambda: InProcessClient(flask_app)
+        target = 'in-process'
+    else:
+        make_client = lambda: HttpClient(args.base_url, args.timeout)
+        target = args.base_url
+
+    stats = Stats()
+    started_at = dt.datetime.utcnow()
+    started = time.perf_counter()
+    deadline = time.time() + args.duration
+    logging.info(f"Старт нагрузки: {target}, пользователей {args.concurrency}, "
+                 f"{'%.0f с' % args.duration if args.duration else '%d запросов на пользователя' % args.requests}")
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(virtual_user, i, args, make_client, stats, deadline) for i in range(args.concurrency)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [v for values in stats.latencies.values() for v in values]
+    return {
+        'meta': {
+            'label': args.label,
+            'target': target,
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'elapsed_s': round(elapsed, 2),
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'requests_per_user': None if args.duration else args.requests,
+            'users': args.users,
+        },
+        'routes': {route: summarize(values, stats.errors.get(route, 0), elapsed)
+                   for route, values in sorted(stats.latencies.items())},
+        'total': summarize(all_latencies, sum(stats.errors.values()), elapsed),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+
+    print(f"\n{'маршрут':<18}{'запросов':>10}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for route, row in list(results['routes'].items()) + [('ИТОГО', results['total'])]:
+        print(f"{route:<18}{row['count']:>10}{row['errors']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+    output = args.output or os.path.join('results', f"load-{dt.datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_results(results, json.load(f))
+
+    return 1 if results['total']['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
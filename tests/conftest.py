@@ -0,0 +1,68 @@
+"""
+Общие фикстуры тестов: приложение на временной базе SQLite.
+
+DATABASE_URL задается до импорта app, потому что модуль подключается к базе и создает таблицы при загрузке.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix='calckal-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ['WRITE_BEHIND_ENABLED'] = '0'
+os.environ['SLOW_QUERY_LOG_PATH'] = os.path.join(_db_dir, 'slow_queries.log')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as calckal  # noqa: E402
+
+
+@pytest.fixture
+def ctx():
+    with calckal.app.app_context():
+        yield
+        calckal.db.session.remove()
+
+
+@pytest.fixture
+def client():
+    """Клиент с новым вошедшим пользователем; id пользователя - в client.user_id"""
+    client = calckal.app.test_client()
+    username = f'user_{uuid.uuid4().hex[:12]}'
+    response = client.post('/register', data={'username': username, 'password': '1234', 'confirm_password': '1234'})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        client.user_id = session['user_id']
+    return client
+
+
+@pytest.fixture
+def products():
+    """Три продукта с уникальными названиями: {'apple': id, 'milk': id, 'bread': id}"""
+    suffix = uuid.uuid4().hex[:8]
+    specs = {
+        'apple': (f'Яблоко {suffix}', 47, 0.4, 9.8, 0.4, 'Фрукты'),
+        'milk': (f'Молоко {suffix}', 60, 2.9, 4.7, 3.2, 'Молочные'),
+        'bread': (f'Хлеб {suffix}', 265, 8.1, 48.8, 3.2, 'Хлебобулочные'),
+    }
+    with calckal.app.app_context():
+        created = {key: calckal.Product(name=name, calories_per_100g=kcal, protein=protein, carbs=carbs, fat=fat,
+                                        category=category)
+                   for key, (name, kcal, protein, carbs, fat, category) in specs.items()}
+        calckal.db.session.add_all(created.values())
+        calckal.db.session.commit()
+        ids = {key: product.id for key, product in created.items()}
+        calckal.db.session.remove()
+    return ids
+
+
+@pytest.fixture
+def user_entries(ctx):
+    """Функция: (дата, прием пищи, product_id, вес) записей пользователя в порядке добавления"""
+    def load(user_id: int) -> list:
+        calckal.db.session.expire_all()
+        return [(row.date.isoformat(), row.meal_type, row.product_id, row.weight)
+                for row in calckal.FoodEntry.query.filter_by(user_id=user_id).order_by(calckal.FoodEntry.id)]
+    return load
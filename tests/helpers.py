@@ -0,0 +1,16 @@
+"""Общие помощники тестов дневника"""
+import app as calckal
+
+DAY = '2026-03-10'
+NEXT_DAY = '2026-03-11'
+
+
+def quick_add(client, product_id, key=None, **fields):
+    body = {'product_id': product_id, 'weight': 100, 'meal_type': 'обед', 'date': DAY, **fields}
+    headers = {'Idempotency-Key': key} if key else {}
+    return client.post('/api/quick_add_food', json=body, headers=headers)
+
+
+def experience(user_id: int) -> int:
+    calckal.db.session.expire_all()
+    return calckal.UserLevel.query.filter_by(user_id=user_id).first().experience
@@ -0,0 +1,29 @@
+"""Пакетное добавление записей дневника: одна вставка и ошибки по строкам"""
+from helpers import DAY, experience
+
+
+def test_bulk_add_reports_errors_per_row(client, products, user_entries):
+    rows = [
+        {'product_id': products['apple'], 'weight': 120, 'meal_type': 'завтрак', 'date': DAY},
+        {'product_id': 10 ** 9, 'weight': 100, 'meal_type': 'обед', 'date': DAY},
+        {'product_id': products['milk'], 'weight': -5, 'meal_type': 'обед', 'date': DAY},
+        {'product_id': products['bread'], 'weight': 30, 'meal_type': 'ужин', 'date': DAY},
+        'не объект',
+    ]
+    response = client.post('/api/food_entries/bulk', json=rows)
+    data = response.get_json()
+    
+    assert response.status_code == 207
+    assert [row['index'] for row in data['created']] == [0, 3]
+    assert [row['index'] for row in data['errors']] == [1, 2, 4]
+    assert user_entries(client.user_id) == [(DAY, 'завтрак', products['apple'], 120.0),
+                                            (DAY, 'ужин', products['bread'], 30.0)]
+    assert experience(client.user_id) == 20
+
+
+def test_bulk_add_without_valid_rows_is_rejected(client, products, user_entries):
+    response = client.post('/api/food_entries/bulk', json=[{'product_id': products['apple'], 'weight': 0,
+                                                            'meal_type': 'обед', 'date': DAY}])
+    
+    assert response.status_code == 400
+    assert user_entries(client.user_id) == []
@@ -0,0 +1,45 @@
+"""Журнал изменений каталога: /api/catalog/changes для клиентов с локальной копией"""
+import app as calckal
+
+
+def changes(client, since: int) -> dict:
+    response = client.get(f'/api/catalog/changes?since={since}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_changes_since_zero_lists_whole_catalog(client, products, ctx):
+    data = changes(client, 0)
+    
+    assert data['reset'] is False
+    assert data['version'] == calckal.get_catalog_version()
+    assert set(products.values()) <= {row['id'] for row in data['upserted']}
+
+
+def test_changes_since_version_are_incremental(client, products, ctx):
+    version = changes(client, 0)['version']
+    assert changes(client, version)['upserted'] == []
+    
+    product = calckal.db.session.get(calckal.Product, products['apple'])
+    product.calories_per_100g = 52
+    calckal.db.session.delete(calckal.db.session.get(calckal.Product, products['bread']))
+    calckal.db.session.commit()
+    
+    data = changes(client, version)
+    assert data['version'] > version
+    assert [(row['id'], row['kcal']) for row in data['upserted']] == [(products['apple'], 52.0)]
+    assert data['deleted'] == [products['bread']]
+
+
+def test_changes_since_before_log_start_require_reset(client, products, ctx):
+    version = changes(client, 0)['version']
+    calckal.db.session.execute(calckal.text("UPDATE catalog_state SET changes_floor = :v WHERE id = 1"), {'v': version})
+    calckal.db.session.commit()
+    try:
+        data = changes(client, version - 1)
+        assert data['reset'] is True
+        assert data['bundle_url']
+        assert changes(client, version)['reset'] is False
+    finally:
+        calckal.db.session.execute(calckal.text("UPDATE catalog_state SET changes_floor = 0 WHERE id = 1"))
+        calckal.db.session.commit()
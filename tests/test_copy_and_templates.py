@@ -0,0 +1,60 @@
+"""Копирование дня и шаблоны приемов пищи"""
+import app as calckal
+from helpers import DAY, NEXT_DAY, quick_add
+
+
+def test_copy_day_and_single_meal(client, products, user_entries):
+    quick_add(client, products['apple'], meal_type='завтрак', weight=150)
+    quick_add(client, products['milk'], meal_type='обед', weight=200)
+    
+    response = client.post('/copy_entries', data={'source_date': DAY, 'target_date': NEXT_DAY})
+    assert response.status_code == 302
+    response = client.post('/copy_entries', data={'source_date': DAY, 'target_date': '2026-03-12', 'meal_type': 'обед'})
+    assert response.status_code == 302
+    
+    entries = user_entries(client.user_id)
+    assert entries[2:] == [(NEXT_DAY, 'завтрак', products['apple'], 150.0),
+                           (NEXT_DAY, 'обед', products['milk'], 200.0),
+                           ('2026-03-12', 'обед', products['milk'], 200.0)]
+    copied = calckal.FoodEntry.query.filter_by(user_id=client.user_id, date=calckal.dt.date(2026, 3, 11),
+                                               meal_type='завтрак').one()
+    assert copied.calories == 70.5
+
+
+def test_copy_day_replay_does_not_duplicate(client, products, user_entries):
+    quick_add(client, products['apple'])
+    form = {'source_date': DAY, 'target_date': NEXT_DAY, 'idempotency_key': 'copy-1'}
+    client.post('/copy_entries', data=form)
+    replay = client.post('/copy_entries', data=form)
+    
+    assert replay.headers.get('Idempotent-Replayed') == 'true'
+    assert len(user_entries(client.user_id)) == 2
+
+
+def test_meal_template_apply(client, products, user_entries):
+    quick_add(client, products['apple'], meal_type='завтрак', weight=150)
+    quick_add(client, products['bread'], meal_type='завтрак', weight=40)
+    
+    response = client.post('/meal_templates', data={'name': 'Мой завтрак', 'meal_type': 'завтрак', 'date': DAY})
+    assert response.status_code == 302
+    template = calckal.MealTemplate.query.filter_by(user_id=client.user_id, name='Мой завтрак').one()
+    assert [(item.product_id, item.weight) for item in template.items] == [(products['apple'], 150.0),
+                                                                            (products['bread'], 40.0)]
+    
+    response = client.post(f'/meal_templates/{template.id}/apply', data={'date': NEXT_DAY, 'meal_type': 'перекус'})
+    assert response.status_code == 302
+    assert user_entries(client.user_id)[2:] == [(NEXT_DAY, 'перекус', products['apple'], 150.0),
+                                                (NEXT_DAY, 'перекус', products['bread'], 40.0)]
+
+
+def test_meal_template_of_other_user_is_not_applied(client, products, user_entries):
+    quick_add(client, products['apple'], meal_type='завтрак')
+    client.post('/meal_templates', data={'name': 'Чужой', 'meal_type': 'завтрак', 'date': DAY})
+    template = calckal.MealTemplate.query.filter_by(user_id=client.user_id, name='Чужой').one()
+    
+    other = calckal.app.test_client()
+    other.post('/register', data={'username': f'other_{template.id}', 'password': '1234', 'confirm_password': '1234'})
+    response = other.post(f'/meal_templates/{template.id}/apply', data={'date': NEXT_DAY})
+    
+    assert response.status_code == 404
+    assert len(user_entries(client.user_id)) == 1
@@ -0,0 +1,21 @@
+"""Идемпотентные повторы записи дневника по заголовку Idempotency-Key"""
+from helpers import DAY, experience, quick_add
+
+
+def test_idempotent_replay_returns_stored_response(client, products, user_entries):
+    first = quick_add(client, products['apple'], key='add-1')
+    replay = quick_add(client, products['apple'], key='add-1')
+    
+    assert first.status_code == replay.status_code == 200
+    assert replay.headers.get('Idempotent-Replayed') == 'true'
+    assert replay.get_json()['entry_id'] == first.get_json()['entry_id']
+    assert user_entries(client.user_id) == [(DAY, 'обед', products['apple'], 100.0)]
+    assert experience(client.user_id) == 10
+
+
+def test_idempotency_key_reused_for_other_body_is_rejected(client, products, user_entries):
+    quick_add(client, products['apple'], key='add-2')
+    response = quick_add(client, products['apple'], key='add-2', weight=250)
+    
+    assert response.status_code == 422
+    assert len(user_entries(client.user_id)) == 1
@@ -0,0 +1,29 @@
+"""Слияние дубликатов продуктов: перенос записей, шаблонов и статистики, доступ только администраторам"""
+import app as calckal
+
+
+def test_merge_products_into_moves_entries_templates_and_stats(client, products, ctx):
+    keep, loser = products['apple'], products['milk']
+    for product_id in (keep, loser, loser):
+        client.post('/api/quick_add_food', json={'product_id': product_id, 'weight': 100, 'meal_type': 'обед',
+                                                 'date': '2026-03-10'})
+    client.post('/meal_templates', data={'name': 'Обед', 'meal_type': 'обед', 'date': '2026-03-10'})
+    
+    moved = calckal.merge_products_into({loser: keep})
+    calckal.db.session.commit()
+    
+    assert moved == 2
+    assert calckal.db.session.get(calckal.Product, loser) is None
+    entries = calckal.FoodEntry.query.filter_by(user_id=client.user_id).all()
+    assert {entry.product_id for entry in entries} == {keep}
+    template = calckal.MealTemplate.query.filter_by(user_id=client.user_id).one()
+    assert {item.product_id for item in template.items} == {keep}
+    stats = calckal.UserProductStat.query.filter_by(user_id=client.user_id).all()
+    assert [(stat.product_id, stat.uses) for stat in stats] == [(keep, 3)]
+
+
+def test_merge_products_route_requires_admin(client, products, ctx):
+    response = client.post('/merge_products', data={'keep_id': products['apple'], 'product_id[]': [products['milk']]})
+    
+    assert response.status_code == 302
+    assert calckal.db.session.get(calckal.Product, products['milk']) is not None
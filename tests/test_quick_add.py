@@ -0,0 +1,51 @@
+"""Быстрое добавление: поиск продукта в снимке каталога по id и по названию"""
+import app as calckal
+
+
+def test_resolve_catalog_product_by_id_and_name(products, ctx):
+    by_id = calckal.resolve_catalog_product(product_id=products['milk'])
+    assert by_id['id'] == products['milk']
+    
+    by_name = calckal.resolve_catalog_product(name='  ' + by_id['name'].upper().replace(' ', '  ') + ' ')
+    assert by_name['id'] == products['milk']
+    
+    assert calckal.resolve_catalog_product(product_id=10 ** 9) is None
+    assert calckal.resolve_catalog_product(name='нет такого продукта') is None
+
+
+def test_quick_add_by_product_id(client, products, ctx):
+    response = client.post('/api/quick_add_food', json={'product_id': products['bread'], 'weight': 50,
+                                                        'meal_type': 'завтрак', 'date': '2026-03-10'})
+    data = response.get_json()
+    
+    assert data['success'] is True
+    assert data['product_id'] == products['bread']
+    entry = calckal.db.session.get(calckal.FoodEntry, data['entry_id'])
+    assert (entry.product_id, entry.weight, entry.calories) == (products['bread'], 50.0, 132.5)
+    assert client.post('/api/quick_add_food', json={'product_id': 'x', 'weight': 50, 'meal_type': 'обед',
+                                                    'date': '2026-03-10'}).get_json()['success'] is False
+
+
+def test_quick_add_with_stale_catalog_rereads_product(client, products, ctx, monkeypatch):
+    stale = dict(calckal.get_catalog_by_id())
+    calckal.merge_products_into({products['milk']: products['apple']})
+    calckal.db.session.commit()
+    # Снимок другого процесса, который еще не увидел слияние
+    monkeypatch.setattr(calckal, 'get_catalog_by_id', lambda: stale)
+    
+    def enforce_foreign_keys(connection, record):
+        connection.execute('PRAGMA foreign_keys = ON')
+    
+    calckal.event.listen(calckal.db.engine, 'connect', enforce_foreign_keys)
+    calckal.db.session.remove()
+    calckal.db.engine.dispose()
+    try:
+        data = client.post('/api/quick_add_food', json={'product_id': products['milk'], 'weight': 100,
+                                                        'meal_type': 'обед', 'date': '2026-03-10'}).get_json()
+    finally:
+        calckal.event.remove(calckal.db.engine, 'connect', enforce_foreign_keys)
+        calckal.db.session.remove()
+        calckal.db.engine.dispose()
+    
+    assert data == {'success': False, 'message': f'Продукт {products["milk"]} не найден'}
+    assert calckal.FoodEntry.query.filter_by(user_id=client.user_id).count() == 0
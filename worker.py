@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Воркер фоновых задач.
+
+Разбирает очередь таблицы jobs (загрузка продуктов, очистка дубликатов,
+миграции), которую наполняют административные маршруты приложения. На
+PostgreSQL можно запускать несколько воркеров: задачи забираются через
+FOR UPDATE SKIP LOCKED. Между задачами выполняется обслуживание: сжатие
+журнала изменений каталога и очистка ключей идемпотентности. По SIGTERM
+воркер дорабатывает текущую задачу и завершается.
+
+Примеры:
+    python worker.py
+    python worker.py --once
+    python worker.py --poll-interval 5
+"""
+import argparse
+import logging
+import signal
+import sys
+import threading
+
+from app import app, job_worker_id, work_jobs
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Воркер фоновых задач')
+    parser.add_argument('--poll-interval', type=float, default=app.config['JOB_POLL_INTERVAL'],
+                        help='пауза между опросами пустой очереди, секунд')
+    parser.add_argument('--once', action='store_true', help='выполнить накопившиеся задачи и выйти')
+    parser.add_argument('--worker-id', default=None, help='имя воркера в jobs.locked_by (по умолчанию хост:pid)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    worker_id = args.worker_id or job_worker_id()
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info(f"Получен сигнал {signum}, воркер завершится после текущей задачи")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logging.info(f"Воркер {worker_id} запущен")
+    processed = work_jobs(worker_id, stop, args.poll_interval, exit_when_idle=args.once)
+    logging.info(f"Воркер {worker_id} остановлен, выполнено задач: {processed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())